@@ -1,19 +1,22 @@
 import sys
 from PySide6.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QSizePolicy, QDialog
 from PySide6.QtWidgets import QCalendarWidget, QListWidget, QPushButton, QLabel
-from PySide6.QtWidgets import QListWidgetItem, QMessageBox,  QSpacerItem
+from PySide6.QtWidgets import QListWidgetItem, QMessageBox,  QSpacerItem, QCheckBox, QAbstractItemView
 from PySide6.QtCore import Qt, QDate
-from PySide6.QtGui import QFont
+from PySide6.QtGui import QFont, QShortcut, QKeySequence
 from datetime import datetime
-import xml.etree.ElementTree as ET
 import os
-import glob
 
 from test_event_creation import EventDialog
 from test_schedule_system import CreateScheduleDialog
 from test_zone import ListItemWidget
 from test_timeline_view import WeeklyScheduleView
 from test_event_infor import EventInfor
+from test_schedule_store import schedule_repository
+from test_snapshot import schedule_snapshot
+from test_background import BackgroundLoader
+from test_schedule_watcher import ScheduleWatcher
+from test_diagnostics import DiagnosticsPanel
 
 class CalendarView(QMainWindow):
     def __init__(self):
@@ -23,6 +26,9 @@ class CalendarView(QMainWindow):
     def initUI(self):
         self.setGeometry(100, 100, 1100, 650)
         self.current_schedule_path = None
+        # 叠加模式下同时显示的多个日程文件路径
+        self.overlay_schedule_paths = []
+        self.schedule_loader = BackgroundLoader(self)
         self.setWindowTitle('Building Management System')
 
         # 创建水平布局
@@ -54,6 +60,11 @@ class CalendarView(QMainWindow):
         new_schedule_button.clicked.connect(self.on_new_schedule_button_clicked)  # 绑定事件处理器
         my_schedule_layout.addWidget(new_schedule_button)
 
+        # 叠加模式：在列表中选择多个日程，同时显示在时间线上
+        self.overlay_checkbox = QCheckBox('Overlay')
+        self.overlay_checkbox.toggled.connect(self.on_overlay_toggled)
+        my_schedule_layout.addWidget(self.overlay_checkbox)
+
         # 将“My Schedule”布局添加到左侧布局
         left_vbox.addLayout(my_schedule_layout)
 
@@ -61,6 +72,7 @@ class CalendarView(QMainWindow):
         self.schedule_list = QListWidget()
         self.schedule_list.setStyleSheet("QListWidget {border: 1px solid black;}")
         self.schedule_list.itemClicked.connect(self.on_schedule_item_clicked) 
+        self.schedule_list.itemSelectionChanged.connect(self.on_schedule_selection_changed)
         left_vbox.addWidget(self.schedule_list)
 
         # 创建时间线视图上方的水平布局
@@ -98,8 +110,16 @@ class CalendarView(QMainWindow):
         timeline_widget = QWidget()
         timeline_widget.setLayout(timeline_vbox)
 
-        # 加载现有的日程到"My Schedule"列表
+        # 先读取二进制快照，再加载现有的日程到"My Schedule"列表
+        schedule_repository.ensure_dir()
+        schedule_snapshot.load()
         self.loadSchedules()
+        schedule_snapshot.refresh_in_background()
+
+        # 监视日程文件夹，其他程序修改日程文件后增量刷新
+        self.schedule_watcher = ScheduleWatcher(schedule_repository, self)
+        self.schedule_watcher.schedules_changed.connect(self.on_schedules_changed)
+        self.schedule_watcher.start()
 
         # 将左侧和中间的布局添加到水平布局
         hbox.addLayout(left_vbox, 1)
@@ -110,6 +130,10 @@ class CalendarView(QMainWindow):
         central_widget.setLayout(hbox)
         self.setCentralWidget(central_widget)
 
+        # 隐藏的诊断面板，用于现场排查慢操作
+        self.diagnostics_panel = None
+        QShortcut(QKeySequence('Ctrl+Shift+D'), self, self.show_diagnostics)
+
     def on_today_button_clicked(self):
         current_date = QDate.currentDate()  # 获取当前日期
         self.updateTimeline(current_date)
@@ -118,8 +142,13 @@ class CalendarView(QMainWindow):
         # 计算所选日期所在周的周一日期
         week_start_date = date.addDays(-date.dayOfWeek() + 1)
 
-        # 如果当前有选中的日程文件路径，则加载该日程中的事件
-        if self.current_schedule_path:
+        # 叠加模式下加载所有选中的日程，否则加载当前选中的日程
+        if self.overlay_checkbox.isChecked():
+            if self.overlay_schedule_paths:
+                self.timeline_view.loadOverlay(self.overlay_schedule_paths, week_start_date)
+            else:
+                self.timeline_view.clearEvents()
+        elif self.current_schedule_path:
             self.timeline_view.loadEventsFromXML(self.current_schedule_path, week_start_date)
         else:
             # 如果没有选中的日程，则清空时间线
@@ -127,8 +156,7 @@ class CalendarView(QMainWindow):
 
     def on_new_event_button_clicked(self):
         # 检查是否存在日程
-        schedules_dir = 'Schedules'
-        if not glob.glob(os.path.join(schedules_dir, '*.xml')):
+        if not schedule_repository.list_schedule_files():
             QMessageBox.warning(self, "Warning", "You haven't created a schedule yet. \nPlease create a schedule before adding events.")
         else:
             dialog = EventDialog(self)
@@ -139,8 +167,10 @@ class CalendarView(QMainWindow):
                 pass
     
     def on_event_created(self, event_date):
-        self.timeline_view.setWeekFromDate(event_date)
-        self.refreshEvents(event_date)
+        # 新事件已由时间线增量加入，只有不在当前周时才切换到该周
+        if event_date.addDays(-event_date.dayOfWeek() + 1) != self.timeline_view.weekStartDate():
+            self.timeline_view.setWeekFromDate(event_date)
+            self.refreshEvents(event_date)
 
     def updateTimeline(self, date):
         # 当日历中的日期被点击时，更新时间线视图
@@ -186,7 +216,38 @@ class CalendarView(QMainWindow):
         if dialog.exec() == QDialog.Accepted and dialog.operation_successful:
             pass
 
+    def on_overlay_toggled(self, checked):
+        # 切换单选和多选，当前选中的日程作为叠加的第一个日程
+        self.schedule_list.setSelectionMode(QAbstractItemView.MultiSelection if checked else QAbstractItemView.SingleSelection)
+        if not checked:
+            self.overlay_schedule_paths = []
+            current = self.schedule_list.currentItem()
+            self.schedule_list.clearSelection()
+            if current is not None:
+                current.setSelected(True)
+        else:
+            self.on_schedule_selection_changed()
+        self.refreshEvents(self.timeline_view.weekStartDate())
+
+    def on_schedule_selection_changed(self):
+        if not self.overlay_checkbox.isChecked():
+            return
+        # 按列表中的顺序叠加，颜色分配保持稳定
+        paths = []
+        for row in range(self.schedule_list.count()):
+            item = self.schedule_list.item(row)
+            item_widget = self.schedule_list.itemWidget(item)
+            if item.isSelected() and item_widget:
+                paths.append(item_widget.schedule_file)
+        if paths != self.overlay_schedule_paths:
+            self.overlay_schedule_paths = paths
+            self.refreshEvents(self.timeline_view.weekStartDate())
+
     def on_schedule_item_clicked(self, item):
+        # 叠加模式下由选择变化处理
+        if self.overlay_checkbox.isChecked():
+            return
+
         # 获取被点击的日程项对应的ListItemWidget
         item_widget = self.schedule_list.itemWidget(item)
 
@@ -195,54 +256,86 @@ class CalendarView(QMainWindow):
             self.current_schedule_path = item_widget.schedule_file
 
             # 获取当前时间线视图的周开始日期
-            week_start_date_str = self.timeline_view.tableWidget.horizontalHeaderItem(0).text().split('\n')[1]
-            # 获取当前年份
-            current_year = QDate.currentDate().year()
-            # 将年份添加到日期字符串中
-            full_date_str = f"{week_start_date_str}/{current_year}"
-            # 转换为QDate对象
-            week_start_date = QDate.fromString(full_date_str, 'dd/MM/yyyy')
+            week_start_date = self.timeline_view.weekStartDate()
 
             # 调用refreshEvents来更新视图
             self.refreshEvents(week_start_date)
 
     def getBuildingNameFromSchedule(self, schedule_file):
-        tree = ET.parse(schedule_file)
-        root = tree.getroot()
-        building_element = root.find('.//building')
-        if building_element is not None:
-            return building_element.get('ID', '')  # 返回Building ID属性
-        return ''
+        return schedule_repository.building_id(schedule_file)  # 返回Building ID属性
     
     def loadSchedules(self):
 
         self.schedule_list.clear()
 
-        # 设置存储日程的文件夹
-        schedules_dir = 'Schedules'
-        
         # 检查"Schedules"文件夹是否存在，如果不存在则创建
-        if not os.path.isdir(schedules_dir):
-            os.makedirs(schedules_dir)
-        
-        # 读取"Schedules"文件夹中的所有XML文件
-        schedule_files = glob.glob(os.path.join(schedules_dir, '*.xml'))
+        schedule_repository.ensure_dir()
         
-        for filepath in schedule_files:
-            schedule_name = os.path.splitext(os.path.basename(filepath))[0]
-            building_name = self.getBuildingNameFromSchedule(filepath)  # 获取Building名称
-            display_name = f"{schedule_name} - {building_name}" 
-            item_widget = ListItemWidget(display_name, filepath)
-            item_widget.removed.connect(self.remove_schedule)  # 连接信号到槽函数
-            item = QListWidgetItem(self.schedule_list)
-            item.setSizeHint(item_widget.sizeHint())
-            self.schedule_list.addItem(item)
-            self.schedule_list.setItemWidget(item, item_widget) 
+        # 在工作线程中读取所有日程的 Building 名称，完成后再填充列表
+        self.schedule_loader.submit(self.readScheduleList, on_result=self.showScheduleList)
 
         # 加载事件到时间线
         current_date = QDate.currentDate()  # 获取当前日期
         self.refreshEvents(current_date)  # 使用当前日期刷新事件
         self.updateLabel(current_date)
+
+    def scheduleDisplayName(self, filepath):
+        schedule_name = os.path.splitext(os.path.basename(filepath))[0]
+        building_name = self.getBuildingNameFromSchedule(filepath)  # 获取Building名称
+        return f"{schedule_name} - {building_name}"
+
+    def readScheduleList(self):
+        # 读取"Schedules"文件夹中的所有XML文件
+        return [(filepath, self.scheduleDisplayName(filepath)) for filepath in schedule_repository.list_schedule_files()]
+
+    def showScheduleList(self, schedule_list):
+        self.schedule_list.clear()
+        for filepath, display_name in schedule_list:
+            self.addScheduleItem(filepath, display_name)
+
+    def addScheduleItem(self, filepath, display_name):
+        item_widget = ListItemWidget(display_name, filepath)
+        item_widget.removed.connect(self.remove_schedule)  # 连接信号到槽函数
+        item = QListWidgetItem(self.schedule_list)
+        item.setSizeHint(item_widget.sizeHint())
+        self.schedule_list.addItem(item)
+        self.schedule_list.setItemWidget(item, item_widget)
+
+    def findScheduleItem(self, filepath):
+        for row in range(self.schedule_list.count()):
+            item = self.schedule_list.item(row)
+            item_widget = self.schedule_list.itemWidget(item)
+            if item_widget and os.path.normpath(item_widget.schedule_file) == os.path.normpath(filepath):
+                return item, item_widget
+        return None, None
+
+    def on_schedules_changed(self, added, removed, modified):
+        # 其他程序修改了日程文件：只更新受影响的列表项，当前日程变化时只重新加载当前周
+        current = os.path.normpath(self.current_schedule_path) if self.current_schedule_path else None
+        for filepath in removed:
+            item, _ = self.findScheduleItem(filepath)
+            if item is not None:
+                self.schedule_list.takeItem(self.schedule_list.row(item))
+        for filepath in modified:
+            _, item_widget = self.findScheduleItem(filepath)
+            if item_widget is not None:
+                item_widget.label.setText(self.scheduleDisplayName(filepath))
+        for filepath in added:
+            if self.findScheduleItem(filepath)[0] is None:
+                self.addScheduleItem(filepath, self.scheduleDisplayName(filepath))
+
+        if self.overlay_checkbox.isChecked():
+            overlay = [os.path.normpath(path) for path in self.overlay_schedule_paths]
+            if any(path in overlay for path in removed):
+                # 删除的日程已从列表中移除，重新读取选择
+                self.on_schedule_selection_changed()
+            elif any(path in overlay for path in modified):
+                self.refreshEvents(self.timeline_view.weekStartDate())
+        elif current in removed:
+            self.current_schedule_path = None
+            self.timeline_view.clearEvents()
+        elif current in modified:
+            self.refreshEvents(self.timeline_view.weekStartDate())
         
     def remove_schedule(self, schedule_label):
         # 使用 split() 方法分割字符串，以 " - " 作为分隔符
@@ -256,6 +349,18 @@ class CalendarView(QMainWindow):
         # 重新加载或更新日程列表
         self.loadSchedules()
 
+    def show_diagnostics(self):
+        if self.diagnostics_panel is None:
+            self.diagnostics_panel = DiagnosticsPanel(self)
+        self.diagnostics_panel.show()
+        self.diagnostics_panel.raise_()
+
+    def closeEvent(self, event):
+        # 退出前将未合并的日志写回日程文件
+        schedule_repository.compact_all()
+        schedule_snapshot.flush()
+        super().closeEvent(event)
+
 def main():
     app = QApplication(sys.argv)
 
@@ -0,0 +1,66 @@
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+class LoadSignals(QObject):
+    # 工作线程通过信号把结果送回界面线程
+    finished = Signal(int, object)
+    failed = Signal(int, object)
+
+
+class LoadTask(QRunnable):
+    def __init__(self, loader, generation, func, args):
+        super().__init__()
+        self.loader = loader
+        self.generation = generation
+        self.func = func
+        self.args = args
+        self.signals = LoadSignals()
+
+    def run(self):
+        # 开始执行前请求已经过期（用户已切换到其他周或日程）则直接放弃
+        if self.generation != self.loader.generation:
+            return
+        try:
+            result = self.func(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, e)
+            return
+        self.signals.finished.emit(self.generation, result)
+
+
+class BackgroundLoader(QObject):
+    # 在线程池中执行解析、建立索引和展开重复事件等耗时操作。
+    # 每次提交都会使之前的请求过期，过期请求的结果不会交给回调
+    def __init__(self, parent=None, pool=None):
+        super().__init__(parent)
+        self.pool = pool or QThreadPool.globalInstance()
+        self.generation = 0
+        self.callbacks = {}
+
+    def submit(self, func, *args, on_result=None, on_error=None):
+        self.cancel()
+        generation = self.generation
+        task = LoadTask(self, generation, func, args)
+        task.signals.finished.connect(self.on_finished)
+        task.signals.failed.connect(self.on_failed)
+        self.callbacks[generation] = (on_result, on_error)
+        self.pool.start(task)
+        return generation
+
+    def cancel(self):
+        # 还在队列中的任务开始时会发现自己已过期而直接返回，正在执行的任务结果将被丢弃
+        self.callbacks.clear()
+        self.generation += 1
+
+    def is_pending(self):
+        return self.generation in self.callbacks
+
+    def on_finished(self, generation, result):
+        callbacks = self.callbacks.pop(generation, None)
+        if callbacks is not None and callbacks[0] is not None:
+            callbacks[0](result)
+
+    def on_failed(self, generation, error):
+        callbacks = self.callbacks.pop(generation, None)
+        if callbacks is not None and callbacks[1] is not None:
+            callbacks[1](error)
@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta
+import argparse
+import platform
+import tempfile
+import random
+import shutil
+import time
+import json
+import sys
+import os
+
+from test_recurrence import compiled_rules
+from test_schedule_store import ScheduleRepository, update_op
+from test_workload import generate_estate, add_workload_arguments, workload_parameters
+
+# 每项操作执行的次数
+DEFAULT_OPERATIONS = 50
+# 与基准结果相比变慢超过该比例时标记为回归
+REGRESSION_THRESHOLD = 0.2
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'total': sum(samples),
+        'mean': sum(samples) / len(samples),
+        'min': samples[0],
+        'median': samples[len(samples) // 2],
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1]
+    }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+class DataLayerBenchmark:
+    # 在临时目录中生成日程，依次测量读取、Building ID 查重、Outstation 检查、新建、编辑、删除和按周查询。
+    # 每一项都使用新的 ScheduleRepository，避免前一项留下的缓存影响结果
+    def __init__(self, workload, operations=DEFAULT_OPERATIONS, seed=0):
+        self.workload = workload
+        self.operations = operations
+        self.rng = random.Random(seed)
+        self.schedules_dir = None
+        self.paths = []
+
+    def setup(self):
+        self.schedules_dir = tempfile.mkdtemp(prefix='smartbms-bench-')
+        self.paths = generate_estate(self.schedules_dir, **self.workload)
+
+    def teardown(self):
+        shutil.rmtree(self.schedules_dir, ignore_errors=True)
+
+    def fresh_repository(self):
+        # 同时清空规则缓存，测量的是冷启动
+        compiled_rules.clear()
+        for name in os.listdir(self.schedules_dir):
+            if name.startswith('.'):
+                os.remove(os.path.join(self.schedules_dir, name))
+        return ScheduleRepository(self.schedules_dir)
+
+    def schedule_names(self):
+        return [os.path.splitext(os.path.basename(path))[0] for path in self.paths]
+
+    def bench_load(self):
+        # 每次都是新的仓库：解析所有文件并建立事件列表
+        samples = []
+        for _ in range(max(1, self.operations // 10)):
+            repository = self.fresh_repository()
+            samples.append(timed(lambda: [repository.events(path) for path in repository.list_schedule_files()]))
+        return samples
+
+    def bench_building_check(self):
+        repository = self.fresh_repository()
+        buildings = self.workload['buildings']
+        # 一半查询已存在的 ID，一半查询不存在的 ID
+        ids = [f'B{self.rng.randint(1, buildings * 2)}' for _ in range(self.operations)]
+        return [timed(repository.find_building, building_id) for building_id in ids]
+
+    def bench_outstation_check(self):
+        repository = self.fresh_repository()
+        names = self.schedule_names()
+        samples = []
+        for _ in range(self.operations):
+            schedule_name = self.rng.choice(names)
+            building = self.rng.randint(1, self.workload['buildings'])
+            outstation = f'B{building}-OS{self.rng.randint(1, self.workload["zones"])}'
+            zone_id = f'Zone{self.rng.randint(1, self.workload["zones"])}'
+            samples.append(timed(repository.find_outstation_conflict, outstation, schedule_name, zone_id))
+        return samples
+
+    def random_event_time(self):
+        minutes = self.rng.randrange(self.workload['weeks'] * 7 * 24 * 4) * 15
+        return (datetime(2024, 1, 1) + timedelta(minutes=minutes)).strftime('%Y%m%d%H%M')
+
+    def bench_create(self):
+        repository = self.fresh_repository()
+        names = self.schedule_names()
+        samples = []
+        for number in range(self.operations):
+            schedule_name = self.rng.choice(names)
+            building_number = names.index(schedule_name) + 1
+            zone_number = self.rng.randint(1, self.workload['zones'])
+            samples.append(timed(repository.add_event, schedule_name, f'Zone{zone_number}', f'Bench{number}',
+                                 self.random_event_time(), '21', 'eq', [('day', 'Mo, We, Fr')],
+                                 f'B{building_number}-OS{zone_number}', '(200, 200, 255)'))
+        return samples
+
+    def existing_events(self, repository):
+        events = []
+        for path in repository.list_schedule_files():
+            events.extend(repository.events(path))
+        return self.rng.sample(events, min(self.operations, len(events)))
+
+    def bench_edit(self):
+        repository = self.fresh_repository()
+        samples = []
+        for event in self.existing_events(repository):
+            original = (event['schedule_name'], event['zone_id'], event['event_name'])
+            samples.append(timed(repository.update_event, original, event['event_name'], self.random_event_time(),
+                                 event['setpoint_value'], event['setpoint_type'], event['repeat_rules'], event['schedule_name'],
+                                 event['zone_id'], event['event_outstation'], event['event_colour']))
+        return samples
+
+    def bench_delete(self):
+        repository = self.fresh_repository()
+        samples = []
+        for event in self.existing_events(repository):
+            samples.append(timed(repository.delete_event, event['schedule_name'], event['zone_id'], event['event_name']))
+        return samples
+
+    def bench_batch_edit(self):
+        # 与 edit 相同数量的设定值修改作为一次批量修改提交，样本为平均每个操作的耗时
+        repository = self.fresh_repository()
+        operations = [update_op((event['schedule_name'], event['zone_id'], event['event_name']), setpoint_value='19')
+                      for event in self.existing_events(repository)]
+        return [timed(repository.batch, operations) / max(len(operations), 1)]
+
+    def bench_week_query(self):
+        # 第一次查询包括建立按周索引，之后的查询只展开一周
+        repository = self.fresh_repository()
+        samples = []
+        for _ in range(self.operations):
+            path = self.rng.choice(self.paths)
+            week = datetime(2024, 1, 1) + timedelta(weeks=self.rng.randrange(self.workload['weeks']))
+            samples.append(timed(repository.week_occurrences, path, week.date()))
+        return samples
+
+    def run(self):
+        benchmarks = [
+            ('load', self.bench_load),
+            ('building_check', self.bench_building_check),
+            ('outstation_check', self.bench_outstation_check),
+            ('create', self.bench_create),
+            ('edit', self.bench_edit),
+            ('delete', self.bench_delete),
+            ('batch_edit', self.bench_batch_edit),
+            ('week_query', self.bench_week_query)
+        ]
+        results = {}
+        self.setup()
+        try:
+            for name, bench in benchmarks:
+                # 修改类的测试会改变文件，每一项都从同样的数据开始
+                generate_estate(self.schedules_dir, **self.workload)
+                results[name] = summarize(bench())
+        finally:
+            self.teardown()
+        return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def compare(results, baseline):
+    # 按平均时间比较，返回 (名称, 基准, 当前, 变化比例)
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or not previous['mean']:
+            continue
+        rows.append((name, previous['mean'], current['mean'], current['mean'] / previous['mean'] - 1))
+    return rows
+
+
+def print_results(results):
+    for name, result in results.items():
+        print(f"{name:<18} mean {result['mean'] * 1000:9.3f} ms   p95 {result['p95'] * 1000:9.3f} ms   runs {result['runs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the schedule data layer on generated schedules.')
+    add_workload_arguments(parser)
+    parser.add_argument('--operations', type=int, default=DEFAULT_OPERATIONS, help='operations per benchmark')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    args = parser.parse_args()
+
+    workload = workload_parameters(args)
+    results = DataLayerBenchmark(workload, args.operations, args.seed).run()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'workload': workload, 'operations': args.operations,
+                       'results': results}, f, indent=2)
+
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('workload') != workload:
+            print("Warning: the baseline was recorded with a different workload.", file=sys.stderr)
+        for name, before, after, change in compare(results, baseline['results']):
+            flag = '  REGRESSION' if change > REGRESSION_THRESHOLD else ''
+            regressions += bool(flag)
+            print(f"{name:<18} {before * 1000:9.3f} ms -> {after * 1000:9.3f} ms  {change:+7.1%}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
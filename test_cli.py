@@ -0,0 +1,234 @@
+import argparse
+import sys
+
+# 不依赖 Qt 的命令行工具，供服务器上的定时任务查询和修改日程。
+# 数据层模块在各命令中才导入，启动和 --help 只需要 argparse
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def parse_date(text):
+    from datetime import datetime
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"'{text}' must look like 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'.")
+
+
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a whole number.")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"'{text}' must be greater than 0.")
+    return value
+
+
+def schedule_paths(repository, schedule_names=None):
+    import os
+    paths = sorted(repository.list_schedule_files())
+    if schedule_names:
+        paths = [path for path in paths if os.path.splitext(os.path.basename(path))[0] in schedule_names]
+    return paths
+
+
+def describe(event):
+    return f"{event['schedule_name']}/{event['zone_id']}/{event['event_name']}"
+
+
+def list_command(args):
+    import xml.etree.ElementTree as ET
+    from test_schedule_store import schedule_repository
+    if args.schedule is None:
+        # 只读取索引，不解析日程文件。无法读取的文件报告错误后继续列出其他日程
+        summaries = {summary[0]: summary for summary in schedule_repository.schedule_summaries()}
+        status = 0
+        for path in schedule_paths(schedule_repository):
+            if path not in summaries:
+                print(f"{path}: cannot be read.", file=sys.stderr)
+                status = 1
+                continue
+            _, schedule_name, building_id, event_count = summaries[path]
+            print(f"{schedule_name}\t{building_id}\t{event_count} events")
+        return status
+
+    path = schedule_repository.schedule_path(args.schedule)
+    try:
+        zones = schedule_repository.zones(path)
+        events = schedule_repository.events(path)
+    except OSError:
+        print(f"Error: Schedule file '{args.schedule}.xml' does not exist.", file=sys.stderr)
+        return 1
+    except ET.ParseError as e:
+        print(f"{path}: cannot be read: {e}", file=sys.stderr)
+        return 1
+    for zone_id, description in zones:
+        print(f"{zone_id}\t{description}")
+        for event in events:
+            if event['zone_id'] == zone_id:
+                rules = '; '.join(f"{rule[0]}:{rule[1]}" for rule in event['repeat_rules'])
+                print(f"  {event['event_name']}\t{event['event_time']:%Y-%m-%d %H:%M}\t{event['setpoint_type']} {event['setpoint_value']}\t"
+                      f"{event['event_outstation']}\t{rules}")
+    return 0
+
+
+def occurrences_command(args):
+    from test_schedule_store import schedule_repository
+    from test_recurrence import iter_occurrences
+    if args.end <= args.start:
+        print("Error: --to must be after --from.", file=sys.stderr)
+        return 1
+    occurrences = []
+    for path in schedule_paths(schedule_repository, args.schedule):
+        # 大文件只流式读取在时间窗口内发生的事件
+        for event in schedule_repository.stream_events(path, args.zone, args.start, args.end):
+            for occurrence in iter_occurrences(event['event_time'], event['repeat_rules'], args.start, args.end):
+                occurrences.append((occurrence, event))
+    occurrences.sort(key=lambda item: (item[0], describe(item[1])))
+    for occurrence, event in occurrences:
+        print(f"{occurrence:%Y-%m-%d %H:%M}\t{describe(event)}\t{event['setpoint_type']} {event['setpoint_value']}\t{event['event_outstation']}")
+    return 0
+
+
+def add_event_command(args):
+    from test_schedule_store import schedule_repository, ScheduleError
+    from test_event_io import event_from_row, EventImportError
+    from test_conflicts import candidate_event, conflicts_for_event, format_conflict
+    row = {'schedule': args.schedule, 'zone': args.zone, 'event': args.event, 'time': args.time, 'setpoint_value': args.setpoint,
+           'setpoint_type': args.type, 'outstation': args.outstation, 'colour': args.colour, 'repeat_rules': '; '.join(args.repeat)}
+    try:
+        # 与事件对话框和批量导入相同的检查
+        operation = event_from_row(row)
+    except EventImportError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    fields = [operation[name] for name in ('schedule_name', 'zone_name', 'event_name', 'date_time', 'setpoint_value', 'setpoint_type',
+                                           'repeat_rules', 'outstation_identifier', 'colour')]
+    if not args.force:
+        conflicts = conflicts_for_event(schedule_repository, candidate_event(*fields))
+        if conflicts:
+            for conflict in conflicts:
+                print(format_conflict(conflict), file=sys.stderr)
+            print("Error: the event sends contradictory setpoints; use --force to add it anyway.", file=sys.stderr)
+            return 1
+    try:
+        schedule_repository.add_event(*fields)
+    except (ScheduleError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Added {args.event} to {args.schedule}/{args.zone}.")
+    return 0
+
+
+def delete_event_command(args):
+    from test_schedule_store import EventDeleter
+    errors = []
+    if not EventDeleter(error_func=errors.append).delete_event(args.schedule, args.zone, args.event):
+        print(f"Error: {errors[0]}", file=sys.stderr)
+        return 1
+    print(f"Deleted {args.event} from {args.schedule}/{args.zone}.")
+    return 0
+
+
+def check_command(args):
+    # 检查所有日程：文件能否读取、Building ID 是否重复、每个事件是否符合界面中的校验规则、
+    # Outstation 是否被同一 Building 的多个 Zone 使用，以及一段时间内的设定值冲突
+    from datetime import datetime, timedelta
+    from test_schedule_store import schedule_repository
+    from test_validation import validate_event, validate_repeat_rule
+    from test_conflicts import find_conflicts, format_conflict, CONFLICT_HORIZON, HOLD_MINUTES
+    days = args.days if args.days is not None else CONFLICT_HORIZON.days
+    hold = args.hold if args.hold is not None else HOLD_MINUTES
+    problems = []
+    buildings = {}
+    outstations = {}
+    events = []
+    for path in schedule_paths(schedule_repository):
+        try:
+            schedule_events = schedule_repository.events(path)
+            building_id = schedule_repository.building_id(path)
+        except (OSError, SyntaxError, ValueError) as e:
+            problems.append(f"{path}: cannot be read: {e}")
+            continue
+        schedule_name = schedule_repository.schedule_name(path)
+        buildings.setdefault(building_id, []).append(schedule_name)
+        for event in schedule_events:
+            error = validate_event(event['event_name'], event['setpoint_value'], event['setpoint_type'], event['zone_id'], event['event_outstation'])
+            for rule in event['repeat_rules']:
+                error = error or validate_repeat_rule(rule)
+            if error:
+                problems.append(f"{describe(event)}: {error}")
+                continue
+            outstations.setdefault((schedule_name, event['event_outstation']), set()).add(event['zone_id'])
+            events.append(event)
+
+    for building_id, schedule_names in sorted(buildings.items()):
+        if len(schedule_names) > 1:
+            problems.append(f"Building ID {building_id} is used by {', '.join(sorted(schedule_names))}.")
+    for (schedule_name, outstation), zone_ids in sorted(outstations.items()):
+        if len(zone_ids) > 1:
+            problems.append(f"Outstation Identifier '{outstation}' is used in several zones of {schedule_name}: {', '.join(sorted(zone_ids))}.")
+
+    start = args.start or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    conflicts = find_conflicts(events, start, start + timedelta(days=days), timedelta(minutes=hold))
+    problems.extend(format_conflict(conflict) for conflict in conflicts)
+
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problem(s) found.", file=sys.stderr)
+    return 1 if problems else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Query and edit SmartBMS schedules without the GUI.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='list the schedules, or the zones and events of one schedule')
+    list_parser.add_argument('schedule', nargs='?')
+    list_parser.set_defaults(func=list_command)
+
+    occurrences_parser = subparsers.add_parser('occurrences', help='list every occurrence of the events in a time window')
+    occurrences_parser.add_argument('--from', dest='start', type=parse_date, required=True)
+    occurrences_parser.add_argument('--to', dest='end', type=parse_date, required=True)
+    occurrences_parser.add_argument('--schedule', action='append', help='only this schedule (repeatable)')
+    occurrences_parser.add_argument('--zone', action='append', help='only this zone (repeatable)')
+    occurrences_parser.set_defaults(func=occurrences_command)
+
+    add_parser = subparsers.add_parser('add-event', help='add an event to a zone')
+    add_parser.add_argument('schedule')
+    add_parser.add_argument('zone')
+    add_parser.add_argument('event')
+    add_parser.add_argument('--time', required=True, help="'YYYY-MM-DD HH:MM'")
+    add_parser.add_argument('--setpoint', required=True, help='setpoint value')
+    add_parser.add_argument('--type', required=True, choices=['lt', 'eq', 'gt'], help='setpoint type')
+    add_parser.add_argument('--outstation', required=True, help='outstation identifier')
+    add_parser.add_argument('--colour', default='', help="'(r, g, b)'")
+    add_parser.add_argument('--repeat', action='append', default=[],
+                            help="repeat rule such as 'day:Mo, We, Fr' or 'time:********0700 excl 202401020700' (repeatable)")
+    add_parser.add_argument('--force', action='store_true', help='add the event even if its setpoints conflict')
+    add_parser.set_defaults(func=add_event_command)
+
+    delete_parser = subparsers.add_parser('delete-event', help='delete an event')
+    delete_parser.add_argument('schedule')
+    delete_parser.add_argument('zone')
+    delete_parser.add_argument('event')
+    delete_parser.set_defaults(func=delete_event_command)
+
+    check_parser = subparsers.add_parser('check', help='validate all schedules and report setpoint conflicts')
+    check_parser.add_argument('--from', dest='start', type=parse_date, help='start of the conflict check (default: today)')
+    check_parser.add_argument('--days', type=positive_int, help='number of days to check for conflicts (default: 28)')
+    check_parser.add_argument('--hold', type=positive_int, help='minutes each setpoint is held (default: 60)')
+    check_parser.set_defaults(func=check_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
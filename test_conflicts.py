@@ -0,0 +1,242 @@
+from datetime import datetime, timedelta
+import argparse
+import sys
+import os
+
+from test_recurrence import iter_occurrences, event_key
+from test_schedule_store import schedule_repository, build_event_element, event_from_element
+from test_profiling import profiled
+from test_cli import positive_int
+
+# 每次下发的设定值保持的时间（分钟），两个事件的保持时间重叠即视为同时作用于该 Outstation
+HOLD_MINUTES = 60
+# 从起始时间向后展开重复事件的范围
+CONFLICT_HORIZON = timedelta(days=28)
+
+INFINITY = float('inf')
+
+
+def setpoint_range(setpoint_type, setpoint_value):
+    # 设定值允许的取值范围 (下限, 下限是否开区间, 上限, 上限是否开区间)，无法识别时返回 None
+    try:
+        value = float(setpoint_value)
+    except (TypeError, ValueError):
+        return None
+    if setpoint_type == 'lt':
+        return (-INFINITY, True, value, True)
+    if setpoint_type == 'gt':
+        return (value, True, INFINITY, True)
+    if setpoint_type == 'eq':
+        return (value, False, value, False)
+    return None
+
+
+def setpoints_contradict(first, second):
+    # 两个设定值的取值范围没有交集时互相矛盾，例如 lt 18 与 gt 22
+    a = setpoint_range(first['setpoint_type'], first['setpoint_value'])
+    b = setpoint_range(second['setpoint_type'], second['setpoint_value'])
+    if a is None or b is None:
+        return False
+    if a[0] != b[0]:
+        low, low_open = max((a[0], a[1]), (b[0], b[1]))
+    else:
+        low, low_open = a[0], a[1] or b[1]
+    if a[2] != b[2]:
+        high, high_open = min((a[2], a[3]), (b[2], b[3]))
+    else:
+        high, high_open = a[2], a[3] or b[3]
+    return low > high or (low == high and (low_open or high_open))
+
+
+def event_intervals(event, start, end, hold):
+    # 将事件在 [start, end) 内的每次发生展开为保持区间 [发生时间, 发生时间 + hold)
+    try:
+        occurrences = iter_occurrences(event['event_time'], event['repeat_rules'], start - hold, end)
+        return [(occurrence, occurrence + hold, event) for occurrence in occurrences]
+    except ValueError:
+        return []
+
+
+class IntervalTree:
+    # 静态的中心点区间树：每个节点保存跨过中心点的区间（分别按起点和终点排序），
+    # 其余区间按在中心点左侧或右侧递归建树。建树 O(n log n)，查询 O(log n + k)
+    def __init__(self, intervals):
+        # 先按起点排序一次，左右子树划分后仍保持有序，因此不需要在每一层重新排序
+        self.root = self.build(sorted(intervals, key=lambda interval: interval[0]))
+
+    def build(self, intervals):
+        if not intervals:
+            return None
+        # 以起点的中位数为中心点，跨过中心点的区间 (start <= center < end) 留在本节点。
+        # 起点等于中心点的区间总是留在本节点（包括长度为 0 的区间），保证每层至少处理掉一个区间
+        center = intervals[len(intervals) // 2][0]
+        left, right, by_start = [], [], []
+        for interval in intervals:
+            if interval[1] <= center and interval[0] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                by_start.append(interval)
+        by_end = sorted(by_start, key=lambda interval: interval[1], reverse=True)
+        return (center, by_start, by_end, self.build(left), self.build(right))
+
+    def overlapping(self, start, end):
+        # 返回与 [start, end) 重叠的所有区间
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+            if end <= center:
+                for interval in by_start:
+                    if interval[0] >= end:
+                        break
+                    found.append(interval)
+                stack.append(left)
+            elif start >= center:
+                for interval in by_end:
+                    if interval[1] <= start:
+                        break
+                    found.append(interval)
+                stack.append(right)
+            else:
+                found.extend(by_start)
+                stack.append(left)
+                stack.append(right)
+        return found
+
+
+def candidate_event(schedule_name, zone_id, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+    # 与保存到XML后再读出的事件完全一致，保存前用于检查
+    element = build_event_element(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+    return event_from_element(element, schedule_name, zone_id)
+
+
+def conflict_key(event):
+    return (event['schedule_name'], event['zone_id'], event['event_name'])
+
+
+def collect_conflicts(pairs, conflicts):
+    # 同一对事件只报告一次，记录第一次重叠的时间和重叠次数
+    for first, second, overlap_start in pairs:
+        if conflict_key(second) < conflict_key(first):
+            first, second = second, first
+        key = (conflict_key(first), conflict_key(second))
+        conflict = conflicts.get(key)
+        if conflict is None:
+            conflicts[key] = {'outstation': first['event_outstation'], 'first': first, 'second': second,
+                              'start': overlap_start, 'count': 1}
+        else:
+            conflict['count'] += 1
+            conflict['start'] = min(conflict['start'], overlap_start)
+
+
+@profiled('conflicts.find')
+def find_conflicts(events, start, end, hold=timedelta(minutes=HOLD_MINUTES)):
+    # 按 Outstation 分组，每组的保持区间放入区间树，查询每个区间的重叠并检查设定值是否矛盾。
+    # 总体为 O(n log n + k)，n 为区间数量，k 为重叠数量
+    if hold <= timedelta(0):
+        raise ValueError("The hold time must be positive.")
+    by_outstation = {}
+    for event in events:
+        by_outstation.setdefault(event['event_outstation'], []).extend(event_intervals(event, start, end, hold))
+
+    conflicts = {}
+    for intervals in by_outstation.values():
+        if len(intervals) < 2:
+            continue
+        tree = IntervalTree(intervals)
+        pairs = []
+        for interval in intervals:
+            for other in tree.overlapping(interval[0], interval[1]):
+                # 每对区间只检查一次
+                if (other[0], conflict_key(other[2])) <= (interval[0], conflict_key(interval[2])):
+                    continue
+                if conflict_key(other[2]) == conflict_key(interval[2]):
+                    continue
+                if setpoints_contradict(interval[2], other[2]):
+                    pairs.append((interval[2], other[2], max(interval[0], other[0])))
+        collect_conflicts(pairs, conflicts)
+    return sorted(conflicts.values(), key=lambda conflict: (conflict['start'], conflict['outstation']))
+
+
+def conflicts_for_event(repository, event, ignore=None, horizon=CONFLICT_HORIZON, hold=timedelta(minutes=HOLD_MINUTES), now=None):
+    # 保存前检查：只展开使用同一 Outstation 的事件。ignore 为正在编辑的原事件 (日程, Zone, 事件)。
+    # 与整体报告一样从今天开始检查，起始时间很早的重复事件也能发现冲突
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    start = max(event['event_time'], today)
+    end = start + horizon
+    users = {}
+    for user in repository.outstation_users(event['event_outstation']):
+        if user == conflict_key(event) or (ignore is not None and user == tuple(ignore)):
+            continue
+        users.setdefault(user[0], set()).add((user[1], user[2]))
+    candidates = [event]
+    for schedule_name, keys in users.items():
+        path = repository.schedule_path(schedule_name)
+        if not os.path.exists(path):
+            continue
+        candidates.extend(other for other in repository.events(path) if event_key(other) in keys)
+    return [conflict for conflict in find_conflicts(candidates, start, end, hold)
+            if conflict_key(event) in (conflict_key(conflict['first']), conflict_key(conflict['second']))]
+
+
+def estate_report(repository, start, end, hold=timedelta(minutes=HOLD_MINUTES)):
+    # 整个园区所有日程的冲突报告
+    events = []
+    for path in repository.list_schedule_files():
+        try:
+            events.extend(repository.events(path))
+        except (OSError, SyntaxError):
+            continue
+    return find_conflicts(events, start, end, hold)
+
+
+def describe_event(event):
+    return f"{event['schedule_name']}/{event['zone_id']}/{event['event_name']} ({event['setpoint_type']} {event['setpoint_value']})"
+
+
+def conflict_message(conflicts, limit=5):
+    # 保存前的警告内容，只列出前几个冲突
+    lines = [format_conflict(conflict) for conflict in conflicts[:limit]]
+    if len(conflicts) > limit:
+        lines.append(f"... and {len(conflicts) - limit} more.")
+    return "This event sends contradictory setpoints to the same outstation:\n\n" + "\n".join(lines) + "\n\nSave anyway?"
+
+
+def confirm_conflicts(repository, event, confirm, ignore=None):
+    # 保存前的提示：与其他事件向同一 Outstation 下发矛盾的设定值时，调用 confirm(message) 询问用户，
+    # 返回 True 表示可以保存。在名称、Outstation 等校验通过后再调用
+    try:
+        conflicts = conflicts_for_event(repository, event, ignore)
+    except (OSError, SyntaxError, ValueError):
+        return True
+    return not conflicts or confirm(conflict_message(conflicts))
+
+
+def format_conflict(conflict):
+    text = f"{conflict['start']:%Y-%m-%d %H:%M} outstation {conflict['outstation']}: {describe_event(conflict['first'])} contradicts {describe_event(conflict['second'])}"
+    if conflict['count'] > 1:
+        text += f" ({conflict['count']} overlaps)"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report contradictory setpoints sent to the same outstation.')
+    parser.add_argument('--days', type=int, default=CONFLICT_HORIZON.days, help='number of days to check from today')
+    parser.add_argument('--hold', type=positive_int, default=HOLD_MINUTES, help='minutes each setpoint is held')
+    args = parser.parse_args()
+
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    conflicts = estate_report(schedule_repository, start, start + timedelta(days=args.days), timedelta(minutes=args.hold))
+    for conflict in conflicts:
+        print(format_conflict(conflict))
+    print(f"{len(conflicts)} conflict(s) found.", file=sys.stderr)
+    sys.exit(1 if conflicts else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QPushButton
+from PySide6.QtWidgets import QCheckBox, QLabel, QFileDialog, QMessageBox, QHeaderView, QAbstractItemView
+from PySide6.QtCore import Qt, QTimer
+
+from test_profiling import profiler
+from test_week_cache import week_cache
+
+# 面板打开时自动刷新的间隔（毫秒）
+REFRESH_INTERVAL_MS = 1000
+COLUMNS = ['Span', 'Count', 'Total (ms)', 'Mean (ms)', 'Max (ms)']
+
+
+class DiagnosticsPanel(QDialog):
+    # 隐藏的诊断面板（Ctrl+Shift+D）：开关计时记录，查看各 span 的汇总耗时，导出 JSON 或 Chrome 跟踪文件
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Diagnostics')
+        self.resize(640, 420)
+        self.setupUI()
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def setupUI(self):
+        layout = QVBoxLayout(self)
+
+        self.enabled_checkbox = QCheckBox('Record timings')
+        self.enabled_checkbox.setChecked(profiler.enabled)
+        self.enabled_checkbox.toggled.connect(profiler.enable)
+        layout.addWidget(self.enabled_checkbox)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        self.cache_label = QLabel()
+        layout.addWidget(self.cache_label)
+
+        button_layout = QHBoxLayout()
+        for text, slot in (('Refresh', self.refresh), ('Reset', self.reset), ('Save JSON...', self.save_json),
+                           ('Save Chrome Trace...', self.save_trace)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            button_layout.addWidget(button)
+        layout.addLayout(button_layout)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        stats = profiler.stats()
+        self.table.setRowCount(len(stats))
+        for row, (name, values) in enumerate(stats.items()):
+            cells = [name, str(values['count']), f"{values['total_ms']:.2f}", f"{values['mean_ms']:.3f}", f"{values['max_ms']:.2f}"]
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        cache = week_cache.stats()
+        self.cache_label.setText(f"Week cache: {cache['layouts']} layouts, {cache['size'] // 1024} KB of {cache['budget'] // 1024} KB, "
+                                 f"{cache['hits']} hits, {cache['misses']} misses, {cache['prefetched']} prefetched, {cache['evicted']} evicted")
+
+    def reset(self):
+        profiler.reset()
+        self.refresh()
+
+    def save_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Timings', 'smartbms-profile.json', 'JSON (*.json)')
+        if path:
+            self.save(profiler.dump_json, path)
+
+    def save_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Chrome Trace', 'smartbms-trace.json', 'Chrome Trace (*.json)')
+        if path:
+            self.save(profiler.dump_chrome_trace, path)
+
+    def save(self, dump, path):
+        try:
+            dump(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Failed to save the file: {e}")
@@ -3,11 +3,13 @@ from PySide6.QtWidgets import QVBoxLayout, QComboBox, QMessageBox, QHBoxLayout
 from PySide6.QtWidgets import QDateTimeEdit, QPushButton, QColorDialog
 from PySide6.QtCore import QDate, QDateTime, Signal
 from PySide6.QtGui import QColor
-import xml.etree.ElementTree as ET
 import os
-import glob
 
 from test_repeat import RepeatRulesDialog
+from test_background import BackgroundLoader
+from test_conflicts import candidate_event, confirm_conflicts
+from test_validation import validate_event
+from test_schedule_store import schedule_repository, ScheduleError, create_op
 
 class EventDialog(QDialog):
 
@@ -16,6 +18,7 @@ class EventDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle('Create New Event')
+        self.zone_loader = BackgroundLoader(self)
         self.repeat_rules = []
 
         self.event_name_input = QLineEdit(self)
@@ -93,9 +96,7 @@ class EventDialog(QDialog):
         self.schedule_selector.clear() 
         self.schedule_selector.addItem("Please select one of the following schedules", None) 
 
-        schedules_dir = 'Schedules'
-        schedule_files = glob.glob(os.path.join(schedules_dir, '*.xml'))
-        for filepath in schedule_files:
+        for filepath in schedule_repository.list_schedule_files():
             schedule_name = os.path.splitext(os.path.basename(filepath))[0]
             self.schedule_selector.addItem(schedule_name, filepath)  # 设置userData为文件路径 
         
@@ -105,16 +106,17 @@ class EventDialog(QDialog):
         self.zone_selector.clear()  # 清除之前的选项
         selected_schedule_path = self.schedule_selector.currentData()  # 获取选中的日程文件路径
         if selected_schedule_path:
-            try:
-                tree = ET.parse(selected_schedule_path)
-                root = tree.getroot()
-                building = root.find('.//building')
-                if building:
-                    for zone in building.findall('.//zone'):
-                        zone_id = zone.get('ID')
-                        self.zone_selector.addItem(zone_id)  # 添加区域ID到下拉列表
-            except ET.ParseError as e:
-                QMessageBox.critical(self, "Error", "Failed to parse the schedule file.")
+            # 在工作线程中解析日程文件，切换到其他日程时之前的请求作废
+            self.zone_loader.submit(schedule_repository.zone_ids, selected_schedule_path, on_result=self.show_zones, on_error=self.show_zone_error)
+        else:
+            self.zone_loader.cancel()
+
+    def show_zones(self, zone_ids):
+        for zone_id in zone_ids:
+            self.zone_selector.addItem(zone_id)  # 添加区域ID到下拉列表
+
+    def show_zone_error(self, error):
+        QMessageBox.critical(self, "Error", "Failed to parse the schedule file.")
 
     def populate_setpoint_type_selector(self):
         self.setpoint_selector.clear()
@@ -153,30 +155,12 @@ class EventDialog(QDialog):
 
         colour = self.selected_color_rgb 
 
-        if not event_name:  # 如果事件名称为空
-            QMessageBox.critical(self, "Error", "Event name cannot be empty.")  # 显示错误消息
-            return  # 退出方法，不继续执行后面的保存操作
-        
-        if not setpoint_value:
-            QMessageBox.critical(self, "Error", "Setpoint Value cannot be empty.")
-            return
-        
-        if not self.check_numeric(setpoint_value):
-            QMessageBox.critical(self, "Error", "Setpoint Value must be a literal numeric value.")
-            return
-        
-        if not setpoint_type:
-            QMessageBox.critical(self, "Error", "Setpoint Type must be selected.")
-            return
-            
-        if not zone_name:
-            QMessageBox.critical(self, "Error", "Zone must be selected.")
-            return
-        
-        if not outstation_identifier:
-            QMessageBox.critical(self, "Error", "Outstation Identifier cannot be empty.")
+        # 与批量导入共用同一套检查
+        error = validate_event(event_name, setpoint_value, setpoint_type, zone_name, outstation_identifier)
+        if error:
+            QMessageBox.critical(self, "Error", error)
             return
-    
+
         if not self.createEventXML(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, selected_schedule, zone_name, outstation_identifier, colour):
             return  # 如果 createEventXML 返回 False，则不关闭对话框
 
@@ -189,59 +173,24 @@ class EventDialog(QDialog):
         # 返回用户在日期时间选择器中选择的事件开始日期
         return self.date_time_edit.date()
     
-    def check_numeric(self, input_value):
-        try:
-            float(input_value)
-            return True
-        except ValueError:
-            return False
+    def save_anyway(self, message):
+        reply = QMessageBox.warning(self, "Setpoint Conflict", message,
+                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        return reply == QMessageBox.StandardButton.Yes
 
     def createEventXML(self, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_name, outstation_identifier, colour):
-        schedules_dir = 'Schedules'
-        filename = os.path.join(schedules_dir, f'{schedule_name}.xml')
-    
-        if os.path.exists(filename):
-            tree = ET.parse(filename)
-            root = tree.getroot()
-            building = root.find('.//building')
-            if building is not None:
-                # 检查outstation-identifier是否在其他区域已被使用
-                for zn in building.findall('.//zone'):
-                    existing_outstation_event = zn.find(f".//event[@outstation='{outstation_identifier}']")
-                    if existing_outstation_event is not None and zn.get('ID') != zone_name:
-                        found_zone_name = zn.get('ID')
-                        QMessageBox.critical(self, "Error", f"Outstation Identifier '{outstation_identifier}' is already used in {found_zone_name}.")
-                        return False
-            
-                # 直接获取选择的zone元素，不需要检查是否存在，因为用户是从已有区域中选择的
-                zone = building.find(f".//zone[@ID='{zone_name}']")
-            
-                # 检查当前区域内是否已有相同名称的event
-                existing_event = zone.find(f".//event[@ID='{event_name}']")
-                if existing_event is not None:
-                    QMessageBox.critical(self, "Error", f"{event_name} already exists in {zone_name}.")
-                    return False
-
-                # 创建新的event元素
-                event = ET.SubElement(zone, 'event', ID=event_name, outstation=outstation_identifier, colour=colour)
-                event_time = ET.SubElement(event, 'eventTime')
-                event_time.text = f' "{date_time}" '
-                setpoint = ET.SubElement(event, 'setpoint', value=setpoint_value, type=setpoint_type)
-
-                # 处理重复规则
-                for rule in self.repeat_rules:
-                    rrule = ET.SubElement(event, 'rrule')
-                    # 添加repeat元素，包含specifier和type属性
-                    repeat_element = ET.SubElement(rrule, 'repeat', specifier=rule[1], type=str(rule[0]))
-                    for excluded_time in rule[2:]:  # 第三位及以后是 excludedTime
-                        # 添加excludedTime，文本两边添加一个空格
-                        ET.SubElement(rrule, 'excDay').text = f' "{excluded_time}" '
-
-                tree.write(filename, encoding='utf-8', xml_declaration=True)
-                return True  # 创建成功
-            else:
-                QMessageBox.critical(self, "Error", "No building element found in the schedule.")
-                return False
-        else:
-            QMessageBox.critical(self, "Error", "Schedule file does not exist.")
+        fields = (schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, self.repeat_rules, outstation_identifier, colour)
+        try:
+            # 先检查事件名称和 Outstation 是否重复，通过后再提示设定值冲突
+            schedule_repository.batch([create_op(*fields)], dry_run=True)
+        except ScheduleError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return False
+        if not confirm_conflicts(schedule_repository, candidate_event(*fields), self.save_anyway):
+            return False
+        try:
+            schedule_repository.add_event(*fields)
+        except ScheduleError as e:
+            QMessageBox.critical(self, "Error", str(e))
             return False
+        return True  # 创建成功
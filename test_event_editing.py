@@ -3,20 +3,22 @@ from PySide6.QtWidgets import QVBoxLayout, QComboBox, QMessageBox, QHBoxLayout
 from PySide6.QtWidgets import QDateTimeEdit, QPushButton, QColorDialog
 from PySide6.QtCore import QDateTime, Qt
 from PySide6.QtGui import QColor
-import xml.etree.ElementTree as ET
 import os
-import glob
 
 from test_repeat import RepeatRulesDialog
+from test_schedule_store import schedule_repository, ScheduleError, update_op
+from test_background import BackgroundLoader
+from test_conflicts import candidate_event, confirm_conflicts
+from test_validation import validate_event
 
 class EventEditDialog(QDialog):
 
     def __init__(self, parent=None, event_name=None, event_time=None, setpoint_value=None, setpoint_type=None, repeat_rules=None, schedule_name=None, zone_id=None, event_outstation=None, event_colour=None, schedules_dir='Schedules', refresh_func=None):
         super().__init__(parent)
         self.setWindowTitle('Edit Event')
+        self.zone_loader = BackgroundLoader(self)
         self.schedules_dir = schedules_dir
         self.refresh_func = refresh_func
-        self.remover = EventDeleter(schedules_dir)
         self.repeat_rules = repeat_rules if repeat_rules else []
 
         self.event_name_input = QLineEdit(event_name, self)
@@ -72,16 +74,10 @@ class EventEditDialog(QDialog):
         # 连接日程选择器的信号以填充区域选择器
         self.schedule_selector.currentIndexChanged.connect(self.populate_zone_selector)
 
-        # 确保区域选择器被正确填充
+        # 确保区域选择器被正确填充，区域加载完成后选中原事件所在的区域
+        self.initial_zone = zone_id
         self.populate_zone_selector()
 
-        # 设置区域选择器的当前选项
-        zone_index = self.zone_selector.findText(zone_id)
-        if zone_index != -1:
-            self.zone_selector.setCurrentIndex(zone_index)
-        else:
-            self.zone_selector.setCurrentIndex(0)
-
         self.setpoint_selector.setCurrentText(setpoint_type)
 
     def setupUI(self):
@@ -130,9 +126,7 @@ class EventEditDialog(QDialog):
         self.schedule_selector.clear() 
         self.schedule_selector.addItem("Please select one of the following schedules", None) 
 
-        schedules_dir = 'Schedules'
-        schedule_files = glob.glob(os.path.join(schedules_dir, '*.xml'))
-        for filepath in schedule_files:
+        for filepath in schedule_repository.list_schedule_files():
             schedule_name = os.path.splitext(os.path.basename(filepath))[0]
             self.schedule_selector.addItem(schedule_name, filepath)  # 设置userData为文件路径 
 
@@ -140,16 +134,23 @@ class EventEditDialog(QDialog):
         self.zone_selector.clear()  
         selected_schedule_path = self.schedule_selector.currentData()  # 获取选中的日程文件路径
         if selected_schedule_path:
-            try:
-                tree = ET.parse(selected_schedule_path)
-                root = tree.getroot()
-                building = root.find('.//building')
-                if building:
-                    for zone in building.findall('.//zone'):
-                        zone_id = zone.get('ID')
-                        self.zone_selector.addItem(zone_id)  # 添加区域ID到下拉列表
-            except ET.ParseError as e:
-                QMessageBox.critical(self, "Error", "Failed to parse the schedule file.")
+            # 在工作线程中解析日程文件，切换到其他日程时之前的请求作废
+            self.zone_loader.submit(schedule_repository.zone_ids, selected_schedule_path, on_result=self.show_zones, on_error=self.show_zone_error)
+        else:
+            self.zone_loader.cancel()
+
+    def show_zones(self, zone_ids):
+        for zone_id in zone_ids:
+            self.zone_selector.addItem(zone_id)  # 添加区域ID到下拉列表
+
+        # 设置区域选择器的当前选项
+        if self.initial_zone is not None:
+            zone_index = self.zone_selector.findText(self.initial_zone)
+            self.zone_selector.setCurrentIndex(zone_index if zone_index != -1 else 0)
+            self.initial_zone = None
+
+    def show_zone_error(self, error):
+        QMessageBox.critical(self, "Error", "Failed to parse the schedule file.")
 
     def populate_setpoint_type_selector(self):
         self.setpoint_selector.clear()
@@ -195,117 +196,43 @@ class EventEditDialog(QDialog):
 
         colour = self.selected_color_rgb 
 
-        if not event_name:  # 如果事件名称为空
-            QMessageBox.critical(self, "Error", "Event name cannot be empty.")  # 显示错误消息
-            return  # 退出方法，不继续执行后面的保存操作
-        
-        if not setpoint_value:
-            QMessageBox.critical(self, "Error", "Setpoint Value cannot be empty.")
-            return
-        
-        if not self.check_numeric(setpoint_value):
-            QMessageBox.critical(self, "Error", "Setpoint Value must be a literal numeric value.")
-            return
-        
-        if not setpoint_type:
-            QMessageBox.critical(self, "Error", "Setpoint Type must be selected.")
-            return
-            
-        if not zone_name:
-            QMessageBox.critical(self, "Error", "Zone must be selected.")
+        # 与批量导入共用同一套检查
+        error = validate_event(event_name, setpoint_value, setpoint_type, zone_name, outstation_identifier)
+        if error:
+            QMessageBox.critical(self, "Error", error)
             return
-        
-        if not outstation_identifier:
-            QMessageBox.critical(self, "Error", "Outstation Identifier cannot be empty.")
-            return
-        
-        if not self.remover.delete_event(self.original_schedule, self.original_zone, self.original_name):
-            return
-    
+
         if not self.updateEventXML(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, selected_schedule, zone_name, outstation_identifier, colour):
             return  # 如果 createEventXML 返回 False，则不关闭对话框
 
         # 如果一切顺利，则可以接受对话框并关闭
         self.accept()
     
-    def check_numeric(self, input_value):
-        try:
-            float(input_value)
-            return True
-        except ValueError:
-            return False
+    def save_anyway(self, message):
+        reply = QMessageBox.warning(self, "Setpoint Conflict", message,
+                                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        return reply == QMessageBox.StandardButton.Yes
 
     def updateEventXML(self, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_name, outstation_identifier, colour):
-        filename = os.path.join(self.schedules_dir, f'{schedule_name}.xml')
-    
-        if os.path.exists(filename):
-            tree = ET.parse(filename)
-            root = tree.getroot()
-            building = root.find('.//building')
-            if building is not None:
-                # 检查outstation-identifier是否在其他区域已被使用
-                for zn in building.findall('.//zone'):
-                    existing_outstation_event = zn.find(f".//event[@outstation='{outstation_identifier}']")
-                    if existing_outstation_event is not None and existing_outstation_event.get('ID') != self.original_name and zn.get('ID') != zone_name:
-                        found_zone_name = zn.get('ID')
-                        QMessageBox.critical(None, "Error", f"Outstation Identifier '{outstation_identifier}' is already used in {found_zone_name}.")
-                        return False
-
-                # 添加新事件
-                zone = building.find(f".//zone[@ID='{zone_name}']")
-                event = ET.SubElement(zone, 'event', ID=event_name, outstation=outstation_identifier, colour=str(colour))
-                ET.SubElement(event, 'eventTime').text = date_time
-                ET.SubElement(event, 'setpoint', value=setpoint_value, type=setpoint_type)
-
-                # 处理重复规则
-                for rule in repeat_rules:
-                    rrule = ET.SubElement(event, 'rrule')
-                    ET.SubElement(rrule, 'repeat', specifier=rule[1], type=str(rule[0]))
-                    for excluded_time in rule[2:]:
-                        ET.SubElement(rrule, 'excDay').text = excluded_time
-
-                tree.write(filename, encoding='utf-8', xml_declaration=True)
-                if self.refresh_func:
-                    self.refresh_func(date_time) 
-                return True
-            else:
-                QMessageBox.critical(None, "Error", "No building element found in the schedule.")
-                return False
-        else:
-            QMessageBox.critical(None, "Error", f"Schedule file '{schedule_name}.xml' does not exist.")
+        # 在一次事务中替换原事件并只写一次文件，校验失败时原事件保持不变
+        original = (self.original_schedule, self.original_zone, self.original_name)
+        try:
+            # 先检查事件名称和 Outstation 是否重复，通过后再提示设定值冲突
+            schedule_repository.batch([update_op(original, event_name=event_name, date_time=date_time, setpoint_value=setpoint_value,
+                                                 setpoint_type=setpoint_type, repeat_rules=repeat_rules, schedule_name=schedule_name,
+                                                 zone_name=zone_name, outstation_identifier=outstation_identifier, colour=colour)], dry_run=True)
+        except ScheduleError as e:
+            QMessageBox.critical(None, "Error", str(e))
             return False
-
-class EventDeleter:
-    def __init__(self, schedules_dir='Schedules', refresh_func=None):
-        self.schedules_dir = schedules_dir
-        self.refresh_func = refresh_func
-
-    def delete_event(self, schedule_name, zone_id, event_id):
-        filename = os.path.join(self.schedules_dir, f'{schedule_name}.xml')
-        if os.path.exists(filename):
-            tree = ET.parse(filename)
-            root = tree.getroot()
-            building = root.find('.//building')
-            if building is not None:
-                zone = building.find(f".//zone[@ID='{zone_id}']")
-                if zone is not None:
-                    event = zone.find(f".//event[@ID='{event_id}']")
-                    if event is not None:
-                        zone.remove(event)
-                        tree.write(filename, encoding='utf-8', xml_declaration=True)
-                        if self.refresh_func:
-                            self.refresh_func(None)  # 调用刷新函数
-                        return True
-                    else:
-                        QMessageBox.critical(None, "Error", f"No event found with ID '{event_id}' in zone '{zone_id}'.")
-                        return False
-                else:
-                    QMessageBox.critical(None, "Error", f"No zone found with ID '{zone_id}'.")
-                    return False
-            else:
-                QMessageBox.critical(None, "Error", "No building element found in the schedule.")
-                return False
-        else:
-            QMessageBox.critical(None, "Error", f"Schedule file '{schedule_name}.xml' does not exist.")
+        event = candidate_event(schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+        if not confirm_conflicts(schedule_repository, event, self.save_anyway, original):
             return False
-        
\ No newline at end of file
+        try:
+            schedule_repository.update_event(original, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_name, outstation_identifier, colour)
+        except ScheduleError as e:
+            QMessageBox.critical(None, "Error", str(e))
+            return False
+
+        if self.refresh_func:
+            self.refresh_func(date_time) 
+        return True
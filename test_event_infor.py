@@ -4,14 +4,16 @@ from PySide6.QtGui import QIcon, QFont
 from PySide6.QtCore import Qt, QDate
 from datetime import datetime
 
-from test_event_editing import EventEditDialog, EventDeleter
+from test_event_editing import EventEditDialog
+from test_schedule_store import EventDeleter
 
 class EventInfor():
 
     def __init__(self, parent=None):
         self.parent = parent
         # 传递刷新函数
-        self.event_deleter = EventDeleter(refresh_func=self.refresh_events_from_parent)
+        self.event_deleter = EventDeleter(refresh_func=self.refresh_events_from_parent,
+                                          error_func=lambda message: QMessageBox.critical(None, "Error", message))
 
     def view_event(self, event_name, event_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_id, event_outstation, event_colour):
         dialog = QDialog(self.parent)
@@ -142,8 +144,6 @@ class EventInfor():
 
     def refresh_events_from_parent(self, date_in):
         if self.parent:
-            schedule_path = f"Schedules\\{self.schedule_name}.xml"
-
             if date_in is None:
                 date = self.event_time
                 # 从 datetime 对象中提取年、月、日
@@ -159,4 +159,5 @@ class EventInfor():
             # 使用提取的年、月、日创建一个 QDate 对象
             qdate_object = QDate(year, month, day)
 
-            self.parent.updateEventsTimeline(schedule_path, qdate_object)  # 调用主界面的刷新方法
\ No newline at end of file
+            # 修改已由时间线增量应用，这里只在事件位于其他周时切换到该周
+            self.parent.followDate(qdate_object)
\ No newline at end of file
@@ -0,0 +1,403 @@
+from datetime import datetime, timezone
+import argparse
+import csv
+import re
+import os
+import sys
+
+from test_schedule_store import schedule_repository, ScheduleError, create_op
+from test_validation import validate_event, validate_repeat_rule, parse_time, DAY_CODES
+
+# 批量导入/导出事件：CSV 和 iCalendar（.ics）。两种格式都逐行流式读写，导入时每一行先按与事件对话框相同的
+# 规则校验，全部有效后作为一次批量修改写入，每个日程文件只写一次
+
+CSV_FIELDS = ['schedule', 'zone', 'event', 'time', 'setpoint_value', 'setpoint_type', 'outstation', 'colour', 'repeat_rules']
+CSV_TIME_FORMAT = '%Y-%m-%d %H:%M'
+DEFAULT_COLOUR = '(255, 255, 255)'
+COLOUR_PATTERN = re.compile(r'^\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*\)$')
+
+# 重复规则的文本形式：规则之间用 ';' 分隔，排除时间写在 'excl' 之后，例如
+# "day:Mo, Tu, We excl 202403050700 202403120700; time:********0700"
+RULE_SEPARATOR = ';'
+EXCLUSION_MARKER = ' excl '
+
+ICAL_PRODID = '-//SmartBMS//Schedules//EN'
+ICAL_LINE_OCTETS = 75
+ICAL_DAYS = {'MO': 'Mo', 'TU': 'Tu', 'WE': 'We', 'TH': 'Th', 'FR': 'Fr', 'SA': 'Sa', 'SU': 'Su'}
+
+
+class EventImportError(Exception):
+    pass
+
+
+def format_rules(repeat_rules):
+    parts = []
+    for rule_type, specifier, *excluded_times in repeat_rules:
+        text = f"{rule_type}:{specifier}"
+        if excluded_times:
+            text += EXCLUSION_MARKER + ' '.join(excluded_times)
+        parts.append(text)
+    return (RULE_SEPARATOR + ' ').join(parts)
+
+
+def parse_rules(text):
+    repeat_rules = []
+    for part in (text or '').split(RULE_SEPARATOR):
+        part = part.strip()
+        if not part:
+            continue
+        rule_type, colon, rest = part.partition(':')
+        if not colon:
+            raise EventImportError(f"Repeat rule '{part}' must look like 'day:Mo, Tu' or 'time:********0700'.")
+        specifier, _, excluded = rest.partition(EXCLUSION_MARKER.strip())
+        repeat_rules.append((rule_type.strip(), specifier.strip(), *excluded.split()))
+    return repeat_rules
+
+
+def normalize_colour(text):
+    if not text:
+        return DEFAULT_COLOUR
+    match = COLOUR_PATTERN.match(text.strip())
+    if match is None or any(int(value) > 255 for value in match.groups()):
+        raise EventImportError(f"Colour '{text}' must look like '(255, 0, 0)'.")
+    return '({}, {}, {})'.format(*(int(value) for value in match.groups()))
+
+
+def normalize_time(text):
+    # 接受 'YYYY-MM-DD HH:MM' 或 'YYYYMMDDhhmm'，返回日程文件使用的 'YYYYMMDDhhmm'
+    text = (text or '').strip()
+    try:
+        return datetime.strptime(text, CSV_TIME_FORMAT).strftime('%Y%m%d%H%M')
+    except ValueError:
+        pass
+    if parse_time(text) is None:
+        raise EventImportError(f"Event time '{text}' must look like 'YYYY-MM-DD HH:MM'.")
+    return text
+
+
+def event_from_row(row, defaults=None):
+    # 校验一行并返回新增该事件的批量操作，无效时抛出 EventImportError
+    if 'error' in row:
+        raise EventImportError(row['error'])
+
+    def field(name):
+        value = (row.get(name) or '').strip()
+        return value or (defaults or {}).get(name, '')
+
+    schedule_name = field('schedule')
+    if not schedule_name:
+        raise EventImportError("Schedule cannot be empty.")
+    event_name, zone_name, outstation_identifier = field('event'), field('zone'), field('outstation')
+    setpoint_value, setpoint_type = field('setpoint_value'), field('setpoint_type')
+    error = validate_event(event_name, setpoint_value, setpoint_type, zone_name, outstation_identifier)
+    if error:
+        raise EventImportError(error)
+    date_time = normalize_time(field('time'))
+    repeat_rules = row['repeat_rules'] if isinstance(row.get('repeat_rules'), list) else parse_rules(field('repeat_rules'))
+    for rule in repeat_rules:
+        error = validate_repeat_rule(rule)
+        if error:
+            raise EventImportError(error)
+    colour = normalize_colour(field('colour'))
+    return create_op(schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+
+
+def import_rows(rows, repository=schedule_repository, defaults=None, dry_run=False):
+    # rows 为 (行号, 行) 序列。任何一行无效时不写入任何文件；返回 (日程 -> 导入数量, [(行号, 错误)])
+    operations = []
+    lines = []
+    errors = []
+    for line, row in rows:
+        try:
+            operations.append(event_from_row(row, defaults))
+        except EventImportError as e:
+            errors.append((line, str(e)))
+            continue
+        lines.append(line)
+    if errors:
+        return {}, errors
+
+    try:
+        repository.batch(operations, dry_run)
+    except ScheduleError as e:
+        line = lines[e.operation] if getattr(e, 'operation', None) is not None else None
+        return {}, [(line, str(e))]
+    except OSError as e:
+        return {}, [(None, f"Failed to write the schedules: {e}")]
+    imported = {}
+    for operation in operations:
+        imported[operation['schedule_name']] = imported.get(operation['schedule_name'], 0) + 1
+    return imported, errors
+
+
+def read_csv(f):
+    reader = csv.DictReader(f)
+    missing = [name for name in ('event', 'time', 'setpoint_value', 'setpoint_type', 'outstation') if name not in (reader.fieldnames or [])]
+    if missing:
+        raise EventImportError(f"CSV header is missing: {', '.join(missing)}.")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def event_rows(repository=schedule_repository, schedule_names=None):
+    # 逐个日程、逐个事件地产生导出的事件，大文件按流式读取
+    for path in sorted(repository.list_schedule_files()):
+        if schedule_names and os.path.splitext(os.path.basename(path))[0] not in schedule_names:
+            continue
+        yield from repository.stream_events(path)
+
+
+def write_csv(f, events):
+    writer = csv.writer(f)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for event in events:
+        writer.writerow([event['schedule_name'], event['zone_id'], event['event_name'], event['event_time'].strftime(CSV_TIME_FORMAT),
+                         event['setpoint_value'], event['setpoint_type'], event['event_outstation'], event['event_colour'],
+                         format_rules(event['repeat_rules'])])
+        count += 1
+    return count
+
+
+def escape_text(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def unescape_text(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def fold(line):
+    # 超过 75 字节的行折行，续行以空格开头（RFC 5545 3.1）
+    data = line.encode('utf-8')
+    if len(data) <= ICAL_LINE_OCTETS:
+        return line + '\r\n'
+    parts = []
+    limit = ICAL_LINE_OCTETS
+    while data:
+        cut = min(limit, len(data))
+        # 不在 UTF-8 多字节字符中间断开
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+        limit = ICAL_LINE_OCTETS - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ical_time(date_time):
+    return date_time.strftime('%Y%m%dT%H%M%S')
+
+
+def ical_event_lines(event, stamp):
+    yield 'BEGIN:VEVENT'
+    yield f"UID:{escape_text(event['schedule_name'])}/{escape_text(event['zone_id'])}/{escape_text(event['event_name'])}@smartbms"
+    yield f"DTSTAMP:{stamp}"
+    yield f"DTSTART:{ical_time(event['event_time'])}"
+    yield f"SUMMARY:{escape_text(event['event_name'])}"
+    yield f"X-SMARTBMS-SCHEDULE:{escape_text(event['schedule_name'])}"
+    yield f"X-SMARTBMS-ZONE:{escape_text(event['zone_id'])}"
+    yield f"X-SMARTBMS-OUTSTATION:{escape_text(event['event_outstation'])}"
+    yield f"X-SMARTBMS-SETPOINT-VALUE:{escape_text(event['setpoint_value'])}"
+    yield f"X-SMARTBMS-SETPOINT-TYPE:{escape_text(event['setpoint_type'])}"
+    yield f"X-SMARTBMS-COLOUR:{escape_text(event['event_colour'])}"
+    # 原样保留的重复规则，导入时优先使用；按星期重复的规则同时写成标准的 RRULE/EXDATE，供其他日历程序显示
+    for rule in event['repeat_rules']:
+        yield f"X-SMARTBMS-RULE:{escape_text(format_rules([rule]))}"
+        rule_type, specifier, *excluded_times = rule
+        if rule_type == 'day':
+            days = ','.join(day.strip().upper() for day in specifier.split(',') if day.strip())
+            yield f"RRULE:FREQ=WEEKLY;BYDAY={days}"
+            for excluded_time in excluded_times:
+                yield f"EXDATE:{excluded_time[:8]}T{excluded_time[8:12]}00"
+    yield 'END:VEVENT'
+
+
+def write_ical(f, events):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    f.write(fold('BEGIN:VCALENDAR'))
+    f.write(fold('VERSION:2.0'))
+    f.write(fold(f'PRODID:{ICAL_PRODID}'))
+    count = 0
+    for event in events:
+        for line in ical_event_lines(event, stamp):
+            f.write(fold(line))
+        count += 1
+    f.write(fold('END:VCALENDAR'))
+    return count
+
+
+def unfold(f):
+    # 逐行读取并合并续行，产生 (起始行号, 内容行)
+    current, start = None, 0
+    for number, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield start, current
+        current, start = line, number
+    if current:
+        yield start, current
+
+
+def parse_content_line(line):
+    # 'NAME;PARAM=x:VALUE' -> (NAME, {PARAM: x}, VALUE)，参数值可以带引号
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        raise EventImportError(f"Invalid iCalendar line '{line}'.")
+    name, *params = head.split(';')
+    return name.upper(), dict(param.partition('=')[::2] for param in params), value
+
+
+def parse_ical_time(value):
+    # 'YYYYMMDDTHHMMSS'（可带 Z）或全天的 'YYYYMMDD' -> 'YYYYMMDDhhmm'。时区按本地时间处理
+    value = value.strip().rstrip('Z')
+    if len(value) == 8 and value.isdigit():
+        value += 'T0000'
+    date_time = parse_time(value[:8] + value[9:13]) if len(value) >= 13 and value[8] == 'T' else None
+    if date_time is None:
+        raise EventImportError(f"Invalid iCalendar date-time '{value}'.")
+    return date_time.strftime('%Y%m%d%H%M')
+
+
+def day_rule_from_rrule(value, start):
+    parts = dict(part.partition('=')[::2] for part in value.upper().split(';'))
+    unsupported = set(parts) - {'FREQ', 'BYDAY', 'WKST', 'INTERVAL'}
+    if parts.get('INTERVAL', '1') != '1':
+        unsupported.add('INTERVAL')
+    if parts.get('FREQ') == 'DAILY' and 'BYDAY' not in parts:
+        days = list(DAY_CODES)
+    elif parts.get('FREQ') in ('DAILY', 'WEEKLY'):
+        codes = parts.get('BYDAY') or datetime.strptime(start, '%Y%m%d%H%M').strftime('%a')[:2].upper()
+        days = [ICAL_DAYS.get(code.strip()) for code in codes.split(',')]
+        if None in days:
+            unsupported.add('BYDAY')
+    else:
+        unsupported.add('FREQ')
+    if unsupported:
+        raise EventImportError(f"Unsupported RRULE '{value}': only weekly repetition on days of the week can be imported.")
+    return ['day', ', '.join(day for day in DAY_CODES if day in days)]
+
+
+def row_from_vevent(properties):
+    row = {
+        'schedule': properties.get('X-SMARTBMS-SCHEDULE', ''),
+        'zone': properties.get('X-SMARTBMS-ZONE', ''),
+        'event': properties.get('SUMMARY', ''),
+        'setpoint_value': properties.get('X-SMARTBMS-SETPOINT-VALUE', ''),
+        'setpoint_type': properties.get('X-SMARTBMS-SETPOINT-TYPE', ''),
+        'outstation': properties.get('X-SMARTBMS-OUTSTATION', ''),
+        'colour': properties.get('X-SMARTBMS-COLOUR', '')
+    }
+    if 'DTSTART' not in properties:
+        raise EventImportError("VEVENT has no DTSTART.")
+    row['time'] = parse_ical_time(properties['DTSTART'])
+    if properties['rules']:
+        row['repeat_rules'] = [rule for text in properties['rules'] for rule in parse_rules(text)]
+    else:
+        # 其他日历程序导出的事件：RRULE 转换为按星期重复，EXDATE 作为其排除时间
+        rules = [day_rule_from_rrule(value, row['time']) for value in properties['rrules']]
+        if properties['exdates'] and not rules:
+            raise EventImportError("EXDATE without a RRULE cannot be imported.")
+        if rules:
+            rules[0].extend(properties['exdates'])
+        row['repeat_rules'] = [tuple(rule) for rule in rules]
+    return row
+
+
+def read_ical(f):
+    # 逐个 VEVENT 产生 (起始行号, 行)，不把整个日历读入内存
+    properties, start = None, 0
+    for number, line in unfold(f):
+        try:
+            name, params, value = parse_content_line(line)
+            if name == 'BEGIN' and value.upper() == 'VEVENT':
+                properties, start = {'rules': [], 'rrules': [], 'exdates': []}, number
+            elif properties is None:
+                continue
+            elif name == 'END' and value.upper() == 'VEVENT':
+                row = row_from_vevent(properties)
+                properties = None
+                yield start, row
+            elif name == 'X-SMARTBMS-RULE':
+                properties['rules'].append(unescape_text(value))
+            elif name == 'RRULE':
+                properties['rrules'].append(value)
+            elif name == 'EXDATE':
+                properties['exdates'].extend(parse_ical_time(part) for part in value.split(','))
+            elif name == 'DTSTART':
+                properties[name] = value
+            else:
+                properties[name] = unescape_text(value)
+        except EventImportError as e:
+            # 读取阶段的错误以 {'error': ...} 传给校验统一报告，跳过该事件的剩余内容继续读取下一个
+            properties = None
+            yield start or number, {'error': str(e)}
+
+
+def file_format(path, requested=None):
+    if requested:
+        return requested
+    return 'ics' if os.path.splitext(path)[1].lower() in ('.ics', '.ical', '.ifb') else 'csv'
+
+
+def import_file(path, repository=schedule_repository, file_type=None, defaults=None, dry_run=False):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = read_ical(f) if file_format(path, file_type) == 'ics' else read_csv(f)
+        return import_rows(reader, repository, defaults, dry_run)
+
+
+def export_file(path, repository=schedule_repository, file_type=None, schedule_names=None):
+    # 先写入临时文件再替换，导出中途失败不会留下半个文件
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = write_ical if file_format(path, file_type) == 'ics' else write_csv
+        count = writer(f, event_rows(repository, schedule_names))
+    os.replace(temp_path, path)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import or export schedule events as CSV or iCalendar.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='add the events in a CSV or .ics file to the schedules')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--schedule', help='schedule for rows that do not name one')
+    import_parser.add_argument('--zone', help='zone for rows that do not name one')
+    import_parser.add_argument('--dry-run', action='store_true', help='only validate the file')
+    export_parser = subparsers.add_parser('export', help='write the events of the schedules to a CSV or .ics file')
+    export_parser.add_argument('path')
+    export_parser.add_argument('--schedule', action='append', help='export only this schedule (repeatable)')
+    for sub in (import_parser, export_parser):
+        sub.add_argument('--format', choices=['csv', 'ics'], help='file format (default: from the file extension)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        count = export_file(args.path, schedule_repository, args.format, args.schedule)
+        print(f"Exported {count} events to {args.path}.")
+        return
+
+    defaults = {name: value for name, value in (('schedule', args.schedule), ('zone', args.zone)) if value}
+    try:
+        imported, errors = import_file(args.path, schedule_repository, args.format, defaults, args.dry_run)
+    except EventImportError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for line, error in errors:
+        print(f"Line {line}: {error}" if line is not None else error, file=sys.stderr)
+    if errors:
+        sys.exit(1)
+    for schedule_name, count in imported.items():
+        print(f"{'Would import' if args.dry_run else 'Imported'} {count} events into {schedule_name}.")
+
+
+if __name__ == '__main__':
+    main()
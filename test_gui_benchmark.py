@@ -0,0 +1,203 @@
+import os
+# 没有显示器也能运行，必须在导入 PySide6 之前设置
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QObject, QDate, QThreadPool, QTimer, QCoreApplication, QEvent
+import argparse
+import resource
+import tempfile
+import shutil
+import time
+import json
+import sys
+
+from test_workload import generate_dense_week
+from test_benchmark import summarize, compare, environment, REGRESSION_THRESHOLD
+
+DEFAULT_REPEAT = 5
+# 生成的日程都从该周开始
+BENCH_DATE = QDate(2024, 1, 3)
+
+
+def peak_rss_kb():
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class GuiBenchmark:
+    # 在离屏平台上创建 CalendarView，测量主要界面操作的耗时。后台加载的操作会等待线程池完成并处理完
+    # 所有排队的信号，测量的是用户看到结果所需的时间
+    def __init__(self, app, schedules=3, events_per_cell=2, repeat=DEFAULT_REPEAT):
+        self.app = app
+        self.schedules = schedules
+        self.events_per_cell = events_per_cell
+        self.repeat = repeat
+        self.workdir = None
+        self.previous_dir = None
+        self.view = None
+        self.paths = []
+
+    def settle(self):
+        pool = QThreadPool.globalInstance()
+        while True:
+            pool.waitForDone()
+            self.app.processEvents()
+            if pool.activeThreadCount() == 0:
+                self.app.processEvents()
+                # deleteLater 只在回到事件循环时执行，这里手动处理，对象计数才准确
+                QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+                return
+
+    def setup(self):
+        # 日程仓库使用相对路径 Schedules，在临时目录中运行
+        self.previous_dir = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix='smartbms-gui-bench-')
+        os.chdir(self.workdir)
+        self.paths = [os.path.join('Schedules', os.path.basename(path)) for path in
+                      generate_dense_week('Schedules', self.schedules, self.events_per_cell)]
+        from test_GUI import CalendarView
+        self.view = CalendarView()
+        self.view.show()
+        self.settle()
+
+    def teardown(self):
+        from test_snapshot import schedule_snapshot
+        self.view.schedule_watcher.timer.stop()
+        self.view.close()
+        self.settle()
+        schedule_snapshot.flush()
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def object_counts(self):
+        return {
+            'widgets': len(QApplication.allWidgets()),
+            'view_objects': len(self.view.findChildren(QObject)),
+            'chips': sum(len(events) for events in self.view.timeline_view.model.cells.values())
+        }
+
+    def load_schedules(self):
+        self.view.loadSchedules()
+
+    def update_timeline(self):
+        self.view.current_schedule_path = self.paths[0]
+        self.view.updateTimeline(BENCH_DATE)
+
+    def load_week_cold(self):
+        from test_week_cache import week_cache
+        from test_schedule_store import schedule_repository
+        # 丢弃周布局缓存和已解析的文件，测量从磁盘读取到显示
+        week_cache.on_file_changed(self.paths[0], False)
+        schedule_repository.invalidate(self.paths[0])
+        self.view.timeline_view.loadEventsFromXML(self.paths[0], BENCH_DATE.addDays(-BENCH_DATE.dayOfWeek() + 1))
+
+    def load_week_warm(self):
+        timeline = self.view.timeline_view
+        timeline.loadEventsFromXML(self.paths[0], BENCH_DATE.addDays(-BENCH_DATE.dayOfWeek() + 1))
+
+    def load_overlay(self):
+        self.view.timeline_view.loadOverlay(self.paths, BENCH_DATE.addDays(-BENCH_DATE.dayOfWeek() + 1))
+
+    def clear_events(self):
+        self.view.timeline_view.clearEvents()
+
+    def close_modal(self):
+        dialog = QApplication.activeModalWidget()
+        if dialog is not None:
+            dialog.reject()
+        else:
+            QTimer.singleShot(0, self.close_modal)
+
+    def open_event_dialog(self):
+        from test_event_creation import EventDialog
+        dialog = EventDialog(self.view)
+        dialog.show()
+        self.settle()
+        dialog.close()
+        dialog.deleteLater()
+
+    def view_event(self):
+        # view_event 使用模态对话框，显示后由定时器关闭
+        timeline = self.view.timeline_view
+        occurrence, event = next(iter(timeline.model.cells.values()))[0]
+        QTimer.singleShot(0, self.close_modal)
+        timeline.handle_chip_click(event)
+
+    def run(self):
+        # 每项操作之前先准备好它需要的状态
+        benchmarks = [
+            ('loadSchedules', None, self.load_schedules),
+            ('updateTimeline', None, self.update_timeline),
+            ('loadEventsFromXML_cold', None, self.load_week_cold),
+            ('loadEventsFromXML_warm', self.load_week_warm, self.load_week_warm),
+            ('loadOverlay', None, self.load_overlay),
+            ('clearEvents', self.load_week_warm, self.clear_events),
+            ('EventDialog', None, self.open_event_dialog),
+            ('EventInfor.view_event', self.load_week_warm, self.view_event)
+        ]
+        results = {}
+        self.setup()
+        try:
+            for name, prepare, operation in benchmarks:
+                samples = []
+                for _ in range(self.repeat):
+                    if prepare is not None:
+                        prepare()
+                        self.settle()
+                    samples.extend(self.measure_once(operation))
+                result = summarize(samples)
+                result['peak_rss_kb'] = peak_rss_kb()
+                result['objects'] = self.object_counts()
+                results[name] = result
+        finally:
+            self.teardown()
+        return results
+
+    def measure_once(self, operation):
+        started = time.perf_counter()
+        operation()
+        self.settle()
+        return [time.perf_counter() - started]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CalendarView and WeeklyScheduleView offscreen.')
+    parser.add_argument('--schedules', type=int, default=3, help='number of generated schedules')
+    parser.add_argument('--events-per-cell', type=int, default=2, help='events in every hour/day cell')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs per operation')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = GuiBenchmark(app, args.schedules, args.events_per_cell, args.repeat).run()
+    for name, result in results.items():
+        objects = result['objects']
+        print(f"{name:<24} mean {result['mean'] * 1000:9.3f} ms   p95 {result['p95'] * 1000:9.3f} ms   "
+              f"rss {result['peak_rss_kb'] / 1024:7.1f} MB   widgets {objects['widgets']}   chips {objects['chips']}")
+
+    parameters = {'schedules': args.schedules, 'events_per_cell': args.events_per_cell}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'parameters': parameters, 'repeat': args.repeat,
+                       'results': results}, f, indent=2)
+
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('parameters') != parameters:
+            print("Warning: the baseline was recorded with different parameters.", file=sys.stderr)
+        for name, before, after, change in compare(results, baseline['results']):
+            flag = '  REGRESSION' if change > REGRESSION_THRESHOLD else ''
+            regressions += bool(flag)
+            print(f"{name:<24} {before * 1000:9.3f} ms -> {after * 1000:9.3f} ms  {change:+7.1%}{flag}")
+    sys.stdout.flush()
+    # 不等待后台线程（快照写入、预取）退出
+    os._exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import threading
+import json
+import sys
+
+# 默认的 Outstation 网关地址
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 47808
+# 每个网关保持的长连接数量，以及同时发送的批次数量
+POOL_SIZE = 4
+MAX_CONCURRENCY = 16
+# 同一分钟到期的设定值在该时间窗口（秒）内合并，每批最多的命令数
+BATCH_WINDOW = 0.05
+MAX_BATCH = 100
+# 待发送队列的长度上限，满了以后调度器会被阻塞（背压）
+QUEUE_SIZE = 10000
+MAX_RETRIES = 3
+RETRY_DELAY = 0.2
+REPLY_TIMEOUT = 5.0
+# 建立连接的超时时间（秒）：网关不应答时按失败处理并重试，不会一直占用发送名额
+CONNECT_TIMEOUT = 5.0
+
+
+def command_from_dispatch(dispatch):
+    return {
+        'zone': dispatch['zone_id'],
+        'event': dispatch['event_name'],
+        'schedule': dispatch['schedule_name'],
+        'type': dispatch['setpoint_type'],
+        'value': dispatch['setpoint_value'],
+        'time': dispatch['fire_time'].strftime('%Y%m%d%H%M')
+    }
+
+
+class DispatchError(Exception):
+    pass
+
+
+class ConnectionPool:
+    # 到一个网关的持久连接池：连接按需建立，用完放回，出错的连接直接关闭
+    def __init__(self, host, port, size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.idle = asyncio.LifoQueue()
+        self.slots = asyncio.Semaphore(size)
+
+    async def acquire(self):
+        await self.slots.acquire()
+        try:
+            while not self.idle.empty():
+                reader, writer = self.idle.get_nowait()
+                if not writer.is_closing():
+                    return reader, writer
+            try:
+                return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
+            except asyncio.TimeoutError:
+                raise DispatchError(f"Connecting to {self.host}:{self.port} timed out.")
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, broken=False):
+        if broken:
+            connection[1].close()
+        else:
+            self.idle.put_nowait(connection)
+        self.slots.release()
+
+    async def close(self):
+        while not self.idle.empty():
+            _, writer = self.idle.get_nowait()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+class OutstationDispatcher:
+    # 按 Outstation 合并到期的设定值，通过连接池批量发送：并发数有上限，失败按指数退避重试，
+    # 队列满时 submit 会等待。同一 Outstation 的批次按顺序发送
+    def __init__(self, resolve=None, pool_size=POOL_SIZE, concurrency=MAX_CONCURRENCY, batch_window=BATCH_WINDOW,
+                 max_batch=MAX_BATCH, queue_size=QUEUE_SIZE, max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY,
+                 connect_timeout=CONNECT_TIMEOUT):
+        # resolve(outstation) 返回该 Outstation 所在网关的 (host, port)
+        self.resolve = resolve or (lambda outstation: (DEFAULT_HOST, DEFAULT_PORT))
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.connect_timeout = connect_timeout
+        self.pools = {}
+        self.outstation_locks = {}
+        self.sequence = 0
+        self.stats = {'commands': 0, 'batches': 0, 'retries': 0, 'failed_commands': 0}
+        self.failures = []
+        self.queue = None
+        self.semaphore = None
+        self.collector = None
+        self.sending = set()
+        self.loop = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.collector = asyncio.create_task(self.collect())
+
+    async def submit(self, dispatch):
+        await self.queue.put(dispatch)
+
+    def submit_threadsafe(self, dispatch):
+        # 供调度线程调用，队列满时阻塞调用者
+        asyncio.run_coroutine_threadsafe(self.submit(dispatch), self.loop).result()
+
+    async def collect(self):
+        while True:
+            # 先占用一个发送名额再从队列取命令：所有名额都在发送时命令留在队列中，
+            # 队列满后 submit 等待（背压）
+            await self.semaphore.acquire()
+            try:
+                batch = [await self.queue.get()]
+            except BaseException:
+                self.semaphore.release()
+                raise
+            # 在时间窗口内尽量多取，使同一分钟到期的设定值一起发送
+            deadline = self.loop.time() + self.batch_window
+            while len(batch) < self.max_batch * self.concurrency:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            groups = {}
+            for dispatch in batch:
+                groups.setdefault(dispatch['outstation'], []).append(command_from_dispatch(dispatch))
+            acquired = True
+            for outstation, commands in groups.items():
+                for start in range(0, len(commands), self.max_batch):
+                    if not acquired:
+                        await self.semaphore.acquire()
+                    acquired = False
+                    # 名额和队列计数在批次发送完成后由 send_batch 释放
+                    task = asyncio.create_task(self.send_batch(outstation, commands[start:start + self.max_batch]))
+                    self.sending.add(task)
+                    task.add_done_callback(self.sending.discard)
+
+    def pool_for(self, outstation):
+        endpoint = self.resolve(outstation)
+        pool = self.pools.get(endpoint)
+        if pool is None:
+            pool = self.pools[endpoint] = ConnectionPool(*endpoint, size=self.pool_size, connect_timeout=self.connect_timeout)
+        return pool
+
+    async def send_batch(self, outstation, commands):
+        # 调用前 collect 已经为该批次占用了一个发送名额
+        lock = self.outstation_locks.setdefault(outstation, asyncio.Lock())
+        try:
+            async with lock:
+                for attempt in range(self.max_retries + 1):
+                    if attempt:
+                        self.stats['retries'] += 1
+                        await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                    try:
+                        await self.send_once(outstation, commands)
+                    except (OSError, asyncio.TimeoutError, DispatchError, ValueError) as e:
+                        error = e
+                        continue
+                    self.stats['batches'] += 1
+                    self.stats['commands'] += len(commands)
+                    return
+                self.stats['failed_commands'] += len(commands)
+                self.failures.append((outstation, commands, str(error)))
+        finally:
+            self.semaphore.release()
+            for _ in commands:
+                self.queue.task_done()
+
+    async def send_once(self, outstation, commands):
+        pool = self.pool_for(outstation)
+        connection = await pool.acquire()
+        broken = True
+        try:
+            reader, writer = connection
+            self.sequence += 1
+            sequence = self.sequence
+            writer.write((json.dumps({'seq': sequence, 'outstation': outstation, 'commands': commands}) + '\n').encode('utf-8'))
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), REPLY_TIMEOUT)
+            if not line:
+                raise DispatchError('Connection closed by outstation.')
+            reply = json.loads(line)
+            if reply.get('seq') != sequence:
+                raise DispatchError('Reply does not match the request.')
+            broken = False
+            if not reply.get('ok'):
+                raise DispatchError(reply.get('error', 'Outstation rejected the commands.'))
+        finally:
+            pool.release(connection, broken)
+
+    async def drain(self):
+        # 等待队列中和正在发送的命令全部完成
+        await self.queue.join()
+        while self.sending:
+            await asyncio.gather(*list(self.sending))
+
+    async def close(self):
+        await self.drain()
+        self.collector.cancel()
+        for pool in self.pools.values():
+            await pool.close()
+
+
+class DispatcherThread:
+    # 在后台线程中运行事件循环，把 OutstationDispatcher 作为 SetpointScheduler 的 sink
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.dispatcher.start(), self.loop).result()
+
+    def __call__(self, dispatch):
+        self.dispatcher.submit_threadsafe(dispatch)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.dispatcher.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class OutstationSimulator:
+    # 本地的 Outstation 网关替身：接收按行分隔的 JSON 请求，记录收到的命令并应答。
+    # latency 为每个请求的处理延迟，fail_every 为每隔多少个请求断开一次连接（用于测试重试）
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, latency=0.0, fail_every=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.connections = 0
+        self.received = {}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.requests += 1
+                if self.fail_every and self.requests % self.fail_every == 0:
+                    break
+                request = json.loads(line)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                self.received.setdefault(request['outstation'], []).extend(request['commands'])
+                reply = {'seq': request['seq'], 'ok': True, 'applied': len(request['commands'])}
+                writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send due setpoints to outstations, or run a local outstation simulator.')
+    parser.add_argument('mode', choices=('run', 'simulate'))
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulator delay per request in seconds')
+    args = parser.parse_args()
+
+    if args.mode == 'simulate':
+        async def simulate():
+            simulator = OutstationSimulator(args.host, args.port, args.latency)
+            port = await simulator.start()
+            print(f"Outstation simulator listening on {args.host}:{port}", file=sys.stderr)
+            await simulator.server.serve_forever()
+        try:
+            asyncio.run(simulate())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    from test_setpoint_scheduler import SetpointScheduler
+    from test_schedule_store import schedule_repository
+    sink = DispatcherThread(OutstationDispatcher(lambda outstation: (args.host, args.port)))
+    sink.start()
+    scheduler = SetpointScheduler(schedule_repository, sink)
+    scheduler.load()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from collections import deque
+import threading
+import time
+import json
+import os
+
+# 设置该环境变量后启动时即开始记录
+PROFILE_ENV = 'SMARTBMS_PROFILE'
+# Chrome 跟踪中最多保留的最近记录数量
+TRACE_LIMIT = 100000
+
+
+class NullSpan:
+    # 关闭记录时所有 span() 返回同一个对象，进入和退出什么也不做
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.started = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.started, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    # 轻量的计时记录：按名称汇总次数、总耗时和最长耗时，同时保留最近的记录用于导出 Chrome 跟踪（chrome://tracing）。
+    # 关闭时 span() 只检查一个属性并返回共享的空对象，热点路径上的开销可以忽略
+    def __init__(self, enabled=False, trace_limit=TRACE_LIMIT):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.trace = deque(maxlen=trace_limit)
+        self.origin = time.perf_counter_ns()
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def profiled(self, name):
+        # 装饰器形式，关闭时只多一次属性检查
+        def decorate(func):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Span(self, name):
+                    return func(*args, **kwargs)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            wrapper.__wrapped__ = func
+            return wrapper
+        return decorate
+
+    def record(self, name, started, finished):
+        duration = finished - started
+        with self.lock:
+            total = self.totals.get(name)
+            if total is None:
+                self.totals[name] = [1, duration, duration]
+            else:
+                total[0] += 1
+                total[1] += duration
+                if duration > total[2]:
+                    total[2] = duration
+            self.trace.append((name, started, duration, threading.get_ident()))
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.totals.clear()
+            self.trace.clear()
+
+    def stats(self):
+        # 名称 -> 次数、总耗时、平均和最长耗时（毫秒），按总耗时从大到小排列
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: item[1][1], reverse=True)
+        return {name: {'count': count, 'total_ms': total / 1e6, 'mean_ms': total / count / 1e6, 'max_ms': longest / 1e6}
+                for name, (count, total, longest) in totals}
+
+    def chrome_trace(self):
+        with self.lock:
+            trace = list(self.trace)
+        pid = os.getpid()
+        return {'traceEvents': [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                                 'ts': (started - self.origin) / 1000, 'dur': duration / 1000}
+                                for name, started, duration, tid in trace],
+                'displayTimeUnit': 'ms'}
+
+    def dump_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.stats(), f, indent=2)
+
+    def dump_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+profiler = Profiler(enabled=os.environ.get(PROFILE_ENV, '') not in ('', '0'))
+span = profiler.span
+profiled = profiler.profiled
@@ -0,0 +1,303 @@
+from datetime import datetime, date, timedelta
+from bisect import bisect_left, bisect_right
+import threading
+import heapq
+
+from test_profiling import span
+
+# 星期缩写与位掩码位置的对应关系，星期一为第0位
+WEEKDAY_BITS = {"Mo": 0, "Tu": 1, "We": 2, "Th": 3, "Fr": 4, "Sa": 5, "Su": 6}
+
+# 已编译规则的缓存上限
+RULE_CACHE_SIZE = 4096
+
+# Time Specifier 各字段在字符串中的位置以及取值范围
+TIME_FIELDS = (
+    ('month', 4, 6, 1, 12),
+    ('day', 6, 8, 1, 31),
+    ('hour', 8, 10, 0, 23),
+    ('minute', 10, 12, 0, 59),
+)
+
+
+def parse_event_time(text):
+    # 去除所有非数字字符，兼容 ' "202401011200" ' 和 '202401011200' 两种写法
+    digits = ''.join(filter(str.isdigit, text or ''))
+    return datetime.strptime(digits, '%Y%m%d%H%M')
+
+
+def minute_key(dt):
+    # 将时间转换为 yyyymmddHHMM 形式的整数，便于排序和比较
+    return ((dt.year * 100 + dt.month) * 100 + dt.day) * 10000 + dt.hour * 100 + dt.minute
+
+
+def day_key(d):
+    return (d.year * 100 + d.month) * 100 + d.day
+
+
+def pattern_mask(pattern, low, high):
+    # 将带通配符的两位字段编译为位掩码，第 n 位表示取值 n 是否匹配
+    mask = 0
+    for value in range(low, high + 1):
+        text = f'{value:02d}'
+        if all(p == '*' or p == c for p, c in zip(pattern, text)):
+            mask |= 1 << value
+    return mask
+
+
+def mask_values(mask, low, high):
+    return tuple(value for value in range(low, high + 1) if mask >> value & 1)
+
+
+class DayRule:
+    kind = 'day'
+
+    def __init__(self, specifier, excluded_times=()):
+        self.specifier = specifier
+        self.weekday_mask = 0
+        for day in specifier.split(','):
+            day = day.strip()
+            if day not in WEEKDAY_BITS:
+                raise ValueError(f"Unknown day '{day}' in day specifier.")
+            self.weekday_mask |= 1 << WEEKDAY_BITS[day]
+        if not self.weekday_mask:
+            raise ValueError("Day specifier does not contain any day.")
+        # Day Specifier 的排除时间按整天处理
+        self.excluded = tuple(sorted({minute_key(parse_event_time(t)) // 10000 for t in excluded_times}))
+
+    @classmethod
+    def from_compiled(cls, specifier, weekday_mask, excluded_keys):
+        # 由快照中预编译的数据直接构造，不再解析字符串
+        rule = cls.__new__(cls)
+        rule.specifier = specifier
+        rule.weekday_mask = weekday_mask
+        rule.excluded = tuple(sorted({key // 10000 for key in excluded_keys}))
+        return rule
+
+    def excluded_between(self, start, end):
+        lo = bisect_left(self.excluded, day_key(start))
+        hi = bisect_left(self.excluded, day_key(end) + 1)
+        return frozenset(self.excluded[lo:hi])
+
+    def occurrences(self, dtstart, start, end):
+        # 事件在 dtstart 的时分重复，起始日期不早于 dtstart
+        start = max(start, dtstart)
+        if start >= end:
+            return
+        excluded = self.excluded_between(start.date(), end.date())
+        day = start.date()
+        last_day = end.date()
+        while day <= last_day:
+            if self.weekday_mask >> day.weekday() & 1 and day_key(day) not in excluded:
+                occurrence = datetime(day.year, day.month, day.day, dtstart.hour, dtstart.minute)
+                if start <= occurrence < end:
+                    yield occurrence
+            day += timedelta(days=1)
+
+
+class TimeRule:
+    kind = 'time'
+
+    def __init__(self, specifier, excluded_times=()):
+        if len(specifier) != 12 or not all(c.isdigit() or c == '*' for c in specifier):
+            raise ValueError(f"Invalid time specifier '{specifier}'.")
+        self.specifier = specifier
+        self.year_pattern = specifier[0:4]
+        self.fixed_year = int(self.year_pattern) if self.year_pattern.isdigit() else None
+        masks = {}
+        for name, begin, stop, low, high in TIME_FIELDS:
+            masks[name] = pattern_mask(specifier[begin:stop], low, high)
+        self.set_masks(masks['month'], masks['day'], masks['hour'], masks['minute'])
+        # Time Specifier 的排除时间精确到分钟
+        self.excluded = tuple(sorted({minute_key(parse_event_time(t)) for t in excluded_times}))
+
+    @classmethod
+    def from_compiled(cls, specifier, month_mask, day_mask, hour_mask, minute_mask, excluded_keys):
+        # 由快照中预编译的数据直接构造，不再解析字符串
+        rule = cls.__new__(cls)
+        rule.specifier = specifier
+        rule.year_pattern = specifier[0:4]
+        rule.fixed_year = int(rule.year_pattern) if rule.year_pattern.isdigit() else None
+        rule.set_masks(month_mask, day_mask, hour_mask, minute_mask)
+        rule.excluded = tuple(sorted(set(excluded_keys)))
+        return rule
+
+    def set_masks(self, month_mask, day_mask, hour_mask, minute_mask):
+        self.month_mask = month_mask
+        self.day_mask = day_mask
+        self.hour_mask = hour_mask
+        self.minute_mask = minute_mask
+        self.hours = mask_values(hour_mask, 0, 23)
+        self.minutes = mask_values(minute_mask, 0, 59)
+
+    def year_matches(self, year):
+        if self.fixed_year is not None:
+            return year == self.fixed_year
+        return all(p == '*' or p == c for p, c in zip(self.year_pattern, str(year)))
+
+    def excluded_between(self, start, end):
+        lo = bisect_left(self.excluded, minute_key(start))
+        hi = bisect_left(self.excluded, minute_key(end))
+        return frozenset(self.excluded[lo:hi])
+
+    def occurrences(self, dtstart, start, end):
+        start = max(start, dtstart)
+        if start >= end or not self.month_mask or not self.day_mask or not self.hours or not self.minutes:
+            return
+        excluded = self.excluded_between(start, end)
+        day = start.date()
+        last_day = end.date()
+        while day <= last_day:
+            # 年份或月份不匹配时整段跳过，避免逐日检查
+            if not self.year_matches(day.year):
+                day = date(day.year + 1, 1, 1)
+                continue
+            if not self.month_mask >> day.month & 1:
+                day = date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+                continue
+            if self.day_mask >> day.day & 1:
+                base_key = day_key(day) * 10000
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        if base_key + hour * 100 + minute in excluded:
+                            continue
+                        occurrence = datetime(day.year, day.month, day.day, hour, minute)
+                        if occurrence >= end:
+                            return
+                        if occurrence >= start:
+                            yield occurrence
+            day += timedelta(days=1)
+
+
+compiled_rules = {}
+
+
+def prime_rule(rule, compiled):
+    # 将已经编译好的规则（例如从快照中读取的）放入缓存
+    if len(compiled_rules) >= RULE_CACHE_SIZE:
+        compiled_rules.clear()
+    compiled_rules[tuple(rule)] = compiled
+
+
+def compile_rule(rule):
+    # 同样的规则只编译一次
+    rule = tuple(rule)
+    compiled = compiled_rules.get(rule)
+    if compiled is not None:
+        return compiled
+    rule_type, specifier, *excluded_times = rule
+    if rule_type == 'day':
+        compiled = DayRule(specifier, excluded_times)
+    elif rule_type == 'time':
+        compiled = TimeRule(specifier, excluded_times)
+    else:
+        raise ValueError(f"Unknown repeat rule type '{rule_type}'.")
+    prime_rule(rule, compiled)
+    return compiled
+
+
+def compile_rules(repeat_rules):
+    return tuple(compile_rule(rule) for rule in repeat_rules or ())
+
+
+def iter_occurrences(event_time, repeat_rules, start, end):
+    # 按时间顺序惰性地产生事件在 [start, end) 内的所有发生时间，包含事件本身的时间
+    streams = [rule.occurrences(event_time, start, end) for rule in compile_rules(repeat_rules)]
+    if start <= event_time < end:
+        streams.append(iter((event_time,)))
+    previous = None
+    for occurrence in heapq.merge(*streams):
+        if occurrence != previous:
+            yield occurrence
+            previous = occurrence
+
+
+def event_key(event):
+    # 事件在日程中的标识：(Zone, 事件名称)
+    return (event['zone_id'], event['event_name'])
+
+
+def week_start_of(d):
+    # 返回所在周的星期一
+    if isinstance(d, datetime):
+        d = d.date()
+    return d - timedelta(days=d.weekday())
+
+
+class OccurrenceIndex:
+    # 按周索引事件的发生时间：单次事件在建立索引时直接分桶，
+    # 重复事件按周惰性展开并缓存，切换周时只需处理该周内的发生时间。
+    # 界面的后台加载、预取线程和修改事件的线程会同时使用同一个索引，所有读写都持有 self.lock
+    def __init__(self, events):
+        self.lock = threading.RLock()
+        self.single_by_week = {}
+        self.by_key = {}
+        recurring = []
+        for event in events:
+            self.by_key[event_key(event)] = event
+            if event['repeat_rules']:
+                recurring.append(event)
+            else:
+                week = week_start_of(event['event_time'])
+                self.single_by_week.setdefault(week, []).append((event['event_time'], event))
+        recurring.sort(key=lambda e: e['event_time'])
+        self.recurring = recurring
+        self.recurring_starts = [e['event_time'] for e in recurring]
+        self.weeks = {}
+
+    def week(self, week_start):
+        week_start = week_start_of(week_start)
+        with self.lock:
+            cached = self.weeks.get(week_start)
+            if cached is not None:
+                return cached
+
+            start = datetime(week_start.year, week_start.month, week_start.day)
+            end = start + timedelta(days=7)
+            with span('occurrences.expand'):
+                occurrences = list(self.single_by_week.get(week_start, ()))
+                # 只有基准时间早于本周结束的重复事件才可能在本周发生
+                for event in self.recurring[:bisect_left(self.recurring_starts, end)]:
+                    for occurrence in iter_occurrences(event['event_time'], event['repeat_rules'], start, end):
+                        occurrences.append((occurrence, event))
+                occurrences.sort(key=lambda item: item[0])
+            self.weeks[week_start] = occurrences
+            return occurrences
+
+    def drop_weeks_from(self, week_start):
+        # 重复事件会影响其基准时间之后的所有周
+        with self.lock:
+            for week in [week for week in self.weeks if week >= week_start]:
+                del self.weeks[week]
+
+    def add(self, event):
+        week = week_start_of(event['event_time'])
+        with self.lock:
+            self.by_key[event_key(event)] = event
+            if event['repeat_rules']:
+                position = bisect_right(self.recurring_starts, event['event_time'])
+                self.recurring.insert(position, event)
+                self.recurring_starts.insert(position, event['event_time'])
+                self.drop_weeks_from(week)
+            else:
+                self.single_by_week.setdefault(week, []).append((event['event_time'], event))
+                self.weeks.pop(week, None)
+
+    def remove(self, key):
+        # 按 (Zone, 事件名称) 移除事件，只有受影响的周需要重新展开
+        with self.lock:
+            event = self.by_key.pop(key, None)
+            if event is None:
+                return
+            week = week_start_of(event['event_time'])
+            if event['repeat_rules']:
+                position = bisect_left(self.recurring_starts, event['event_time'])
+                while self.recurring[position] is not event:
+                    position += 1
+                del self.recurring[position]
+                del self.recurring_starts[position]
+                self.drop_weeks_from(week)
+            else:
+                bucket = self.single_by_week[week]
+                bucket[:] = [item for item in bucket if item[1] is not event]
+                self.weeks.pop(week, None)
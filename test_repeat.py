@@ -5,6 +5,8 @@ from PySide6.QtGui import QRegularExpressionValidator
 from functools import partial
 from datetime import datetime
 
+from test_validation import validate_repeat_rule
+
 class RepeatRulesDialog(QDialog):
     def __init__(self, specifiers, parent=None):
         super().__init__(parent)
@@ -249,15 +251,10 @@ class DaySpecifierDialog(QDialog):
         return ('day', selected_days, *excluded_times)
 
     def attempt_accept(self):
-        # 检查是否有天被选中
-        if not any(checkbox.isChecked() for checkbox in self.checkboxes.values()):
-            QMessageBox.critical(self, "Error", "You have not set the Day Specifier, save failed.")
-            return
-        
-        # 检查排除时间是否有重复
-        times = [datetime_edit.dateTime().toString("yyyyMMddHHmm") for datetime_edit in self.excluded_times]
-        if len(times) != len(set(times)):
-            QMessageBox.critical(self, "Error", "There is a duplicate Excluded Time, save failed.")
+        # 与命令行和批量导入使用相同的校验规则
+        error = validate_repeat_rule(self.get_selected_days())
+        if error:
+            QMessageBox.critical(self, "Error", error)
             return
         self.accept()
 
@@ -371,71 +368,10 @@ class TimeSpecifierDialog(QDialog):
         return ('time', time_format, *excluded_times)
 
     def save_time_format(self):
-        # 获取各部分的输入
-        year = self.year_edit.text()
-        month = self.month_edit.text()
-        day = self.day_edit.text()
-        hour = self.hour_edit.text()
-        minute = self.minute_edit.text()
-
-        # 组合输入数据
-        time_format = f"{year}{month}{day}{hour}{minute}"
-
-        # 检查是否没有设置Time format
-        if not any([year, month, day, hour, minute]):
-            QMessageBox.critical(self, "Error", "You have not set the Time Specifier, save failed.")
-            return
-
-        # 检查是否全部为通配符
-        if time_format.count('*') == 12:
-            QMessageBox.critical(self, "Error", "The time format cannot be all '*'. Please specify at least one part.")
-            return
-
-        # 检查每个部分是否完全填满
-        if not all([len(year) == 4, len(month) == 2, len(day) == 2, len(hour) == 2, len(minute) == 2]):
-            QMessageBox.critical(self, "Error", "Each part of the time format must be fully filled. Please correct your entries.")
-            return
-        
-        if not self.validate_time_format(year, month, day, hour, minute):
-            QMessageBox.critical(self, "Error", "Invalid date or time format.")
-            return
-
-        # 检查排除时间是否有重复
-        times = [datetime_edit.dateTime().toString("yyyyMMddHHmm") for datetime_edit in self.excluded_times]
-        if len(times) != len(set(times)):
-            QMessageBox.critical(self, "Error", "There is a duplicate Excluded Time, save failed.")
-            return
-
-        # 检查Time format是否全为数字，如果是，则不允许设置Excluded Time
-        if time_format.isdigit() and self.excluded_times:
-            QMessageBox.critical(self, "Error", "Exclusion time cannot be set for specific time repetitions.")
+        # 与命令行和批量导入使用相同的校验规则
+        error = validate_repeat_rule(self.get_selected_time())
+        if error:
+            QMessageBox.critical(self, "Error", error)
             return
 
         self.accept()
-    
-    def validate_time_part(self, part, first_digit_options, second_digit_map):
-        if len(part) != 2:
-            return False
-        first_digit, second_digit = part[0], part[1]
-        valid_second_digits = second_digit_map.get(first_digit, '*')  # 默认允许任何值，如果第一位是星号
-        if (first_digit not in first_digit_options + '*') or (second_digit not in valid_second_digits + '*'):
-            return False
-        return True
-
-    def validate_year(self, year):
-        return len(year) == 4 and all(c.isdigit() or c == '*' for c in year)
-
-    def validate_time_format(self, year, month, day, hour, minute):
-        if not self.validate_year(year):
-            return False
-        if not all([len(month) == 2, len(day) == 2, len(hour) == 2, len(minute) == 2]):
-            return False
-        if not self.validate_time_part(month, '01', {'0': '123456789', '1': '012'}):
-            return False
-        if not self.validate_time_part(day, '0123', {'0': '123456789', '1': '0123456789', '2': '0123456789', '3': '01'}):
-            return False
-        if not self.validate_time_part(hour, '012', {'0': '0123456789', '1': '0123456789', '2': '0123'}):
-            return False
-        if not self.validate_time_part(minute, '012345', {'0': '0123456789', '1': '0123456789', '2': '0123456789', '3': '0123456789', '4': '0123456789', '5': '0123456789'}):
-            return False
-        return True
\ No newline at end of file
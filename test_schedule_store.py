@@ -0,0 +1,1163 @@
+import xml.etree.ElementTree as ET
+import threading
+import weakref
+import json
+import glob
+import time
+import os
+
+from test_recurrence import OccurrenceIndex, event_key, iter_occurrences, parse_event_time, week_start_of
+from test_profiling import span
+from datetime import datetime, timedelta
+
+SCHEDULES_DIR = 'Schedules'
+INDEX_FILE = '.schedule_index.json'
+INDEX_VERSION = 3
+# 目录的 mtime 未变时，两次逐个 stat 已索引文件之间的最短间隔（秒）：外部程序原地修改的文件最晚在此之后被发现
+INDEX_SWEEP_INTERVAL = 1.0
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_THRESHOLD = 200
+# 超过该大小（字节）且尚未缓存的日程文件按周流式读取，不再建立整棵树
+STREAMING_THRESHOLD = 8 * 1024 * 1024
+# update_op 可以修改的事件字段，与 update_event 的参数相同
+EVENT_FIELDS = ('event_name', 'date_time', 'setpoint_value', 'setpoint_type', 'repeat_rules', 'schedule_name', 'zone_name', 'outstation_identifier', 'colour')
+
+
+class ScheduleError(Exception):
+    pass
+
+
+def file_stat_key(path):
+    # 以修改时间和文件大小判断缓存是否仍然有效
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def journal_path(path):
+    return path + JOURNAL_SUFFIX
+
+
+def schedule_stat_key(path):
+    # 日程文件和其日志文件共同决定缓存是否有效
+    xml_stat = file_stat_key(path)
+    try:
+        journal_stat = file_stat_key(journal_path(path))
+    except FileNotFoundError:
+        journal_stat = (0, 0)
+    return [*xml_stat, *journal_stat]
+
+
+def parse_events(root):
+    # 将日程XML中的所有事件解析为字典列表
+    schedule_name = root.get('name')
+    events = []
+
+    building = root.find('building')
+    if building is None:
+        return events
+
+    for zone in building.findall('zone'):
+        zone_id = zone.get('ID')
+        for event in zone.findall('event'):
+            events.append(event_from_element(event, schedule_name, zone_id))
+    return events
+
+
+def event_from_element(event, schedule_name, zone_id):
+    event_setpoint = event.find('setpoint')
+
+    # 解析重复规则
+    repeat_rules = []
+    for rrule in event.findall('rrule'):
+        repeat = rrule.find('repeat')
+        exc_days = [exc_day.text.strip().strip('"') for exc_day in rrule.findall('excDay')]
+        repeat_rules.append((repeat.get('type'), repeat.get('specifier'), *exc_days))
+
+    return {
+        'event_time': parse_event_time(event.find('eventTime').text),
+        'event_name': event.get('ID'),
+        'event_colour': event.get('colour', '(255, 255, 255)'),
+        'setpoint_value': event_setpoint.get('value'),
+        'setpoint_type': event_setpoint.get('type'),
+        'event_outstation': event.get('outstation'),
+        'repeat_rules': repeat_rules,
+        'schedule_name': schedule_name,
+        'zone_id': zone_id
+    }
+
+
+def find_by_id(parent, tag, element_id):
+    # 按 ID 查找元素，避免把名称拼接进 XPath
+    for element in parent.iter(tag):
+        if element.get('ID') == element_id:
+            return element
+    return None
+
+
+def build_event_element(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+    event = ET.Element('event', ID=event_name, outstation=outstation_identifier, colour=str(colour))
+    ET.SubElement(event, 'eventTime').text = date_time
+    ET.SubElement(event, 'setpoint', value=setpoint_value, type=setpoint_type)
+
+    # 处理重复规则
+    for rule in repeat_rules or ():
+        rrule = ET.SubElement(event, 'rrule')
+        ET.SubElement(rrule, 'repeat', specifier=rule[1], type=str(rule[0]))
+        for excluded_time in rule[2:]:
+            ET.SubElement(rrule, 'excDay').text = excluded_time
+    return event
+
+
+def event_triplet(zone, event):
+    return [zone.get('ID'), event.get('ID'), event.get('outstation')]
+
+
+def apply_record(root, record):
+    # 将一条修改记录应用到日程树上，返回 (被移除的事件, 新增的事件) 供索引增量更新
+    building = root.find('.//building')
+    zone = find_by_id(building, 'zone', record['zone']) if building is not None else None
+    if zone is None:
+        return None, None
+    removed = None
+    if record['op'] == 'put':
+        event = ET.fromstring(record['xml'])
+        old_event = find_by_id(zone, 'event', record['replace']) if record.get('replace') is not None else None
+        if old_event is not None:
+            removed = event_triplet(zone, old_event)
+            position = list(zone).index(old_event)
+            zone.remove(old_event)
+            zone.insert(position, event)
+        else:
+            zone.append(event)
+        return removed, event_triplet(zone, event)
+    if record['op'] == 'delete':
+        old_event = find_by_id(zone, 'event', record['event_id'])
+        if old_event is not None:
+            removed = event_triplet(zone, old_event)
+            zone.remove(old_event)
+        return removed, None
+    raise ScheduleError(f"Unknown journal operation '{record['op']}'.")
+
+
+def put_record(zone_id, event, replace=None):
+    return {'op': 'put', 'zone': zone_id, 'replace': replace, 'xml': ET.tostring(event, encoding='unicode')}
+
+
+def delete_record(zone_id, event_id):
+    return {'op': 'delete', 'zone': zone_id, 'event_id': event_id}
+
+
+def replay_journal(path, root):
+    # 按顺序重放日志中的修改记录。没有换行结尾的最后一行是写入时崩溃留下的不完整记录，被忽略；
+    # 其他无法解析的行跳过，不影响之后的记录
+    count = 0
+    try:
+        f = open(journal_path(path), encoding='utf-8', errors='replace')
+    except FileNotFoundError:
+        return count
+    with f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            apply_record(root, record)
+            count += 1
+    return count
+
+
+def truncate_torn_tail(f):
+    # 截掉上次写入中途崩溃时留在末尾的不完整一行，否则追加的记录会接在这半行后面
+    size = f.seek(0, os.SEEK_END)
+    if size:
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+    position = size
+    while position > 0:
+        step = min(4096, position)
+        f.seek(position - step)
+        chunk = f.read(step)
+        newline = chunk.rfind(b'\n')
+        if newline >= 0:
+            position = position - step + newline + 1
+            break
+        position -= step
+    f.truncate(position)
+
+
+def read_schedule_summary(path):
+    # 流式读取日程文件，只提取索引需要的信息：日程名称、Building ID 以及每个事件的 (Zone, 事件, Outstation)
+    schedule_name = None
+    building_id = ''
+    events = []
+    zone_id = None
+    with span('xml.summary'):
+        for action, element in ET.iterparse(path, events=('start', 'end')):
+            if action == 'start':
+                if element.tag == 'schedule':
+                    schedule_name = element.get('name')
+                elif element.tag == 'building':
+                    building_id = element.get('ID', '')
+                elif element.tag == 'zone':
+                    zone_id = element.get('ID')
+                elif element.tag == 'event':
+                    events.append([zone_id, element.get('ID'), element.get('outstation')])
+            elif element.tag in ('event', 'zone'):
+                element.clear()
+    return schedule_name, building_id, events
+
+
+def event_in_window(event, start, end):
+    # 事件（包括其重复规则）在 [start, end) 内是否至少发生一次
+    if start is None and end is None:
+        return True
+    if not event['repeat_rules']:
+        return (start is None or event['event_time'] >= start) and (end is None or event['event_time'] < end)
+    if end is not None and event['event_time'] >= end:
+        return False
+    if start is None or end is None:
+        return True
+    return next(iter_occurrences(event['event_time'], event['repeat_rules'], start, end), None) is not None
+
+
+def stream_events(path, zone_ids=None, start=None, end=None):
+    # 流式读取日程文件中的事件，解析过程中按 Zone 和时间窗口过滤，
+    # 处理完的事件元素立即从父元素上移除，内存占用与文件大小无关
+    schedule_name = None
+    zone = None
+    keep_zone = False
+    parents = []
+    for action, element in ET.iterparse(path, events=('start', 'end')):
+        if action == 'start':
+            parents.append(element)
+            if element.tag == 'schedule':
+                schedule_name = element.get('name')
+            elif element.tag == 'zone':
+                zone = element
+                keep_zone = zone_ids is None or element.get('ID') in zone_ids
+            continue
+        parents.pop()
+        if element.tag == 'event':
+            if keep_zone:
+                event = event_from_element(element, schedule_name, zone.get('ID'))
+                if event_in_window(event, start, end):
+                    yield event
+            if parents:
+                parents[-1].remove(element)
+        elif element.tag == 'zone':
+            element.clear()
+
+
+def summarize_root(root):
+    building = root.find('.//building')
+    if building is None:
+        return root.get('name'), '', []
+    events = []
+    for zone in building.findall('.//zone'):
+        for event in zone.findall('event'):
+            events.append([zone.get('ID'), event.get('ID'), event.get('outstation')])
+    return root.get('name'), building.get('ID', ''), events
+
+
+def outstation_conflict(users, schedule_name, zone_id, ignore=None, estate_wide=False):
+    # 在 Outstation 的使用者 (日程, Zone, 事件) 中查找与 (日程, Zone) 冲突的：同一 Building 内其他 Zone 的事件，
+    # 或在全局唯一模式下其他日程中的事件。ignore 为正在编辑的原事件 (日程, Zone, 事件)
+    for user in sorted(users, key=lambda u: tuple(str(v) for v in u)):
+        if user == ignore:
+            continue
+        user_schedule, user_zone, _ = user
+        if user_schedule == schedule_name:
+            if user_zone != zone_id:
+                return user
+        elif estate_wide:
+            return user
+    return None
+
+
+def event_fields(element, schedule_name, zone_id):
+    # 事件元素对应的 add_event/update_event 参数，批量更新时未给出的字段取原值
+    event = event_from_element(element, schedule_name, zone_id)
+    return {
+        'event_name': event['event_name'],
+        'date_time': element.find('eventTime').text,
+        'setpoint_value': event['setpoint_value'],
+        'setpoint_type': event['setpoint_type'],
+        'repeat_rules': event['repeat_rules'],
+        'schedule_name': schedule_name,
+        'zone_name': zone_id,
+        'outstation_identifier': event['event_outstation'],
+        'colour': event['event_colour']
+    }
+
+
+def create_op(schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+    return {'op': 'create', 'schedule_name': schedule_name, 'zone_name': zone_name, 'event_name': event_name, 'date_time': date_time,
+            'setpoint_value': setpoint_value, 'setpoint_type': setpoint_type, 'repeat_rules': repeat_rules,
+            'outstation_identifier': outstation_identifier, 'colour': colour}
+
+
+def update_op(original, **changes):
+    # original 为 (日程, Zone, 事件)；changes 的键与 update_event 的参数相同，未给出的字段保持原值
+    unknown = set(changes) - set(EVENT_FIELDS)
+    if unknown:
+        raise ScheduleError(f"Unknown event field(s): {', '.join(sorted(unknown))}.")
+    return {'op': 'update', 'original': tuple(original), 'changes': changes}
+
+
+def delete_op(schedule_name, zone_id, event_id):
+    return {'op': 'delete', 'original': (schedule_name, zone_id, event_id)}
+
+
+class ScheduleBatch:
+    # 批量修改的暂存状态：按顺序在内存中校验每个操作，只记录各文件要应用的修改记录，不改动已缓存的日程树。
+    # 事件名称和 Outstation 的唯一性都对照内存中的字典检查，其中已包含本批次之前操作的结果
+    def __init__(self, repository):
+        self.repository = repository
+        # 日程 -> 文件状态
+        self.files = {}
+        # Outstation -> 使用者 (日程, Zone, 事件)，在索引的基础上叠加本批次的修改
+        self.users = {}
+        # 全部写入后发出的 (kind, old, new)
+        self.changes = []
+
+    def file(self, schedule_name):
+        state = self.files.get(schedule_name)
+        if state is None:
+            path = self.repository.schedule_path(schedule_name)
+            if not os.path.exists(path):
+                raise ScheduleError(f"Schedule file '{schedule_name}.xml' does not exist.")
+            tree = self.repository.tree(path)
+            building = tree.getroot().find('.//building')
+            if building is None:
+                raise ScheduleError("No building element found in the schedule.")
+            zones = building.findall('.//zone')
+            state = {
+                'path': path,
+                'tree': tree,
+                'name': tree.getroot().get('name'),
+                'zones': {zone.get('ID') for zone in zones},
+                'events': {(zone.get('ID'), event.get('ID')): event for zone in zones for event in zone.findall('event')},
+                'records': [],
+                'removed': set(),
+                'added': {},
+                'moved_out': False
+            }
+            self.files[schedule_name] = state
+        return state
+
+    def outstation_users(self, outstation):
+        users = self.users.get(outstation)
+        if users is None:
+            users = self.users[outstation] = self.repository.index.outstation_users(outstation)
+        return users
+
+    def find(self, original):
+        schedule_name, zone_id, event_id = original
+        state = self.file(schedule_name)
+        if zone_id not in state['zones']:
+            raise ScheduleError(f"No zone found with ID '{zone_id}'.")
+        element = state['events'].get((zone_id, event_id))
+        if element is None:
+            raise ScheduleError(f"No event found with ID '{event_id}' in zone '{zone_id}'.")
+        return state, element
+
+    def check(self, fields, original=None):
+        schedule_name, zone_name, event_name = fields['schedule_name'], fields['zone_name'], fields['event_name']
+        state = self.file(schedule_name)
+        if zone_name not in state['zones']:
+            raise ScheduleError(f"No zone found with ID '{zone_name}'.")
+        outstation = fields['outstation_identifier']
+        conflict = outstation_conflict(self.outstation_users(outstation), schedule_name, zone_name, original,
+                                       self.repository.estate_wide_outstations)
+        if conflict is not None:
+            raise ScheduleError(f"Outstation Identifier '{outstation}' is already used in {self.repository.describe_owner(conflict, schedule_name)}.")
+        if (zone_name, event_name) in state['events'] and (schedule_name, zone_name, event_name) != original:
+            raise ScheduleError(f"{event_name} already exists in {zone_name}.")
+        return state
+
+    def put(self, state, fields, replace=None):
+        schedule_name, zone_name, event_name = fields['schedule_name'], fields['zone_name'], fields['event_name']
+        element = build_event_element(event_name, fields['date_time'], fields['setpoint_value'], fields['setpoint_type'],
+                                      fields['repeat_rules'], fields['outstation_identifier'], fields['colour'])
+        key = (zone_name, event_name)
+        state['events'][key] = element
+        state['records'].append(put_record(zone_name, element, replace))
+        new = event_from_element(element, state['name'], zone_name)
+        state['added'][key] = new
+        self.outstation_users(fields['outstation_identifier']).add((schedule_name, zone_name, event_name))
+        return new
+
+    def forget(self, state, original):
+        # 从暂存状态中移除原事件，返回其事件字典
+        schedule_name, zone_id, event_id = original
+        key = (zone_id, event_id)
+        element = state['events'].pop(key)
+        self.outstation_users(element.get('outstation')).discard(tuple(original))
+        state['removed'].add(key)
+        state['added'].pop(key, None)
+        return event_from_element(element, state['name'], zone_id)
+
+    def create(self, operation):
+        fields = {name: operation[name] for name in EVENT_FIELDS}
+        new = self.put(self.check(fields), fields)
+        self.changes.append(('added', None, new))
+
+    def update(self, operation):
+        original = operation['original']
+        source, element = self.find(original)
+        fields = dict(event_fields(element, original[0], original[1]), **operation['changes'])
+        target = self.check(fields, original)
+        old = self.forget(source, original)
+        if target is source and fields['zone_name'] == original[1]:
+            # 在原位置替换，保持事件顺序
+            new = self.put(target, fields, replace=original[2])
+        else:
+            source['records'].append(delete_record(original[1], original[2]))
+            source['moved_out'] = source['moved_out'] or target is not source
+            new = self.put(target, fields)
+        self.changes.append(('moved', old, new))
+
+    def delete(self, operation):
+        original = operation['original']
+        state, _ = self.find(original)
+        old = self.forget(state, original)
+        state['records'].append(delete_record(original[1], original[2]))
+        self.changes.append(('removed', old, None))
+
+    def perform(self, operation):
+        handler = {'create': self.create, 'update': self.update, 'delete': self.delete}.get(operation.get('op'))
+        if handler is None:
+            raise ScheduleError(f"Unknown batch operation '{operation.get('op')}'.")
+        handler(operation)
+
+
+class ScheduleIndex:
+    # 持久化的全局索引：Building ID -> 日程文件，日程名称 -> 日程文件，
+    # Outstation -> (日程, Zone, 事件)。目录的 mtime 变化（有文件被新增或删除）时扫描整个目录，
+    # 否则逐个 stat 已索引的文件，外部程序原地修改过的文件也会被重新读取
+    def __init__(self, schedules_dir):
+        self.schedules_dir = schedules_dir
+        self.index_path = os.path.join(schedules_dir, INDEX_FILE)
+        self.files = {}
+        self.dir_stat = None
+        self.swept = 0.0
+        self.building_files = {}
+        self.schedule_files = {}
+        self.outstation_owners = {}
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        self.loaded = True
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != INDEX_VERSION:
+            return
+        self.dir_stat = data.get('dir_stat')
+        for filename, info in data.get('files', {}).items():
+            self.put(filename, info)
+
+    def persist(self):
+        self.dirty = False
+        data = {'version': INDEX_VERSION, 'dir_stat': self.dir_stat, 'files': self.files}
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.index_path)
+        self.own_change()
+
+    def current_dir_stat(self):
+        try:
+            return os.stat(self.schedules_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def own_change(self):
+        # 本进程在目录中写入或删除文件（临时文件、日志、索引、快照）之后调用。
+        # 调用者在写入前已经 validate 过，目录 mtime 的这次变化不需要全量扫描
+        if self.loaded:
+            self.dir_stat = self.current_dir_stat()
+
+    def put(self, filename, info):
+        # 增量维护各个映射，只处理这一个文件的内容
+        self.drop(filename)
+        self.files[filename] = info
+        self.building_files.setdefault(info['building'], set()).add(filename)
+        self.schedule_files[os.path.splitext(filename)[0]] = filename
+        for zone_id, event_id, outstation in info['events']:
+            self.outstation_owners.setdefault(outstation, set()).add((info['schedule'], zone_id, event_id))
+
+    def drop(self, filename):
+        info = self.files.pop(filename, None)
+        if info is None:
+            return
+        owners = self.building_files.get(info['building'])
+        if owners is not None:
+            owners.discard(filename)
+            if not owners:
+                del self.building_files[info['building']]
+        self.schedule_files.pop(os.path.splitext(filename)[0], None)
+        for zone_id, event_id, outstation in info['events']:
+            owners = self.outstation_owners.get(outstation)
+            if owners is not None:
+                owners.discard((info['schedule'], zone_id, event_id))
+                if not owners:
+                    del self.outstation_owners[outstation]
+
+    def validate(self, sweep=False):
+        # sweep 为 True 时不论间隔，立即检查所有已索引的文件（写入前的唯一性检查使用）
+        dir_stat = self.current_dir_stat()
+        if not self.loaded:
+            # 进程内第一次使用时对所有文件做一次 stat 校验，只重新读取变化过的文件
+            self.load()
+            if dir_stat is not None:
+                self.refresh(dir_stat)
+        elif dir_stat is not None and dir_stat != self.dir_stat:
+            self.refresh(dir_stat)
+        elif sweep or time.monotonic() - self.swept >= INDEX_SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self):
+        # 编辑器原地保存文件时目录的 mtime 不变，按每个文件的 mtime 和大小找出被修改过的文件。
+        # 日志文件的新建和删除会改变目录的 mtime，这里只需 stat 已经存在的日志
+        self.swept = time.monotonic()
+        changed = False
+        for filename, info in list(self.files.items()):
+            path = os.path.join(self.schedules_dir, filename)
+            try:
+                if info['stat'][2:] == [0, 0]:
+                    stat_key = [*file_stat_key(path), 0, 0]
+                else:
+                    stat_key = schedule_stat_key(path)
+            except FileNotFoundError:
+                self.drop(filename)
+                changed = True
+                continue
+            if info['stat'] != stat_key:
+                info = self.read_info(path, stat_key)
+                if info is None:
+                    self.drop(filename)
+                else:
+                    self.put(filename, info)
+                changed = True
+        if changed:
+            self.persist()
+
+    def refresh(self, dir_stat):
+        seen = {}
+        journals = {}
+        with os.scandir(self.schedules_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.xml' + JOURNAL_SUFFIX):
+                    stat = entry.stat()
+                    journals[entry.name[:-len(JOURNAL_SUFFIX)]] = [stat.st_mtime_ns, stat.st_size]
+                elif entry.name.endswith('.xml') and entry.is_file():
+                    seen[entry.name] = entry
+        for entry in seen.values():
+            stat = entry.stat()
+            stat_key = [stat.st_mtime_ns, stat.st_size, *journals.get(entry.name, (0, 0))]
+            info = self.files.get(entry.name)
+            if info is None or info['stat'] != stat_key:
+                info = self.read_info(entry.path, stat_key)
+                if info is None:
+                    self.drop(entry.name)
+                else:
+                    self.put(entry.name, info)
+        for filename in list(self.files):
+            if filename not in seen:
+                self.drop(filename)
+        self.dir_stat = dir_stat
+        self.swept = time.monotonic()
+        self.persist()
+
+    def read_info(self, path, stat_key):
+        try:
+            if stat_key[2:] != [0, 0]:
+                # 存在未合并的日志时需要完整解析并重放
+                with span('xml.parse'):
+                    root = ET.parse(path).getroot()
+                    replay_journal(path, root)
+                schedule_name, building_id, events = summarize_root(root)
+            else:
+                schedule_name, building_id, events = read_schedule_summary(path)
+        except (OSError, ET.ParseError):
+            return None
+        return {'stat': stat_key, 'schedule': schedule_name, 'building': building_id, 'events': events}
+
+    def checked_info(self, filename):
+        # 使用前确认文件没有被外部修改过，修改过则只重新读取这一个文件
+        path = os.path.join(self.schedules_dir, filename)
+        try:
+            stat_key = schedule_stat_key(path)
+        except FileNotFoundError:
+            self.drop(filename)
+            self.persist()
+            return None
+        info = self.files.get(filename)
+        if info is None or info['stat'] != stat_key:
+            info = self.read_info(path, stat_key)
+            if info is None:
+                self.drop(filename)
+            else:
+                self.put(filename, info)
+            self.persist()
+        return info
+
+    def find_building(self, building_id):
+        # 返回拥有该 Building ID 的日程名称，没有则返回 None
+        self.validate()
+        for filename in sorted(self.building_files.get(building_id, ())):
+            info = self.checked_info(filename)
+            if info is not None and info['building'] == building_id:
+                return info['schedule']
+        return None
+
+    def building_of(self, path):
+        self.validate()
+        info = self.checked_info(os.path.basename(path))
+        return info['building'] if info is not None else ''
+
+    def schedule_of(self, path):
+        self.validate()
+        info = self.checked_info(os.path.basename(path))
+        return info['schedule'] if info is not None else None
+
+    def outstation_users(self, outstation):
+        # 返回使用该 Outstation 的所有 (日程, Zone, 事件)
+        self.validate()
+        return set(self.outstation_owners.get(outstation, ()))
+
+    def schedule_file(self, schedule_name):
+        self.validate()
+        filename = self.schedule_files.get(schedule_name)
+        if filename is None:
+            return None
+        return os.path.join(self.schedules_dir, filename)
+
+    def record(self, path, root):
+        self.validate()
+        schedule_name, building_id, events = summarize_root(root)
+        self.put(os.path.basename(path), {
+            'stat': schedule_stat_key(path),
+            'schedule': schedule_name,
+            'building': building_id,
+            'events': events
+        })
+        self.persist()
+
+    def apply_changes(self, path, changes):
+        # 日志模式下按单个事件增量更新索引；索引文件延迟到日志合并时再写出，
+        # 若进程中途退出，下次启动时的 stat 校验会发现日志变化并重新读取该文件
+        filename = os.path.basename(path)
+        info = self.files.get(filename)
+        if info is None:
+            return
+        events = list(info['events'])
+        for removed, added in changes:
+            if removed is not None and removed in events:
+                events.remove(removed)
+            if added is not None:
+                events.append(added)
+        self.put(filename, dict(info, stat=schedule_stat_key(path), events=events))
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.persist()
+
+    def forget(self, path):
+        self.drop(os.path.basename(path))
+        self.persist()
+
+
+def call_listeners(listeners, *args):
+    # 监听者可以是普通的可调用对象，也可以是 weakref.WeakMethod（界面对象用它注册，
+    # 不会因为仓库持有引用而无法释放）；已经释放的监听者在这里移除
+    for listener in list(listeners):
+        if isinstance(listener, weakref.WeakMethod):
+            callback = listener()
+            if callback is None:
+                try:
+                    listeners.remove(listener)
+                except ValueError:
+                    pass
+                continue
+            listener = callback
+        listener(*args)
+
+
+class ScheduleRepository:
+    # 所有模块共享的日程仓库：解析后的XML保存在内存中，
+    # 每次访问时用 mtime/size 校验，文件未变化时不再重新解析
+    def __init__(self, schedules_dir=SCHEDULES_DIR, estate_wide_outstations=False, journal_mode=False):
+        self.schedules_dir = schedules_dir
+        # 为 True 时 Outstation Identifier 在所有日程（所有 Building）之间都必须唯一
+        self.estate_wide_outstations = estate_wide_outstations
+        # 为 True 时事件的增删改只追加到日志文件，由后台合并回XML
+        self.journal_mode = journal_mode
+        self.journal_compact_threshold = JOURNAL_COMPACT_THRESHOLD
+        self.streaming_threshold = STREAMING_THRESHOLD
+        self.compacting = set()
+        self.entries = {}
+        self.index = ScheduleIndex(schedules_dir)
+        # 文件写入或删除后的回调 (path, removed)，例如用于更新快照
+        self.file_listeners = []
+        # 事件增删改后的回调 (kind, old, new)，kind 为 'added'、'removed' 或 'moved'，
+        # old/new 为修改前后的事件字典，时间线据此只更新受影响的单元格
+        self.event_listeners = []
+        self.lock = threading.RLock()
+
+    def schedule_path(self, schedule_name):
+        return os.path.join(self.schedules_dir, f'{schedule_name}.xml')
+
+    def ensure_dir(self):
+        if not os.path.isdir(self.schedules_dir):
+            os.makedirs(self.schedules_dir)
+
+    def list_schedule_files(self):
+        return glob.glob(os.path.join(self.schedules_dir, '*.xml'))
+
+    def new_entry(self, stat_key, tree=None, events=None, zones=None, journal_records=0):
+        return {'stat': stat_key, 'tree': tree, 'events': events, 'zones': zones, 'index': None, 'journal_records': journal_records}
+
+    def entry(self, path):
+        key = os.path.normpath(path)
+        with self.lock:
+            stat_key = schedule_stat_key(path)
+            entry = self.entries.get(key)
+            if entry is None or entry['stat'] != stat_key:
+                entry = self.new_entry(stat_key)
+                self.entries[key] = entry
+            return entry
+
+    def seed(self, path, stat_key, zones, events):
+        # 用快照中的数据预先填充缓存，XML 树在真正需要时才解析
+        with self.lock:
+            self.entries[os.path.normpath(path)] = self.new_entry(list(stat_key), zones=zones, events=events)
+
+    def is_cached(self, path):
+        entry = self.entries.get(os.path.normpath(path))
+        try:
+            return entry is not None and entry['stat'] == schedule_stat_key(path)
+        except FileNotFoundError:
+            return False
+
+    def tree(self, path):
+        entry = self.entry(path)
+        with self.lock:
+            if entry['tree'] is None:
+                with span('xml.parse'):
+                    tree = ET.parse(path)
+                    entry['journal_records'] = replay_journal(path, tree.getroot())
+                entry['tree'] = tree
+            return entry['tree']
+
+    def notify_file(self, path, removed=False):
+        call_listeners(self.file_listeners, path, removed)
+
+    def notify_event(self, kind, old, new):
+        call_listeners(self.event_listeners, kind, old, new)
+
+    def carry_over(self, previous, entry, removed, added):
+        # 在修改前已缓存的事件列表和按周索引上增量应用修改，不必重新解析整个文件
+        if previous is None or previous['events'] is None:
+            return
+        removed = set(removed)
+        entry['events'] = [event for event in previous['events'] if event_key(event) not in removed] + list(added)
+        entry['zones'] = previous['zones']
+        index = previous['index']
+        if index is not None:
+            for key in removed:
+                index.remove(key)
+            for event in added:
+                index.add(event)
+        entry['index'] = index
+
+    def root(self, path):
+        return self.tree(path).getroot()
+
+    def building(self, path):
+        return self.root(path).find('.//building')
+
+    def building_id(self, path):
+        # 直接从索引读取，不需要解析整个文件
+        with self.lock:
+            return self.index.building_of(path)
+
+    def schedule_name(self, path):
+        with self.lock:
+            return self.index.schedule_of(path)
+
+    def find_building(self, building_id):
+        with self.lock:
+            return self.index.find_building(building_id)
+
+    def schedule_summaries(self):
+        # 每个日程文件的 (路径, 日程名称, Building ID, 事件数量)，只读取索引，不解析整个文件
+        summaries = []
+        with self.lock:
+            self.index.validate()
+            for path in sorted(self.list_schedule_files()):
+                info = self.index.checked_info(os.path.basename(path))
+                if info is not None:
+                    summaries.append((path, info['schedule'], info['building'], len(info['events'])))
+        return summaries
+
+    def describe_owner(self, owner, schedule_name):
+        # 同一日程内只显示 Zone 名称，与原来的提示保持一致
+        owner_schedule, owner_zone, _ = owner
+        if owner_schedule == schedule_name:
+            return owner_zone
+        return f"{owner_zone} of {owner_schedule}"
+
+    def outstation_users(self, outstation):
+        with self.lock:
+            return self.index.outstation_users(outstation)
+
+    def find_outstation_conflict(self, outstation, schedule_name, zone_id, ignore=None):
+        with self.lock:
+            users = self.index.outstation_users(outstation)
+        return outstation_conflict(users, schedule_name, zone_id, ignore, self.estate_wide_outstations)
+
+    def zones(self, path):
+        # 返回 (Zone ID, Zone 描述) 列表
+        entry = self.entry(path)
+        with self.lock:
+            if entry['zones'] is None:
+                root = self.tree(path).getroot()
+                with span('xml.lookup'):
+                    building = root.find('.//building')
+                    if building is None:
+                        entry['zones'] = []
+                    else:
+                        entry['zones'] = [(zone.get('ID'), zone.get('description', 'No description provided')) for zone in building.findall('.//zone')]
+            return entry['zones']
+
+    def zone_ids(self, path):
+        return [zone_id for zone_id, _ in self.zones(path)]
+
+    def events(self, path):
+        entry = self.entry(path)
+        with self.lock:
+            if entry['events'] is None:
+                root = self.tree(path).getroot()
+                with span('xml.events'):
+                    entry['events'] = parse_events(root)
+            return entry['events']
+
+    def occurrence_index(self, path):
+        entry = self.entry(path)
+        with self.lock:
+            if entry['index'] is None:
+                if entry['events'] is None:
+                    root = self.tree(path).getroot()
+                    with span('xml.events'):
+                        entry['events'] = parse_events(root)
+                with span('occurrences.index'):
+                    entry['index'] = OccurrenceIndex(entry['events'])
+            return entry['index']
+
+    def stream_events(self, path, zone_ids=None, start=None, end=None):
+        # 逐个产生事件，只在检查缓存时持有锁。日志中的修改必须重放到整棵树上，有日志时回退为完整读取
+        with self.lock:
+            events = None
+            if self.is_cached(path) or os.path.exists(journal_path(path)):
+                events = self.events(path)
+        if events is not None:
+            for event in events:
+                if (zone_ids is None or event['zone_id'] in zone_ids) and event_in_window(event, start, end):
+                    yield event
+            return
+        with span('xml.stream'):
+            yield from stream_events(path, zone_ids, start, end)
+
+    def week_occurrences(self, path, week_start, zone_ids=None):
+        # 返回一周内按时间排序的 (发生时间, 事件)。大文件只流式读取本周会发生的事件
+        week_start = week_start_of(week_start)
+        if zone_ids is None and (self.is_cached(path) or os.path.getsize(path) < self.streaming_threshold):
+            return self.occurrence_index(path).week(week_start)
+        start = datetime(week_start.year, week_start.month, week_start.day)
+        return OccurrenceIndex(self.stream_events(path, zone_ids, start, start + timedelta(days=7))).week(week_start)
+
+    def save(self, path, tree):
+        self.write(path, tree)
+        self.notify_file(path)
+
+    def write(self, path, tree):
+        # 写回文件并用新的文件状态更新缓存，派生数据（事件列表、按周索引）随之失效。
+        # 不发出通知，由调用者在释放锁之后通知
+        key = os.path.normpath(path)
+        with self.lock:
+            try:
+                self.index.validate()
+                # 先写入临时文件再原子替换，写入中途失败不会破坏原文件
+                temp_path = path + '.tmp'
+                with span('xml.write'):
+                    tree.write(temp_path, encoding='utf-8', xml_declaration=True)
+                os.replace(temp_path, path)
+                # 完整写出后日志中的记录已经包含在文件里
+                if os.path.exists(journal_path(path)):
+                    os.remove(journal_path(path))
+                self.index.own_change()
+                self.entries[key] = self.new_entry(schedule_stat_key(path), tree=tree)
+                self.index.record(path, tree.getroot())
+            except Exception:
+                self.entries.pop(key, None)
+                raise
+
+    def locate_event(self, schedule_name, zone_id, event_id):
+        path = self.schedule_path(schedule_name)
+        if not os.path.exists(path):
+            raise ScheduleError(f"Schedule file '{schedule_name}.xml' does not exist.")
+        tree = self.tree(path)
+        with span('xml.lookup'):
+            building = tree.getroot().find('.//building')
+            if building is None:
+                raise ScheduleError("No building element found in the schedule.")
+            zone = find_by_id(building, 'zone', zone_id)
+            if zone is None:
+                raise ScheduleError(f"No zone found with ID '{zone_id}'.")
+            event = None
+            if event_id is not None:
+                event = find_by_id(zone, 'event', event_id)
+                if event is None:
+                    raise ScheduleError(f"No event found with ID '{event_id}' in zone '{zone_id}'.")
+        return path, tree, zone, event
+
+    def apply(self, path, tree, records, removed=(), added=()):
+        # 将修改记录应用到内存中的日程树，并写回：日志模式下只追加记录，否则原子地写出整个文件。
+        # removed 为被移除事件的 (Zone, 事件名称)，added 为新增的事件字典，用于增量更新缓存
+        key = os.path.normpath(path)
+        with self.lock:
+            previous = self.entries.get(key)
+            if previous is not None:
+                previous = dict(previous)
+            try:
+                changes = [apply_record(tree.getroot(), record) for record in records]
+                if not self.journal_mode:
+                    self.write(path, tree)
+                    self.carry_over(previous, self.entries[key], removed, added)
+                else:
+                    self.append_journal(path, key, previous, records, changes, removed, added)
+            except Exception:
+                self.entries.pop(key, None)
+                raise
+            compact = self.journal_mode and self.entries[key]['journal_records'] >= self.journal_compact_threshold
+        # 在 apply 的加锁范围之外通知
+        self.notify_file(path)
+        if compact:
+            self.compact_in_background(path)
+
+    def append_journal(self, path, key, previous, records, changes, removed, added):
+        self.index.validate()
+        with open(journal_path(path), 'a+b') as f:
+            truncate_torn_tail(f)
+            f.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        # 第一次追加时新建日志文件，目录 mtime 随之变化
+        self.index.own_change()
+        entry = self.entries[key]
+        entry.update(stat=schedule_stat_key(path), events=None, index=None)
+        self.carry_over(previous, entry, removed, added)
+        entry['journal_records'] += len(records)
+        self.index.apply_changes(path, changes)
+
+    def add_event(self, schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+        with self.lock:
+            path, tree, zone, _ = self.locate_event(schedule_name, zone_name, None)
+
+            # 检查outstation-identifier是否在其他区域已被使用
+            conflict = self.find_outstation_conflict(outstation_identifier, schedule_name, zone_name)
+            if conflict is not None:
+                raise ScheduleError(f"Outstation Identifier '{outstation_identifier}' is already used in {self.describe_owner(conflict, schedule_name)}.")
+
+            # 检查当前区域内是否已有相同名称的event
+            if find_by_id(zone, 'event', event_name) is not None:
+                raise ScheduleError(f"{event_name} already exists in {zone_name}.")
+
+            event = build_event_element(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+            new = event_from_element(event, tree.getroot().get('name'), zone_name)
+            self.apply(path, tree, [put_record(zone_name, event)], added=[new])
+        self.notify_event('added', None, new)
+
+    def batch(self, operations, dry_run=False):
+        # 批量增删改（create_op / update_op / delete_op）：按顺序在内存中校验所有操作，全部通过后每个受影响的文件只写一次。
+        # 任何操作无效时抛出 ScheduleError（operation 属性为出错操作的序号），不写入任何文件。
+        # 返回 (kind, old, new) 列表；dry_run 为 True 时只校验
+        with self.lock:
+            batch = ScheduleBatch(self)
+            for number, operation in enumerate(operations):
+                try:
+                    batch.perform(operation)
+                except ScheduleError as e:
+                    e.operation = number
+                    raise
+            if dry_run:
+                return batch.changes
+            # 先写入接收事件的文件，最后写移出事件的文件，中途写入失败不会丢失事件
+            for state in sorted(batch.files.values(), key=lambda state: state['moved_out']):
+                if state['records']:
+                    self.apply(state['path'], state['tree'], state['records'], removed=state['removed'], added=list(state['added'].values()))
+        for kind, old, new in batch.changes:
+            self.notify_event(kind, old, new)
+        return batch.changes
+
+    def delete_event(self, schedule_name, zone_id, event_id):
+        with self.lock:
+            path, tree, _, event = self.locate_event(schedule_name, zone_id, event_id)
+            old = event_from_element(event, tree.getroot().get('name'), zone_id)
+            self.apply(path, tree, [delete_record(zone_id, event_id)], removed=[event_key(old)])
+        self.notify_event('removed', old, None)
+
+    def update_event(self, original, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_name, outstation_identifier, colour):
+        # 编辑事务：在内存中完成校验和替换，每个受影响的文件只写一次。
+        # original 为原事件的 (日程, Zone, 事件)
+        with self.lock:
+            source_path, source_tree, source_zone, old_event = self.locate_event(*original)
+            target_path, target_tree, target_zone, _ = self.locate_event(schedule_name, zone_name, None)
+
+            conflict = self.find_outstation_conflict(outstation_identifier, schedule_name, zone_name, ignore=tuple(original))
+            if conflict is not None:
+                raise ScheduleError(f"Outstation Identifier '{outstation_identifier}' is already used in {self.describe_owner(conflict, schedule_name)}.")
+
+            existing_event = find_by_id(target_zone, 'event', event_name)
+            if existing_event is not None and existing_event is not old_event:
+                raise ScheduleError(f"{event_name} already exists in {zone_name}.")
+
+            new_event = build_event_element(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+            original_zone, original_name = original[1], original[2]
+            old = event_from_element(old_event, source_tree.getroot().get('name'), original_zone)
+            new = event_from_element(new_event, target_tree.getroot().get('name'), zone_name)
+            if target_zone is source_zone:
+                # 在原位置替换，保持事件顺序
+                self.apply(source_path, source_tree, [put_record(zone_name, new_event, replace=original_name)], removed=[event_key(old)], added=[new])
+            elif os.path.normpath(target_path) == os.path.normpath(source_path):
+                self.apply(source_path, source_tree, [delete_record(original_zone, original_name), put_record(zone_name, new_event)], removed=[event_key(old)], added=[new])
+            else:
+                # 先写入目标文件，再从原文件中移除，任何一步失败都不会丢失事件
+                self.apply(target_path, target_tree, [put_record(zone_name, new_event)], added=[new])
+                self.apply(source_path, source_tree, [delete_record(original_zone, original_name)], removed=[event_key(old)])
+        self.notify_event('moved', old, new)
+
+    def compact(self, path):
+        # 将日志合并回XML文件
+        written = False
+        with self.lock:
+            if os.path.exists(path) and os.path.exists(journal_path(path)):
+                self.write(path, self.tree(path))
+                written = True
+            self.index.flush()
+        if written:
+            self.notify_file(path)
+
+    def compact_in_background(self, path):
+        key = os.path.normpath(path)
+        with self.lock:
+            if key in self.compacting:
+                return
+            self.compacting.add(key)
+        threading.Thread(target=self.compact_worker, args=(path, key), daemon=True).start()
+
+    def compact_worker(self, path, key):
+        try:
+            self.compact(path)
+        finally:
+            with self.lock:
+                self.compacting.discard(key)
+
+    def compact_all(self):
+        for path in glob.glob(os.path.join(self.schedules_dir, '*.xml' + JOURNAL_SUFFIX)):
+            self.compact(path[:-len(JOURNAL_SUFFIX)])
+        with self.lock:
+            self.index.flush()
+
+    def create_schedule(self, schedule_name, building_id, replace=False):
+        # 新建只含 Building 的日程文件；replace 为 True 时覆盖同名日程
+        with self.lock:
+            # 写入前确认没有其他程序刚把某个日程改成了这个 Building ID
+            self.index.validate(sweep=True)
+            owner = self.find_building(building_id)
+            if owner is not None and not (replace and owner == schedule_name):
+                raise ScheduleError(f"{building_id} already exists in {owner}.")
+            path = self.schedule_path(schedule_name)
+            if os.path.exists(path) and not replace:
+                raise ScheduleError(f'"{schedule_name}" already exists.')
+            self.ensure_dir()
+            schedule = ET.Element('schedule', name=schedule_name)
+            ET.SubElement(schedule, 'building', ID=building_id)
+            self.write(path, ET.ElementTree(schedule))
+        self.notify_file(path)
+        return path
+
+    def add_zone(self, schedule_name, zone_name, zone_description=''):
+        with self.lock:
+            path = self.schedule_path(schedule_name)
+            if not os.path.exists(path):
+                raise ScheduleError("Schedule file does not exist.")
+            tree = self.tree(path)
+            building = tree.getroot().find('.//building')
+            if building is None:
+                raise ScheduleError("No building element found in the schedule.")
+            # 检查当前building下是否已有相同名称的zone
+            if find_by_id(building, 'zone', zone_name) is not None:
+                raise ScheduleError(f"Zone '{zone_name}' already exists.")
+            ET.SubElement(building, 'zone', ID=zone_name, description=zone_description)
+            self.write(path, tree)
+        self.notify_file(path)
+
+    def remove(self, path):
+        with self.lock:
+            self.index.validate()
+            os.remove(path)
+            if os.path.exists(journal_path(path)):
+                os.remove(journal_path(path))
+            self.entries.pop(os.path.normpath(path), None)
+            self.index.forget(path)
+        self.notify_file(path, removed=True)
+
+    def external_change(self, path):
+        # 文件被其他程序新增、修改或删除：丢弃该文件的缓存，只重新读取这一个文件的索引信息，
+        # 并通知快照、周布局缓存等监听者
+        removed = not os.path.exists(path)
+        with self.lock:
+            self.entries.pop(os.path.normpath(path), None)
+            self.index.validate()
+            self.index.checked_info(os.path.basename(path))
+        self.notify_file(path, removed)
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(os.path.normpath(path), None)
+
+
+class EventDeleter:
+    # 删除事件并刷新显示。出错时把错误信息交给 error_func（界面中弹出错误框），不依赖 Qt
+    def __init__(self, repository=None, refresh_func=None, error_func=None):
+        self.repository = repository if repository is not None else schedule_repository
+        self.refresh_func = refresh_func
+        self.error_func = error_func
+
+    def delete_event(self, schedule_name, zone_id, event_id):
+        try:
+            self.repository.delete_event(schedule_name, zone_id, event_id)
+        except ScheduleError as e:
+            if self.error_func:
+                self.error_func(str(e))
+            return False
+
+        if self.refresh_func:
+            self.refresh_func(None)  # 调用刷新函数
+        return True
+
+
+schedule_repository = ScheduleRepository(journal_mode=os.environ.get('SMARTBMS_JOURNAL_MODE') == '1')
@@ -1,9 +1,9 @@
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QDialogButtonBox, QMessageBox 
 from PySide6.QtCore import Signal
-import xml.etree.ElementTree as ET
-import glob
 import os
 
+from test_schedule_store import schedule_repository, ScheduleError
+
 class CreateScheduleDialog(QDialog):
 
     schedule_created = Signal()
@@ -53,16 +53,13 @@ class CreateScheduleDialog(QDialog):
             return
 
         # 确保"Schedules"文件夹存在
-        schedules_dir = 'Schedules'
-        if not os.path.isdir(schedules_dir):
-            os.makedirs(schedules_dir)
+        schedule_repository.ensure_dir()
 
         # 检查"Schedules"文件夹中文件是否存在
-        filename = os.path.join(schedules_dir, f'{schedule_name}.xml')
+        filename = schedule_repository.schedule_path(schedule_name)
         if os.path.exists(filename):
             self.confirm_replacement(filename, building_id)  # 现在传递building_id参数
-        else:
-            self.createScheduleXML(schedule_name, building_id)
+        elif self.createScheduleXML(schedule_name, building_id):
             self.operation_successful = True  # 设置操作成功标志
             self.schedule_created.emit()  # 日程创建成功，发射信号
             self.accept()
@@ -75,8 +72,7 @@ class CreateScheduleDialog(QDialog):
                                     QMessageBox.Yes | QMessageBox.No, 
                                     QMessageBox.No)
 
-        if reply == QMessageBox.Yes:
-            self.createScheduleXML(base_name, building_id)
+        if reply == QMessageBox.Yes and self.createScheduleXML(base_name, building_id):
             self.operation_successful = True
             self.schedule_created.emit()  # 用户确认替换，操作成功
             self.accept()
@@ -85,32 +81,16 @@ class CreateScheduleDialog(QDialog):
 
     def is_building_id_duplicate(self, building_id):
         # 检查Building ID是否在现有的XML文件中已存在
-        schedules_dir = 'Schedules'
-        schedule_files = glob.glob(os.path.join(schedules_dir, '*.xml'))
-        for filepath in schedule_files:
-            tree = ET.parse(filepath)
-            root = tree.getroot()
-            if root.findall(f".//building[@ID='{building_id}']"):
-                schedule_name = root.attrib.get('name')  # 获取该schedule的name属性
-                return (True, schedule_name)  # 返回True和schedule名称
+        schedule_name = schedule_repository.find_building(building_id)
+        if schedule_name is not None:
+            return (True, schedule_name)  # 返回True和schedule名称
         return None  # 如果没有找到重复，返回None
 
     def createScheduleXML(self, schedule_name, building_id):
-        # 确保"Schedules"文件夹存在
-        schedules_dir = 'Schedules'
-        if not os.path.isdir(schedules_dir):
-            os.makedirs(schedules_dir)
-        
-        # 定义文件的完整路径
-        filename = os.path.join(schedules_dir, f'{schedule_name}.xml')
-
-        # 创建XML元素
-        schedule = ET.Element('schedule', name=schedule_name)
-
-        #创建building_id元素
-        building_element = ET.SubElement(schedule, 'building', ID=building_id)
-
-        # 创建XML树并写入文件
-        tree = ET.ElementTree(schedule)
-        tree.write(filename, encoding='utf-8', xml_declaration=True)
-
+        # Building ID 已经检查过，同名日程由用户确认替换。检查之后文件被其他程序修改时仍可能失败
+        try:
+            schedule_repository.create_schedule(schedule_name, building_id, replace=True)
+        except ScheduleError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return False
+        return True
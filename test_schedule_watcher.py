@@ -0,0 +1,86 @@
+from PySide6.QtCore import QObject, QFileSystemWatcher, QTimer, Signal
+import threading
+import os
+
+from test_schedule_store import schedule_stat_key, JOURNAL_SUFFIX
+
+# 连续写入在该时间（毫秒）内合并为一次处理
+WATCH_DEBOUNCE_MS = 300
+
+
+class ScheduleWatcher(QObject):
+    # 监视 Schedules 文件夹：其他程序（配置脚本、其他界面实例）新增、删除或修改日程文件后，
+    # 只重新读取变化的文件，并通过信号通知界面做增量刷新。本进程自己的写入不会被当作外部修改
+    schedules_changed = Signal(list, list, list)  # 新增、删除、修改的日程文件路径
+
+    def __init__(self, repository, parent=None, debounce_ms=WATCH_DEBOUNCE_MS):
+        super().__init__(parent)
+        self.repository = repository
+        self.known = {}
+        self.lock = threading.Lock()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_path_changed)
+        self.watcher.fileChanged.connect(self.on_path_changed)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self.flush)
+        repository.file_listeners.append(self.on_own_write)
+
+    def start(self):
+        self.repository.ensure_dir()
+        with self.lock:
+            self.known = self.scan()
+        self.watcher.addPath(self.repository.schedules_dir)
+        self.watch_files()
+
+    def scan(self):
+        # 日程文件 -> (XML, 日志) 的 mtime/size
+        known = {}
+        for path in self.repository.list_schedule_files():
+            try:
+                known[os.path.normpath(path)] = schedule_stat_key(path)
+            except FileNotFoundError:
+                continue
+        return known
+
+    def watch_files(self):
+        # 原子替换写入后文件是新的 inode，需要重新加入监视
+        watched = set(self.watcher.files())
+        paths = []
+        for path in self.known:
+            for candidate in (path, path + JOURNAL_SUFFIX):
+                if candidate not in watched and os.path.exists(candidate):
+                    paths.append(candidate)
+        if paths:
+            self.watcher.addPaths(paths)
+
+    def on_path_changed(self, path):
+        # 每次变化都重新计时，一连串的写入只处理一次
+        self.timer.start()
+
+    def on_own_write(self, path, removed):
+        # 可能在后台合并日志的线程中调用，只更新记录的文件状态
+        path = os.path.normpath(path)
+        with self.lock:
+            if removed:
+                self.known.pop(path, None)
+            else:
+                try:
+                    self.known[path] = schedule_stat_key(path)
+                except FileNotFoundError:
+                    self.known.pop(path, None)
+
+    def flush(self):
+        current = self.scan()
+        with self.lock:
+            added = sorted(path for path in current if path not in self.known)
+            removed = sorted(path for path in self.known if path not in current)
+            modified = sorted(path for path in current if path in self.known and current[path] != self.known[path])
+            self.known = current
+        self.watch_files()
+        if not (added or removed or modified):
+            return
+        for path in added + removed + modified:
+            self.repository.external_change(path)
+        self.schedules_changed.emit(added, removed, modified)
@@ -0,0 +1,266 @@
+from datetime import datetime, timedelta
+import threading
+import heapq
+import queue
+import sys
+import os
+
+from test_recurrence import iter_occurrences
+from test_schedule_store import schedule_repository, schedule_stat_key
+from test_profiling import span
+
+# 查找下一次发生时间的最远范围，覆盖按年重复（包括 2 月 29 日）的规则
+NEXT_FIRE_HORIZON = timedelta(days=366 * 4 + 1)
+# 最长等待时间（秒），防止系统时间被调整后长时间不醒
+MAX_SLEEP = 60
+# 过期的堆项超过有效项的该倍数时重建堆
+STALE_RATIO = 2
+
+
+def dispatch_key(event):
+    return (event['schedule_name'], event['zone_id'], event['event_name'])
+
+
+def event_signature(event):
+    # 只要这些字段不变，事件的触发就不受影响
+    return (event['event_time'], tuple(tuple(rule) for rule in event['repeat_rules']), event['setpoint_value'],
+            event['setpoint_type'], event['event_outstation'])
+
+
+def next_fire_time(event, after):
+    # 事件（包括重复规则）在 after 之后（含）的第一次发生时间，没有则返回 None
+    return next(iter_occurrences(event['event_time'], event['repeat_rules'], after, after + NEXT_FIRE_HORIZON), None)
+
+
+def print_sink(dispatch):
+    print(f"{dispatch['fire_time']:%Y-%m-%d %H:%M} {dispatch['schedule_name']}/{dispatch['zone_id']}/{dispatch['event_name']} "
+          f"-> {dispatch['outstation']} {dispatch['setpoint_type']} {dispatch['setpoint_value']}", flush=True)
+
+
+class SetpointScheduler:
+    # 无界面的设定值下发调度器：最小堆中保存每个事件的下一次发生时间，睡眠到最早的时间再把到期的事件交给 sink。
+    # 事件被修改或删除时只更新其版本号，堆中旧的项在弹出时丢弃，因此每次触发和每次修改都是 O(log n)
+    def __init__(self, repository, sink=print_sink, clock=datetime.now):
+        self.repository = repository
+        self.sink = sink
+        self.clock = clock
+        self.heap = []
+        self.events = {}
+        self.schedule_keys = {}
+        self.file_stats = {}
+        self.file_schedules = {}
+        # 日程仓库通知的 (文件, 是否删除)，通知可能在持有仓库锁时发出，因此不经过 self.condition 排队
+        self.dirty_files = queue.SimpleQueue()
+        self.version = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        repository.event_listeners.append(self.on_event_change)
+        repository.file_listeners.append(self.on_file_changed)
+
+    def now(self):
+        return self.clock().replace(second=0, microsecond=0)
+
+    def load(self):
+        # 读取所有日程，为每个事件找到下一次发生时间
+        with span('scheduler.load'):
+            for path in self.repository.list_schedule_files():
+                self.load_file(path)
+        with self.condition:
+            self.condition.notify()
+
+    def load_file(self, path):
+        # 读取日程仓库时不持有 self.condition：仓库在持有自己的锁时会调用 on_file_changed，
+        # 两把锁的加锁顺序必须一致
+        try:
+            stat_key = schedule_stat_key(path)
+            schedule_name = self.repository.schedule_name(path)
+            events = self.repository.events(path)
+        except (OSError, SyntaxError):
+            return
+        with self.condition:
+            self.sync_schedule(schedule_name, events)
+            self.file_stats[os.path.normpath(path)] = stat_key
+            self.file_schedules[os.path.normpath(path)] = schedule_name
+
+    def sync_schedule(self, schedule_name, events):
+        # 与上次读取的事件比较，只处理新增、删除和内容变化的事件
+        keys = set()
+        for event in events:
+            key = dispatch_key(event)
+            keys.add(key)
+            current = self.events.get(key)
+            if current is None or event_signature(current[0]) != event_signature(event):
+                self.put(event)
+        for key in self.schedule_keys.get(schedule_name, set()) - keys:
+            self.discard(key)
+
+    def put(self, event, after=None):
+        key = dispatch_key(event)
+        self.version += 1
+        self.events[key] = (event, self.version)
+        self.schedule_keys.setdefault(key[0], set()).add(key)
+        try:
+            fire_time = next_fire_time(event, after or self.now())
+        except ValueError:
+            # 无法解析的重复规则，不下发
+            fire_time = None
+        if fire_time is not None:
+            heapq.heappush(self.heap, (fire_time, self.version, key))
+
+    def discard(self, key):
+        if self.events.pop(key, None) is None:
+            return
+        keys = self.schedule_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.schedule_keys[key[0]]
+        # 堆中的旧项保留到弹出时再丢弃，过多时整体重建
+        if len(self.heap) > STALE_RATIO * max(len(self.events), 1):
+            self.heap = [item for item in self.heap if self.is_live(item)]
+            heapq.heapify(self.heap)
+
+    def is_live(self, item):
+        current = self.events.get(item[2])
+        return current is not None and current[1] == item[1]
+
+    def on_event_change(self, kind, old, new):
+        # 本进程中的增删改：只更新这一个事件
+        with self.condition:
+            if old is not None:
+                self.discard(dispatch_key(old))
+            if new is not None:
+                self.put(new)
+            for event in (old, new):
+                if event is not None:
+                    path = self.repository.schedule_path(event['schedule_name'])
+                    if os.path.exists(path):
+                        self.file_stats[os.path.normpath(path)] = schedule_stat_key(path)
+            self.condition.notify()
+
+    def on_file_changed(self, path, removed):
+        # 可能在持有日程仓库锁时调用，这里只做标记，由调度线程比较后更新。
+        # 持有 self.condition 的代码从不等待仓库锁，这里短暂获取它只为唤醒调度线程
+        self.dirty_files.put((os.path.normpath(path), removed))
+        with self.condition:
+            self.condition.notify()
+
+    def check_files(self):
+        # 其他进程（界面、命令行、外部编辑器）的修改不会通知本进程的监听者：每次醒来时比较各文件的状态，
+        # 新增、修改或删除的文件交给 process_dirty_files 处理
+        with self.condition:
+            tracked = dict(self.file_stats)
+        paths = {os.path.normpath(path) for path in self.repository.list_schedule_files()}
+        for path in paths | set(tracked):
+            try:
+                stat_key = schedule_stat_key(path)
+            except FileNotFoundError:
+                if path in tracked:
+                    self.dirty_files.put((path, True))
+                continue
+            if tracked.get(path) != stat_key:
+                self.dirty_files.put((path, False))
+
+    def process_dirty_files(self):
+        # 在调度线程中、不持有 self.condition 时调用。同一文件的多次通知只处理最后一次
+        dirty_files = {}
+        while True:
+            try:
+                path, removed = self.dirty_files.get_nowait()
+            except queue.Empty:
+                break
+            dirty_files[path] = removed
+        for path, removed in dirty_files.items():
+            if removed or not os.path.exists(path):
+                with self.condition:
+                    schedule_name = self.file_schedules.pop(path, None)
+                    for key in list(self.schedule_keys.get(schedule_name, ())):
+                        self.discard(key)
+                    self.file_stats.pop(path, None)
+                continue
+            try:
+                stat_key = schedule_stat_key(path)
+            except FileNotFoundError:
+                continue
+            with self.condition:
+                changed = self.file_stats.get(path) != stat_key
+            if changed:
+                self.load_file(path)
+
+    def pop_due(self, now):
+        # 弹出所有不晚于 now 的有效项，并为重复事件放入下一次发生时间
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            item = heapq.heappop(self.heap)
+            if not self.is_live(item):
+                continue
+            fire_time, _, key = item
+            event = self.events[key][0]
+            due.append((fire_time, event))
+            next_time = next_fire_time(event, fire_time + timedelta(minutes=1))
+            if next_time is not None:
+                heapq.heappush(self.heap, (next_time, item[1], key))
+        return due
+
+    def next_due(self):
+        while self.heap and not self.is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def dispatch(self, fire_time, event):
+        self.sink({
+            'fire_time': fire_time,
+            'schedule_name': event['schedule_name'],
+            'zone_id': event['zone_id'],
+            'event_name': event['event_name'],
+            'outstation': event['event_outstation'],
+            'setpoint_value': event['setpoint_value'],
+            'setpoint_type': event['setpoint_type']
+        })
+
+    def run(self):
+        # 调度循环：睡眠到下一个到期时间，被修改或 stop() 唤醒后重新计算。
+        # 每次醒来先检查文件状态，其他进程删除的事件不会再被下发
+        while True:
+            self.check_files()
+            self.process_dirty_files()
+            with self.condition:
+                if self.stopped:
+                    return
+                if not self.dirty_files.empty():
+                    continue
+                now = self.now()
+                due = self.pop_due(now)
+                if not due:
+                    next_time = self.next_due()
+                    timeout = MAX_SLEEP if next_time is None else (next_time - self.clock()).total_seconds()
+                    self.condition.wait(min(max(timeout, 0), MAX_SLEEP))
+                    continue
+            # 调用 sink 时不持有锁，sink 较慢时不会阻塞修改
+            for fire_time, event in due:
+                self.dispatch(fire_time, event)
+
+    def start(self):
+        self.load()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+
+def main():
+    scheduler = SetpointScheduler(schedule_repository)
+    scheduler.load()
+    print(f"Loaded {len(scheduler.events)} events, next due at {scheduler.next_due()}.", file=sys.stderr)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
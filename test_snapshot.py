@@ -0,0 +1,294 @@
+from datetime import datetime
+from array import array
+import threading
+import struct
+import mmap
+import sys
+import os
+
+from test_recurrence import DayRule, TimeRule, compile_rule, prime_rule, minute_key, parse_event_time
+from test_schedule_store import schedule_repository, schedule_stat_key
+from test_profiling import span
+
+SNAPSHOT_FILE = '.schedule_snapshot.bin'
+SNAPSHOT_MAGIC = b'SBMS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHB')
+SNAPSHOT_WRITE_DELAY = 1.0
+
+# 每个日程文件的元数据字段
+FILE_META = ('name', 'xml_mtime', 'xml_size', 'journal_mtime', 'journal_size', 'schedule', 'building',
+             'zone_count', 'event_count', 'rule_count', 'exclusion_count')
+# 事件列，每个事件一项
+EVENT_COLUMNS = (('time', 'q'), ('zone', 'i'), ('name', 'i'), ('outstation', 'i'), ('colour', 'i'),
+                 ('value', 'i'), ('type', 'i'), ('rule_end', 'i'))
+# 规则列，每条重复规则一项；mask0..mask3 为预编译的位掩码
+RULE_COLUMNS = (('kind', 'b'), ('specifier', 'i'), ('exclusion_end', 'i'),
+                ('mask0', 'q'), ('mask1', 'q'), ('mask2', 'q'), ('mask3', 'q'))
+# 排除时间列，每个排除时间一项
+EXCLUSION_COLUMNS = (('text', 'i'), ('key', 'q'))
+
+
+class StringTable:
+    # 字符串驻留表，相同的字符串只保存一次
+    def __init__(self):
+        self.strings = []
+        self.positions = {}
+
+    def intern(self, text):
+        if text is None:
+            return -1
+        position = self.positions.get(text)
+        if position is None:
+            position = len(self.strings)
+            self.positions[text] = position
+            self.strings.append(text)
+        return position
+
+
+def rule_masks(compiled):
+    if compiled.kind == 'day':
+        return 0, (compiled.weekday_mask, 0, 0, 0)
+    return 1, (compiled.month_mask, compiled.day_mask, compiled.hour_mask, compiled.minute_mask)
+
+
+def encode_file(name, record, strings):
+    stat_key, schedule_name, building_id, zones, events = record
+    zone_positions = {zone_id: position for position, (zone_id, _) in enumerate(zones)}
+    zone_column = array('i')
+    for zone_id, description in zones:
+        zone_column.append(strings.intern(zone_id))
+        zone_column.append(strings.intern(description))
+
+    event_columns = {column: array(code) for column, code in EVENT_COLUMNS}
+    rule_columns = {column: array(code) for column, code in RULE_COLUMNS}
+    exclusion_columns = {column: array(code) for column, code in EXCLUSION_COLUMNS}
+    for event in events:
+        event_columns['time'].append(minute_key(event['event_time']))
+        event_columns['zone'].append(zone_positions[event['zone_id']])
+        event_columns['name'].append(strings.intern(event['event_name']))
+        event_columns['outstation'].append(strings.intern(event['event_outstation']))
+        event_columns['colour'].append(strings.intern(event['event_colour']))
+        event_columns['value'].append(strings.intern(event['setpoint_value']))
+        event_columns['type'].append(strings.intern(event['setpoint_type']))
+        for rule in event['repeat_rules']:
+            kind, masks = rule_masks(compile_rule(rule))
+            rule_columns['kind'].append(kind)
+            rule_columns['specifier'].append(strings.intern(rule[1]))
+            for position, mask in enumerate(masks):
+                rule_columns[f'mask{position}'].append(mask)
+            for excluded_time in rule[2:]:
+                exclusion_columns['text'].append(strings.intern(excluded_time))
+                exclusion_columns['key'].append(minute_key(parse_event_time(excluded_time)))
+            rule_columns['exclusion_end'].append(len(exclusion_columns['text']))
+        event_columns['rule_end'].append(len(rule_columns['kind']))
+
+    meta = array('q', [strings.intern(name), *stat_key, strings.intern(schedule_name), strings.intern(building_id),
+                       len(zones), len(events), len(rule_columns['kind']), len(exclusion_columns['text'])])
+    chunks = [meta, zone_column]
+    chunks += [event_columns[column] for column, _ in EVENT_COLUMNS]
+    chunks += [rule_columns[column] for column, _ in RULE_COLUMNS]
+    chunks += [exclusion_columns[column] for column, _ in EXCLUSION_COLUMNS]
+    return b''.join(chunk.tobytes() for chunk in chunks)
+
+
+class SnapshotReader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def read_array(self, code, count):
+        column = array(code)
+        size = column.itemsize * count
+        column.frombytes(self.buffer[self.offset:self.offset + size])
+        self.offset += size
+        return column
+
+
+def decode_file(reader, strings):
+    meta = dict(zip(FILE_META, reader.read_array('q', len(FILE_META))))
+
+    def text(position):
+        return strings[position] if position >= 0 else None
+
+    zone_column = reader.read_array('i', meta['zone_count'] * 2)
+    zones = [(text(zone_column[i]), text(zone_column[i + 1])) for i in range(0, len(zone_column), 2)]
+    event_columns = {column: reader.read_array(code, meta['event_count']) for column, code in EVENT_COLUMNS}
+    rule_columns = {column: reader.read_array(code, meta['rule_count']) for column, code in RULE_COLUMNS}
+    exclusion_columns = {column: reader.read_array(code, meta['exclusion_count']) for column, code in EXCLUSION_COLUMNS}
+
+    schedule_name = text(meta['schedule'])
+    events = []
+    rule_start = 0
+    exclusion_start = 0
+    for position in range(meta['event_count']):
+        repeat_rules = []
+        for rule_position in range(rule_start, event_columns['rule_end'][position]):
+            exclusion_end = rule_columns['exclusion_end'][rule_position]
+            specifier = text(rule_columns['specifier'][rule_position])
+            excluded_times = [text(t) for t in exclusion_columns['text'][exclusion_start:exclusion_end]]
+            excluded_keys = exclusion_columns['key'][exclusion_start:exclusion_end]
+            masks = [rule_columns[f'mask{i}'][rule_position] for i in range(4)]
+            if rule_columns['kind'][rule_position] == 0:
+                rule = ('day', specifier, *excluded_times)
+                prime_rule(rule, DayRule.from_compiled(specifier, masks[0], excluded_keys))
+            else:
+                rule = ('time', specifier, *excluded_times)
+                prime_rule(rule, TimeRule.from_compiled(specifier, *masks, excluded_keys))
+            repeat_rules.append(rule)
+            exclusion_start = exclusion_end
+        rule_start = event_columns['rule_end'][position]
+
+        key = event_columns['time'][position]
+        events.append({
+            'event_time': datetime(key // 100000000, key // 1000000 % 100, key // 10000 % 100, key // 100 % 100, key % 100),
+            'event_name': text(event_columns['name'][position]),
+            'event_colour': text(event_columns['colour'][position]),
+            'setpoint_value': text(event_columns['value'][position]),
+            'setpoint_type': text(event_columns['type'][position]),
+            'event_outstation': text(event_columns['outstation'][position]),
+            'repeat_rules': repeat_rules,
+            'schedule_name': schedule_name,
+            'zone_id': zones[event_columns['zone'][position]][0]
+        })
+
+    stat_key = [meta['xml_mtime'], meta['xml_size'], meta['journal_mtime'], meta['journal_size']]
+    return text(meta['name']), (stat_key, schedule_name, text(meta['building']), zones, events)
+
+
+class ScheduleSnapshot:
+    # 所有日程的紧凑二进制快照：字符串驻留表 + 按列存储的事件数组 + 预编译的重复规则。
+    # 启动时一次 mmap 读入并填充日程仓库；与文件 mtime/size 不一致的日程回退为解析XML
+    def __init__(self, repository):
+        self.repository = repository
+        self.path = os.path.join(repository.schedules_dir, SNAPSHOT_FILE)
+        self.files = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        repository.file_listeners.append(self.on_file_changed)
+
+    def load(self):
+        try:
+            with span('snapshot.load'), open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                records = self.decode(memoryview(buffer))
+        except (OSError, ValueError, struct.error, IndexError, KeyError):
+            return 0
+
+        seeded = 0
+        for name, record in records.items():
+            path = os.path.join(self.repository.schedules_dir, name)
+            try:
+                current = schedule_stat_key(path)
+            except FileNotFoundError:
+                continue
+            if current != record[0]:
+                # 快照已过期，该日程回退为读取XML
+                continue
+            self.files[name] = record
+            self.repository.seed(path, record[0], record[3], record[4])
+            seeded += 1
+        return seeded
+
+    def decode(self, buffer):
+        magic, version, big_endian = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or big_endian != (sys.byteorder == 'big'):
+            raise ValueError('Unsupported snapshot.')
+        reader = SnapshotReader(buffer)
+        reader.offset = SNAPSHOT_HEADER.size
+        string_count, file_count = reader.read_array('q', 2)
+        lengths = reader.read_array('q', string_count)
+        blob_size = sum(lengths)
+        blob = bytes(buffer[reader.offset:reader.offset + blob_size])
+        reader.offset += blob_size
+        strings = []
+        position = 0
+        for length in lengths:
+            strings.append(blob[position:position + length].decode('utf-8'))
+            position += length
+        records = {}
+        for _ in range(file_count):
+            name, record = decode_file(reader, strings)
+            records[name] = record
+        return records
+
+    def capture(self, path):
+        # 从日程仓库中取出该文件当前的数据
+        return (schedule_stat_key(path), self.repository.schedule_name(path), self.repository.building_id(path),
+                list(self.repository.zones(path)), list(self.repository.events(path)))
+
+    def on_file_changed(self, path, removed):
+        # 旧记录作废，写入快照时从日程仓库中重新取出
+        with self.lock:
+            self.files.pop(os.path.basename(path), None)
+        self.schedule_write()
+
+    def refresh_in_background(self):
+        # 快照中缺少或已过期的日程在后台解析，然后写出新的快照
+        missing = [path for path in self.repository.list_schedule_files() if os.path.basename(path) not in self.files]
+        if missing:
+            threading.Thread(target=self.build, args=(missing,), daemon=True).start()
+
+    def build(self, paths):
+        for path in paths:
+            try:
+                self.repository.events(path)
+                self.repository.zones(path)
+            except (OSError, SyntaxError):
+                continue
+        self.write()
+
+    def flush(self):
+        with self.lock:
+            pending = self.timer is not None
+            if pending:
+                self.timer.cancel()
+        if pending:
+            self.write()
+
+    def schedule_write(self):
+        # 连续的修改合并为一次写入
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(SNAPSHOT_WRITE_DELAY, self.write)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def write(self):
+        with self.lock:
+            self.timer = None
+        with self.repository.lock:
+            for path in list(self.repository.list_schedule_files()):
+                name = os.path.basename(path)
+                if name not in self.files and self.repository.is_cached(path):
+                    self.files[name] = self.capture(path)
+            records = dict(self.files)
+
+        with span('snapshot.write'):
+            self.write_records(records)
+
+    def write_records(self, records):
+        strings = StringTable()
+        bodies = [encode_file(name, record, strings) for name, record in sorted(records.items())]
+        encoded = [text.encode('utf-8') for text in strings.strings]
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.byteorder == 'big')
+        counts = array('q', [len(encoded), len(bodies)])
+        lengths = array('q', [len(data) for data in encoded])
+
+        index = self.repository.index
+        with self.repository.lock:
+            # 快照写在日程目录中，写完后更新索引记录的目录状态，下次查询不必全量扫描
+            index.validate()
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(header)
+                f.write(counts.tobytes())
+                f.write(lengths.tobytes())
+                f.write(b''.join(encoded))
+                for body in bodies:
+                    f.write(body)
+            os.replace(temp_path, self.path)
+            index.own_change()
+
+
+schedule_snapshot = ScheduleSnapshot(schedule_repository)
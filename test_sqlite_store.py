@@ -0,0 +1,293 @@
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+import sqlite3
+import json
+import glob
+import os
+
+from test_recurrence import iter_occurrences, parse_event_time, week_start_of
+from test_schedule_store import ScheduleError, build_event_element, replay_journal
+from test_profiling import span
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    building_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS schedules_building ON schedules (building_id);
+
+CREATE TABLE IF NOT EXISTS zones (
+    id INTEGER PRIMARY KEY,
+    schedule_id INTEGER NOT NULL REFERENCES schedules (id) ON DELETE CASCADE,
+    zone_id TEXT NOT NULL,
+    description TEXT,
+    UNIQUE (schedule_id, zone_id)
+);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    schedule_id INTEGER NOT NULL REFERENCES schedules (id) ON DELETE CASCADE,
+    zone_row INTEGER NOT NULL REFERENCES zones (id) ON DELETE CASCADE,
+    event_id TEXT NOT NULL,
+    event_time TEXT NOT NULL,
+    setpoint_value TEXT NOT NULL,
+    setpoint_type TEXT NOT NULL,
+    outstation TEXT NOT NULL,
+    colour TEXT NOT NULL,
+    repeat_rules TEXT NOT NULL,
+    recurring INTEGER NOT NULL,
+    UNIQUE (schedule_id, zone_row, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_outstation ON events (outstation);
+CREATE INDEX IF NOT EXISTS events_time ON events (schedule_id, event_time);
+CREATE INDEX IF NOT EXISTS events_recurring ON events (schedule_id, recurring, event_time);
+'''
+
+EVENT_COLUMNS = '''s.name, z.zone_id, e.event_id, e.event_time, e.setpoint_value, e.setpoint_type,
+    e.outstation, e.colour, e.repeat_rules'''
+
+
+def event_from_row(row):
+    schedule_name, zone_id, event_id, event_time, setpoint_value, setpoint_type, outstation, colour, repeat_rules = row
+    return {
+        'event_time': parse_event_time(event_time),
+        'event_name': event_id,
+        'event_colour': colour,
+        'setpoint_value': setpoint_value,
+        'setpoint_type': setpoint_type,
+        'event_outstation': outstation,
+        'repeat_rules': [tuple(rule) for rule in json.loads(repeat_rules)],
+        'schedule_name': schedule_name,
+        'zone_id': zone_id
+    }
+
+
+class SQLiteScheduleStore:
+    # 基于 SQLite 的日程存储，提供与 ScheduleRepository 相同的日程/区域/事件操作。
+    # Building ID、(日程, Zone, 事件)、Outstation 和事件时间上都有索引
+    def __init__(self, db_path, estate_wide_outstations=False):
+        self.db_path = db_path
+        self.estate_wide_outstations = estate_wide_outstations
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def schedule_row(self, schedule_name):
+        row = self.connection.execute('SELECT id FROM schedules WHERE name = ?', (schedule_name,)).fetchone()
+        if row is None:
+            raise ScheduleError(f"Schedule '{schedule_name}' does not exist.")
+        return row[0]
+
+    def zone_row(self, schedule_name, zone_id):
+        schedule_row = self.schedule_row(schedule_name)
+        row = self.connection.execute('SELECT id FROM zones WHERE schedule_id = ? AND zone_id = ?', (schedule_row, zone_id)).fetchone()
+        if row is None:
+            raise ScheduleError(f"No zone found with ID '{zone_id}'.")
+        return schedule_row, row[0]
+
+    def schedule_names(self):
+        return [row[0] for row in self.connection.execute('SELECT name FROM schedules ORDER BY name')]
+
+    def building_id(self, schedule_name):
+        row = self.connection.execute('SELECT building_id FROM schedules WHERE name = ?', (schedule_name,)).fetchone()
+        return row[0] if row is not None else ''
+
+    def find_building(self, building_id):
+        row = self.connection.execute('SELECT name FROM schedules WHERE building_id = ? ORDER BY name LIMIT 1', (building_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def create_schedule(self, schedule_name, building_id, replace=False):
+        owner = self.find_building(building_id)
+        if owner is not None and not (replace and owner == schedule_name):
+            raise ScheduleError(f"{building_id} already exists in {owner}.")
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM schedules WHERE name = ?', (schedule_name,))
+            try:
+                self.connection.execute('INSERT INTO schedules (name, building_id) VALUES (?, ?)', (schedule_name, building_id))
+            except sqlite3.IntegrityError:
+                raise ScheduleError(f'"{schedule_name}" already exists.')
+
+    def delete_schedule(self, schedule_name):
+        with self.connection:
+            self.connection.execute('DELETE FROM schedules WHERE name = ?', (schedule_name,))
+
+    def add_zone(self, schedule_name, zone_name, zone_description=''):
+        schedule_row = self.schedule_row(schedule_name)
+        with self.connection:
+            try:
+                self.connection.execute('INSERT INTO zones (schedule_id, zone_id, description) VALUES (?, ?, ?)', (schedule_row, zone_name, zone_description))
+            except sqlite3.IntegrityError:
+                raise ScheduleError(f"Zone '{zone_name}' already exists.")
+
+    def zones(self, schedule_name):
+        schedule_row = self.schedule_row(schedule_name)
+        rows = self.connection.execute('SELECT zone_id, description FROM zones WHERE schedule_id = ? ORDER BY id', (schedule_row,))
+        return [(zone_id, description if description is not None else 'No description provided') for zone_id, description in rows]
+
+    def zone_ids(self, schedule_name):
+        return [zone_id for zone_id, _ in self.zones(schedule_name)]
+
+    def find_outstation_conflict(self, outstation, schedule_name, zone_id, ignore=None):
+        # 与 ScheduleRepository.find_outstation_conflict 的规则相同，但通过 Outstation 索引查询
+        rows = self.connection.execute('''
+            SELECT s.name, z.zone_id, e.event_id FROM events e
+            JOIN schedules s ON s.id = e.schedule_id JOIN zones z ON z.id = e.zone_row
+            WHERE e.outstation = ? ORDER BY s.name, z.zone_id, e.event_id''', (outstation,))
+        for user in rows:
+            if ignore is not None and user == tuple(ignore):
+                continue
+            if user[0] == schedule_name:
+                if user[1] != zone_id:
+                    return user
+            elif self.estate_wide_outstations:
+                return user
+        return None
+
+    def describe_owner(self, owner, schedule_name):
+        if owner[0] == schedule_name:
+            return owner[1]
+        return f"{owner[1]} of {owner[0]}"
+
+    def event_row(self, schedule_name, zone_id, event_id):
+        schedule_row, zone_row = self.zone_row(schedule_name, zone_id)
+        row = self.connection.execute('SELECT id FROM events WHERE schedule_id = ? AND zone_row = ? AND event_id = ?', (schedule_row, zone_row, event_id)).fetchone()
+        return schedule_row, zone_row, (row[0] if row is not None else None)
+
+    def check_event(self, schedule_name, zone_name, event_name, outstation_identifier, original=None):
+        conflict = self.find_outstation_conflict(outstation_identifier, schedule_name, zone_name, ignore=original)
+        if conflict is not None:
+            raise ScheduleError(f"Outstation Identifier '{outstation_identifier}' is already used in {self.describe_owner(conflict, schedule_name)}.")
+        schedule_row, zone_row, existing = self.event_row(schedule_name, zone_name, event_name)
+        if existing is not None and (original is None or tuple(original) != (schedule_name, zone_name, event_name)):
+            raise ScheduleError(f"{event_name} already exists in {zone_name}.")
+        return schedule_row, zone_row
+
+    def event_values(self, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+        repeat_rules = [list(rule) for rule in repeat_rules or ()]
+        return (event_name, date_time, setpoint_value, setpoint_type, outstation_identifier, str(colour), json.dumps(repeat_rules), 1 if repeat_rules else 0)
+
+    def add_event(self, schedule_name, zone_name, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour):
+        schedule_row, zone_row = self.check_event(schedule_name, zone_name, event_name, outstation_identifier)
+        values = self.event_values(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+        with self.connection:
+            self.connection.execute('''
+                INSERT INTO events (schedule_id, zone_row, event_id, event_time, setpoint_value, setpoint_type, outstation, colour, repeat_rules, recurring)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (schedule_row, zone_row, *values))
+
+    def update_event(self, original, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, schedule_name, zone_name, outstation_identifier, colour):
+        _, _, row = self.event_row(*original)
+        if row is None:
+            raise ScheduleError(f"No event found with ID '{original[2]}' in zone '{original[1]}'.")
+        schedule_row, zone_row = self.check_event(schedule_name, zone_name, event_name, outstation_identifier, original=original)
+        values = self.event_values(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, outstation_identifier, colour)
+        with self.connection:
+            self.connection.execute('''
+                UPDATE events SET schedule_id = ?, zone_row = ?, event_id = ?, event_time = ?, setpoint_value = ?, setpoint_type = ?,
+                outstation = ?, colour = ?, repeat_rules = ?, recurring = ? WHERE id = ?''', (schedule_row, zone_row, *values, row))
+
+    def delete_event(self, schedule_name, zone_id, event_id):
+        _, _, row = self.event_row(schedule_name, zone_id, event_id)
+        if row is None:
+            raise ScheduleError(f"No event found with ID '{event_id}' in zone '{zone_id}'.")
+        with self.connection:
+            self.connection.execute('DELETE FROM events WHERE id = ?', (row,))
+
+    def events(self, schedule_name):
+        rows = self.connection.execute(f'''
+            SELECT {EVENT_COLUMNS} FROM events e
+            JOIN schedules s ON s.id = e.schedule_id JOIN zones z ON z.id = e.zone_row
+            WHERE s.name = ? ORDER BY z.id, e.id''', (schedule_name,))
+        return [event_from_row(row) for row in rows]
+
+    def occurrences(self, schedule_name, start, end):
+        # 单次事件直接用时间索引做范围查询，重复事件只取基准时间早于窗口结束的部分再展开
+        schedule_row = self.schedule_row(schedule_name)
+        start_text = start.strftime('%Y%m%d%H%M')
+        end_text = end.strftime('%Y%m%d%H%M')
+        rows = self.connection.execute(f'''
+            SELECT {EVENT_COLUMNS} FROM events e
+            JOIN schedules s ON s.id = e.schedule_id JOIN zones z ON z.id = e.zone_row
+            WHERE e.schedule_id = ? AND e.recurring = 0 AND e.event_time >= ? AND e.event_time < ?
+            UNION ALL
+            SELECT {EVENT_COLUMNS} FROM events e
+            JOIN schedules s ON s.id = e.schedule_id JOIN zones z ON z.id = e.zone_row
+            WHERE e.schedule_id = ? AND e.recurring = 1 AND e.event_time < ?''', (schedule_row, start_text, end_text, schedule_row, end_text))
+        occurrences = []
+        for row in rows:
+            event = event_from_row(row)
+            for occurrence in iter_occurrences(event['event_time'], event['repeat_rules'], start, end):
+                occurrences.append((occurrence, event))
+        occurrences.sort(key=lambda item: item[0])
+        return occurrences
+
+    def week(self, schedule_name, week_start):
+        week_start = week_start_of(week_start)
+        start = datetime(week_start.year, week_start.month, week_start.day)
+        return self.occurrences(schedule_name, start, start + timedelta(days=7))
+
+    def import_xml(self, schedules_dir):
+        # 导入 Schedules/*.xml，已存在的同名日程会被替换。日志模式下尚未合并的修改先重放到树上，
+        # 导入的内容与界面中看到的一致。某个文件无法导入时抛出 ScheduleError，该文件不写入任何数据
+        imported = []
+        for path in sorted(glob.glob(os.path.join(schedules_dir, '*.xml'))):
+            with span('xml.parse'):
+                root = ET.parse(path).getroot()
+                replay_journal(path, root)
+            schedule_name = root.get('name') or os.path.splitext(os.path.basename(path))[0]
+            building = root.find('building')
+            with self.connection:
+                self.connection.execute('DELETE FROM schedules WHERE name = ?', (schedule_name,))
+                cursor = self.connection.execute('INSERT INTO schedules (name, building_id) VALUES (?, ?)', (schedule_name, building.get('ID', '') if building is not None else ''))
+                schedule_row = cursor.lastrowid
+                for zone in building.findall('zone') if building is not None else ():
+                    try:
+                        cursor = self.connection.execute('INSERT INTO zones (schedule_id, zone_id, description) VALUES (?, ?, ?)', (schedule_row, zone.get('ID'), zone.get('description')))
+                    except sqlite3.IntegrityError as e:
+                        raise ScheduleError(f"Cannot import zone '{zone.get('ID')}' from {os.path.basename(path)}: {e}.")
+                    zone_row = cursor.lastrowid
+                    for event in zone.findall('event'):
+                        setpoint = event.find('setpoint')
+                        repeat_rules = []
+                        for rrule in event.findall('rrule'):
+                            repeat = rrule.find('repeat')
+                            exc_days = [exc_day.text.strip().strip('"') for exc_day in rrule.findall('excDay')]
+                            repeat_rules.append((repeat.get('type'), repeat.get('specifier'), *exc_days))
+                        date_time = parse_event_time(event.find('eventTime').text).strftime('%Y%m%d%H%M')
+                        values = self.event_values(event.get('ID'), date_time, setpoint.get('value'), setpoint.get('type'), repeat_rules, event.get('outstation'), event.get('colour', '(255, 255, 255)'))
+                        try:
+                            self.connection.execute('''
+                                INSERT INTO events (schedule_id, zone_row, event_id, event_time, setpoint_value, setpoint_type, outstation, colour, repeat_rules, recurring)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (schedule_row, zone_row, *values))
+                        except sqlite3.IntegrityError as e:
+                            raise ScheduleError(f"Cannot import event '{event.get('ID')}' of zone '{zone.get('ID')}' from {os.path.basename(path)}: {e}.")
+            imported.append(schedule_name)
+        return imported
+
+    def export_xml(self, schedules_dir):
+        # 按原有的 Schedules/*.xml 格式导出所有日程
+        if not os.path.isdir(schedules_dir):
+            os.makedirs(schedules_dir)
+        exported = []
+        for schedule_name in self.schedule_names():
+            schedule = ET.Element('schedule', name=schedule_name)
+            building = ET.SubElement(schedule, 'building', ID=self.building_id(schedule_name))
+            zone_elements = {}
+            rows = self.connection.execute('SELECT zone_id, description FROM zones WHERE schedule_id = ? ORDER BY id', (self.schedule_row(schedule_name),))
+            for zone_id, description in rows:
+                zone_elements[zone_id] = ET.SubElement(building, 'zone', ID=zone_id)
+                if description is not None:
+                    zone_elements[zone_id].set('description', description)
+            for event in self.events(schedule_name):
+                zone_elements[event['zone_id']].append(build_event_element(
+                    event['event_name'], event['event_time'].strftime('%Y%m%d%H%M'), event['setpoint_value'], event['setpoint_type'],
+                    event['repeat_rules'], event['event_outstation'], event['event_colour']))
+            filename = os.path.join(schedules_dir, f'{schedule_name}.xml')
+            with span('xml.write'):
+                ET.ElementTree(schedule).write(filename, encoding='utf-8', xml_declaration=True)
+            exported.append(filename)
+        return exported
@@ -1,41 +1,269 @@
-from PySide6.QtWidgets import QVBoxLayout, QWidget,  QPushButton
-from PySide6.QtWidgets import QTableWidget, QTableWidgetItem
-from PySide6.QtCore import QDate
-from datetime import datetime
-import xml.etree.ElementTree as ET
+from PySide6.QtWidgets import QVBoxLayout, QWidget, QTableView, QStyledItemDelegate, QAbstractItemView, QMessageBox
+from PySide6.QtCore import Qt, QDate, QAbstractTableModel, QModelIndex, QEvent, QRect, Signal
+from PySide6.QtGui import QColor, QPen, QPainter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bisect import insort
+import heapq
+import weakref
+import os
 
+from test_background import BackgroundLoader
 from test_event_infor import EventInfor
+from test_recurrence import event_key, iter_occurrences
+from test_schedule_store import schedule_repository
+from test_week_cache import week_cache
+from test_profiling import span
 
-class WeeklyScheduleView(QWidget):  
+# 单元格中事件色块的尺寸
+CHIP_HEIGHT = 26
+CHIP_SPACING = 4
+CHIP_MARGIN = 6
+DEFAULT_ROW_HEIGHT = 40
+COLUMN_WIDTH = 151
+
+# 叠加显示时色块左侧标识日程的色条宽度，以及各日程依次使用的颜色
+LANE_WIDTH = 5
+LANE_COLOURS = [(31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+                (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207)]
+# 叠加显示时并行读取和展开日程的线程数
+OVERLAY_WORKERS = 4
+
+# 单元格中的 (发生时间, 事件) 列表
+EVENTS_ROLE = Qt.UserRole + 1
+
+overlay_pool = ThreadPoolExecutor(max_workers=OVERLAY_WORKERS)
+
+colour_cache = {}
+
+
+def parse_colour(text):
+    # 将 '(255, 255, 255)' 形式的颜色字符串转换为 QColor，同样的颜色只转换一次
+    colour = colour_cache.get(text)
+    if colour is None:
+        try:
+            colour = QColor(*(int(v) for v in text.strip().strip('()').split(',')))
+        except (AttributeError, TypeError, ValueError):
+            colour = QColor(255, 255, 255)
+        colour_cache[text] = colour
+    return colour
+
+
+def merge_layouts(layouts):
+    # 每个日程的单元格已按发生时间排序，逐个单元格用 heapq.merge 合并，不再整体重新排序；
+    # 时间相同的事件按日程的选择顺序排列
+    cells = {}
+    for cell in set().union(*layouts):
+        streams = [layout[cell] for layout in layouts if cell in layout]
+        if len(streams) == 1:
+            cells[cell] = list(streams[0])
+        else:
+            cells[cell] = list(heapq.merge(*streams, key=lambda item: item[0]))
+    return cells
+
+
+class WeeklyScheduleModel(QAbstractTableModel):
+    # 一周的时间线：24 行（小时）× 7 列（星期），每个单元格保存该小时内发生的事件
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.week_start = QDate.currentDate()
+        self.cells = {}
+        # 叠加显示时日程名称 -> 色条颜色，单个日程时为空
+        self.lane_colours = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 24
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 7
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == EVENTS_ROLE:
+            return self.cells.get((index.row(), index.column()), ())
+        if role == Qt.ToolTipRole:
+            events = self.cells.get((index.row(), index.column()))
+            if events and self.lane_colours:
+                return '\n'.join(f"{event['schedule_name']}: {event['event_name']} {occurrence.strftime('%H:%M')}" for occurrence, event in events)
+            if events:
+                return '\n'.join(f"{event['event_name']} {occurrence.strftime('%H:%M')}" for occurrence, event in events)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            day_date = self.week_start.addDays(section)
+            return f'{day_date.toString("ddd")}\n{day_date.toString("dd/MM")}'
+        return f'{section:02d}:00'
+
+    def set_week(self, week_start):
+        # 更换显示的周，同时清空事件
+        self.beginResetModel()
+        self.week_start = week_start
+        self.cells = {}
+        self.endResetModel()
+
+    def set_cells(self, cells):
+        self.beginResetModel()
+        self.cells = cells
+        self.endResetModel()
+
+    def clear_events(self):
+        self.set_cells({})
+
+    def set_lanes(self, schedule_names):
+        self.lane_colours = {name: QColor(*LANE_COLOURS[i % len(LANE_COLOURS)]) for i, name in enumerate(schedule_names)}
+
+    def lane_colour(self, event):
+        return self.lane_colours.get(event['schedule_name'])
+
+    def cell_changed(self, cell):
+        index = self.index(*cell)
+        self.dataChanged.emit(index, index)
+
+    def remove_event(self, event, start, end):
+        # 从 [start, end) 内的单元格中移除该事件的所有发生时间，返回受影响的行。
+        # 叠加显示时不同日程中可能有同名的事件，因此按 (日程, Zone, 事件) 匹配
+        key = (event['schedule_name'],) + event_key(event)
+        rows = set()
+        for occurrence in iter_occurrences(event['event_time'], event['repeat_rules'], start, end):
+            cell = (occurrence.hour, occurrence.weekday())
+            events = self.cells.get(cell)
+            if not events:
+                continue
+            remaining = [item for item in events if (item[1]['schedule_name'],) + event_key(item[1]) != key]
+            if len(remaining) != len(events):
+                if remaining:
+                    self.cells[cell] = remaining
+                else:
+                    del self.cells[cell]
+                self.cell_changed(cell)
+                rows.add(cell[0])
+        return rows
+
+    def add_event(self, event, start, end):
+        # 将该事件在 [start, end) 内的发生时间按时间顺序插入对应的单元格，返回受影响的行
+        rows = set()
+        for occurrence in iter_occurrences(event['event_time'], event['repeat_rules'], start, end):
+            cell = (occurrence.hour, occurrence.weekday())
+            insort(self.cells.setdefault(cell, []), (occurrence, event), key=lambda item: item[0])
+            self.cell_changed(cell)
+            rows.add(cell[0])
+        return rows
+
+    def row_height(self, row):
+        # 容纳该行中事件最多的单元格所需的高度
+        count = max(len(self.cells.get((row, column), ())) for column in range(7))
+        return max(DEFAULT_ROW_HEIGHT, count * (CHIP_HEIGHT + CHIP_SPACING) - CHIP_SPACING + CHIP_MARGIN * 2)
+
+
+class EventChipDelegate(QStyledItemDelegate):
+    # 直接绘制单元格中的事件色块，并根据点击位置找到被点击的事件
+    event_clicked = Signal(object)
+
+    def chip_rect(self, cell_rect, position):
+        top = cell_rect.top() + CHIP_MARGIN + position * (CHIP_HEIGHT + CHIP_SPACING)
+        return QRect(cell_rect.left() + CHIP_MARGIN, top, cell_rect.width() - CHIP_MARGIN * 2, CHIP_HEIGHT)
+
+    def chip_at(self, cell_rect, point):
+        # 返回点击位置对应的色块序号，点在色块之间或之外时返回 None
+        offset = point.y() - cell_rect.top() - CHIP_MARGIN
+        if offset < 0 or not CHIP_MARGIN <= point.x() - cell_rect.left() <= cell_rect.width() - CHIP_MARGIN:
+            return None
+        position, remainder = divmod(offset, CHIP_HEIGHT + CHIP_SPACING)
+        if remainder >= CHIP_HEIGHT:
+            return None
+        return position
+
+    def paint(self, painter, option, index):
+        events = index.data(EVENTS_ROLE)
+        if not events:
+            return
+        with span('timeline.paint'):
+            self.paint_chips(painter, option, index, events)
+
+    def paint_chips(self, painter, option, index, events):
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        for position, (occurrence, event) in enumerate(events):
+            rect = self.chip_rect(option.rect, position)
+            if rect.top() >= option.rect.bottom():
+                break
+            painter.setPen(QPen(QColor(160, 160, 160)))
+            painter.setBrush(parse_colour(event['event_colour']))
+            painter.drawRoundedRect(rect, 3, 3)
+            # 叠加显示时在色块左侧画出所属日程的色条
+            lane_colour = index.model().lane_colour(event)
+            if lane_colour is not None:
+                painter.setPen(Qt.NoPen)
+                painter.setBrush(lane_colour)
+                painter.drawRoundedRect(QRect(rect.left(), rect.top(), LANE_WIDTH, rect.height()), 2, 2)
+            # 格式化时间显示为HH:MM
+            text = f"{event['event_name']} {occurrence.strftime('%H:%M')}"
+            text = option.fontMetrics.elidedText(text, Qt.ElideRight, rect.width() - 8)
+            painter.setPen(QColor(0, 0, 0))
+            painter.drawText(rect, Qt.AlignCenter, text)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            events = index.data(EVENTS_ROLE)
+            position = self.chip_at(option.rect, event.position().toPoint())
+            if events and position is not None and position < len(events):
+                self.event_clicked.emit(events[position][1])
+                return True
+        return super().editorEvent(event, model, option, index)
+
+
+class WeeklyScheduleView(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.schedule_path = None
+        self.schedule_name = None
+        # 叠加显示的日程文件路径，以及当前显示的所有日程名称
+        self.overlay_paths = []
+        self.schedule_names = set()
         self.initUI()
         self.event_infor = EventInfor(self)
+        self.loader = BackgroundLoader(self)
+        # 事件修改后只更新受影响的单元格，不再重新加载整周。仓库只持有弱引用，视图销毁时取消监听
+        listener = weakref.WeakMethod(self.applyEventChange)
+        schedule_repository.event_listeners.append(listener)
+
+        def unregister():
+            if listener in schedule_repository.event_listeners:
+                schedule_repository.event_listeners.remove(listener)
+        self.destroyed.connect(unregister)
 
     def initUI(self):
         # 创建一个表格，行数为24，代表24小时，列数为7，代表一周七天
-        self.tableWidget = QTableWidget(24, 7)  # 24小时，7天
+        self.model = WeeklyScheduleModel(self)
+        self.tableView = QTableView()
+        self.tableView.setModel(self.model)
+        self.tableView.setSelectionMode(QAbstractItemView.NoSelection)
+        self.tableView.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        # 事件由委托直接绘制，不再为每个事件创建按钮
+        self.delegate = EventChipDelegate(self.tableView)
+        self.delegate.event_clicked.connect(self.handle_chip_click)
+        self.tableView.setItemDelegate(self.delegate)
 
         # 设置表头为一周的每一天和日期
         self.updateTableHeaders()
 
         # 设置布局
         layout = QVBoxLayout()
-        layout.addWidget(self.tableWidget)
+        layout.addWidget(self.tableView)
 
         # 设置时间线视图的布局
-        self.setLayout(layout)  
-
-        # 填充表格数据
-        self.populateSchedule()
+        self.setLayout(layout)
 
     def setWeekFromDate(self, date):
-        # 清空当前的表头
-        self.tableWidget.clear()
-        # 重新设置表头
+        # 重新设置表头，同时清空当前的事件
         self.updateTableHeaders(date)
-        # 填充表格数据
-        self.populateSchedule()
+        self.resetRowHeights()
 
     def updateTableHeaders(self, base_date=None):
         # 如果没有提供基准日期，则使用当前日期
@@ -44,128 +272,135 @@ class WeeklyScheduleView(QWidget):
         # 确保传入的是一个QDate对象
         if isinstance(base_date, datetime):
             base_date = QDate(base_date.year, base_date.month, base_date.day)
-        
-        # 获取基准日期所在周的星期一
+
+        # 获取基准日期所在周的星期一，表头由模型根据该日期生成
         start_of_week = base_date.addDays(-base_date.dayOfWeek() + 1)
-        
-        # 设置水平头标签
+        self.model.set_week(start_of_week)
         for i in range(7):
-            self.tableWidget.setColumnWidth(i, 151)
-            self.tableWidget.setRowHeight(i, 40)
-            day_date = start_of_week.addDays(i)
-            header_label = f'{day_date.toString("ddd")}\n{day_date.toString("dd/MM")}'
-            self.tableWidget.setHorizontalHeaderItem(i, QTableWidgetItem(header_label))
-            
-        # 设置垂直头标签为每个小时
-        for i in range(24):
-            self.tableWidget.setVerticalHeaderItem(i, QTableWidgetItem(f'{i:02d}:00'))
-
-    def populateSchedule(self):
-        # 填充表格的函数，这里只是一个示例
-        for i in range(24):  # 对于每一个小时
-            for j in range(7):  # 对于每一天
-                # 创建一个表格项
-                item = QTableWidgetItem('')
-                # 将表格项添加到表格中
-                self.tableWidget.setItem(i, j, item)
+            self.tableView.setColumnWidth(i, COLUMN_WIDTH)
+
+    def weekStartDate(self):
+        # 当前显示的周的星期一
+        return self.model.week_start
 
     def loadEventsFromXML(self, schedule_file_path, week_start_date):
         # 清除之前的事件再加载新的事件
+        if week_start_date != self.model.week_start:
+            self.model.set_week(week_start_date)
+        elif schedule_file_path != self.schedule_path or self.overlay_paths:
+            self.model.clear_events()
+        self.schedule_path = schedule_file_path
+        self.overlay_paths = []
+
+        # 周布局已在缓存中时直接显示，否则在工作线程中解析和展开，结果通过信号送回；
+        # 之前尚未完成的请求随之作废
+        layout = week_cache.peek(schedule_file_path, week_start_date.toPython())
+        if layout is not None:
+            self.loader.cancel()
+            self.showWeek((schedule_repository.schedule_name(schedule_file_path), layout))
+        else:
+            self.loader.submit(self.computeWeek, schedule_file_path, week_start_date.toPython(), on_result=self.showWeek, on_error=self.showLoadError)
+
+    def computeWeek(self, schedule_file_path, week_start):
+        # 在工作线程中执行
+        return schedule_repository.schedule_name(schedule_file_path), week_cache.get(schedule_file_path, week_start)
+
+    def loadOverlay(self, schedule_file_paths, week_start_date):
+        # 叠加显示多个日程：各日程在线程池中并行读取和展开，再合并各自已排序的单元格
+        schedule_file_paths = [os.path.normpath(path) for path in schedule_file_paths]
+        if week_start_date != self.model.week_start:
+            self.model.set_week(week_start_date)
+        elif schedule_file_paths != self.overlay_paths:
+            self.model.clear_events()
+        self.schedule_path = None
+        self.overlay_paths = schedule_file_paths
+
+        week_start = week_start_date.toPython()
+        layouts = [week_cache.peek(path, week_start) for path in schedule_file_paths]
+        if all(layout is not None for layout in layouts):
+            self.loader.cancel()
+            self.showOverlay([(schedule_repository.schedule_name(path), layout) for path, layout in zip(schedule_file_paths, layouts)])
+        else:
+            self.loader.submit(self.computeOverlay, schedule_file_paths, week_start, on_result=self.showOverlay, on_error=self.showLoadError)
+
+    def computeOverlay(self, schedule_file_paths, week_start):
+        # 在工作线程中执行，每个日程交给 overlay_pool 中的一个线程
+        futures = [overlay_pool.submit(self.computeWeek, path, week_start) for path in schedule_file_paths]
+        return [future.result() for future in futures]
+
+    def showOverlay(self, results):
+        self.schedule_name = None
+        self.schedule_names = {schedule_name for schedule_name, _ in results}
+        self.model.set_lanes([schedule_name for schedule_name, _ in results])
+        with span('timeline.merge'):
+            cells = merge_layouts([layout for _, layout in results])
+        with span('timeline.render'):
+            self.model.set_cells(cells)
+
+        for path in self.overlay_paths:
+            week_cache.prefetch_around(path, self.model.week_start.toPython())
+        with span('timeline.render'):
+            self.resetRowHeights()
+
+    def showWeek(self, result):
+        schedule_name, layout = result
+        self.schedule_name = schedule_name
+        self.schedule_names = {schedule_name}
+        self.model.set_lanes([])
+
+        # 本周每个单元格的事件（已按时间排序，已应用 excDay 排除），模型会在增量更新时修改单元格，因此复制一份
+        events_by_cell = {cell: list(events) for cell, events in layout.items()}  # 用于存储每个单元格的事件列表
+        with span('timeline.render'):
+            self.model.set_cells(events_by_cell)
+
+        # 在后台预取相邻的周
+        week_cache.prefetch_around(self.schedule_path, self.model.week_start.toPython())
+
+        # 调整行高以容纳每个单元格中的事件
+        with span('timeline.render'):
+            self.resetRowHeights()
+
+    def showLoadError(self, error):
         self.clearEvents()
-        tree = ET.parse(schedule_file_path)
-        root = tree.getroot()
-        schedule_name = root.get('name')  # Directly use root to get the schedule name
-
-        building = root.find('building')
-        if building is not None:
-
-            # 遍历每个 zone
-            for zone in building.findall('zone'):
-                zone_id = zone.get('ID')
-                events_by_cell = {}  # 用于存储每个单元格的事件列表
-
-                for event in zone.findall('event'):
-                    event_name = event.get('ID')
-                    event_time = event.find('eventTime')
-                    event_setpoint = event.find('setpoint')
-                    event_outstation = event.get('outstation')
-                    event_colour = event.get('colour', '(255, 255, 255)')
-                    date_time_str = event_time.text.strip().strip('"')
-
-                    # 将字符串格式的日期时间转换为datetime对象
-                    date_time = self.parse_datetime_from_string(date_time_str)
-
-                    # 获取setpoint的value和type属性
-                    setpoint_value = event_setpoint.get('value')
-                    setpoint_type = self.convert_setpoint_type(event_setpoint.get('type'))
-
-                    # 解析重复规则
-                    repeat_rules = []
-                    for rrule in event.findall('rrule'):
-                        repeat = rrule.find('repeat')
-                        repeat_type = repeat.get('type')
-                        repeat_specifier = repeat.get('specifier')
-                        exc_days = [exc_day.text.strip().strip('"') for exc_day in rrule.findall('excDay')]
-                        repeat_rules.append((repeat_type, repeat_specifier, *exc_days))
-
-                    # 只加载在当前周显示的事件
-                    if self.isDateInCurrentWeek(date_time.date(), week_start_date):
-                        # 计算事件在网格中的位置
-                        start_index = self.calculatePositionInGrid(date_time, week_start_date)
-
-                        if start_index is not None:
-                            hour, event_day = start_index
-                            # 初始化单元格的事件列表
-                            if (hour, event_day) not in events_by_cell:
-                                events_by_cell[(hour, event_day)] = []
-                            
-                            # 添加事件到列表
-                            events_by_cell[(hour, event_day)].append({
-                                'date_time': date_time,
-                                'event_name': event_name,
-                                'event_colour': event_colour,
-                                'setpoint_value': setpoint_value,
-                                'setpoint_type': setpoint_type,
-                                'event_outstation': event_outstation,
-                                'repeat_rules': repeat_rules
-                            })
-
-                # 遍历每个单元格，按时间排序事件并创建按钮
-                for (hour, event_day), events in events_by_cell.items():
-                    # 按时间排序
-                    events.sort()
-                    widget = self.tableWidget.cellWidget(hour, event_day)
-                    if widget is None:
-                        widget = QWidget()
-                        layout = QVBoxLayout()
-                        widget.setLayout(layout)
-                        self.tableWidget.setCellWidget(hour, event_day, widget)
-
-                    for event_info in events:
-                        # 格式化时间显示为HH:MM
-                        time_display = event_info['date_time'].strftime('%H:%M')
-                        button_text = f"{event_info['event_name']} {time_display}"
-                        button = QPushButton(button_text)
-
-                        # 解析 RGB 字符串并应用颜色
-                        rgb_tuple = eval(event_info['event_colour'])  # 将字符串 '(255, 255, 255)' 转换为元组 (255, 255, 255)
-                        css_color = f"rgb{rgb_tuple}"  # 转换为 CSS 需要的格式
-                        button.setStyleSheet(f"background-color: {css_color}; color: black;")
-                        widget.layout().addWidget(button)
-
-                        # 调整行高以适应新的按钮
-                        required_height = button.sizeHint().height() * widget.layout().count()
-                        current_height = self.tableWidget.rowHeight(hour)
-                        if required_height > current_height:
-                            self.tableWidget.setRowHeight(hour, required_height)
-
-                        # 连接按钮的点击信号到一个槽函数
-                        button.clicked.connect(lambda en=event_info['event_name'], dt=event_info['date_time'], sv=event_info['setpoint_value'], st=event_info['setpoint_type'], rr=event_info['repeat_rules'], sn=schedule_name, zi=zone_id, eo=event_info['event_outstation'], ec=event_info['event_colour']: self.handle_event_click(en, dt, sv, st, rr, sn, zi, eo, ec))
+        QMessageBox.critical(self, "Error", f"Failed to load the schedule file: {error}")
 
-    def calculatePositionInGrid(self, date_time, week_start_date):
-        # 首先将QDate转换为datetime.date对象
-        week_start_date = datetime(week_start_date.year(), week_start_date.month(), week_start_date.day()).date()
+    def applyEventChange(self, kind, old, new):
+        # 在当前显示的周中移除修改前的事件、加入修改后的事件，只调整受影响的行高
+        if self.schedule_path is None and not self.overlay_paths:
+            return
+        if self.loader.is_pending():
+            # 本周仍在加载中，重新加载以包含这次修改
+            self.reloadWeek(self.model.week_start)
+            return
+        week_start = self.model.week_start.toPython()
+        start = datetime(week_start.year, week_start.month, week_start.day)
+        end = start + timedelta(days=7)
+        rows = set()
+        if old is not None and old['schedule_name'] in self.schedule_names:
+            rows |= self.model.remove_event(old, start, end)
+        if new is not None and new['schedule_name'] in self.schedule_names:
+            rows |= self.model.add_event(new, start, end)
+        for row in rows:
+            self.tableView.setRowHeight(row, self.model.row_height(row))
+
+    def followDate(self, date):
+        # 修改后的事件不在当前周时，切换到该事件所在的周
+        week_start_date = date.addDays(-date.dayOfWeek() + 1)
+        if week_start_date != self.model.week_start:
+            self.updateTableHeaders(date)
+            self.reloadWeek(week_start_date)
+
+    def reloadWeek(self, week_start_date):
+        if self.overlay_paths:
+            self.loadOverlay(self.overlay_paths, week_start_date)
+        else:
+            self.updateEventsTimeline(self.schedule_path, week_start_date)
+
+    def resetRowHeights(self):
+        for hour in range(24):
+            self.tableView.setRowHeight(hour, self.model.row_height(hour))
 
+    def calculatePositionInGrid(self, date_time, week_start_date):
         # 计算事件的小时
         hour = date_time.hour  # 正确获取小时数
         # 计算星期几（列的位置），星期一是0，星期二是1，依此类推
@@ -180,28 +415,18 @@ class WeeklyScheduleView(QWidget):
 
     def clearEvents(self):
         # Clear all the events from the table and reset row heights
-        default_row_height = 40
-        for i in range(24):  # For each hour
-            for j in range(7):  # For each day of the week
-                widget = self.tableWidget.cellWidget(i, j)
-                if widget:
-                    # 清除布局中的所有子部件
-                    while widget.layout().count():
-                        child = widget.layout().takeAt(0)
-                        if child.widget():
-                            child.widget().deleteLater()
-                    # 移除现有的widget
-                    self.tableWidget.removeCellWidget(i, j)
-                # 设置一个新的空白QTableWidgetItem
-                self.tableWidget.setItem(i, j, QTableWidgetItem(''))
-            # 重置行高
-            self.tableWidget.setRowHeight(i, default_row_height)
+        self.loader.cancel()
+        self.schedule_path = None
+        self.overlay_paths = []
+        self.schedule_names = set()
+        self.model.clear_events()
+        self.resetRowHeights()
 
     def parse_datetime_from_string(self, date_time_str):
         # 去除所有非数字字符
         date_time_str = ''.join(filter(str.isdigit, date_time_str))
         return datetime.strptime(date_time_str, '%Y%m%d%H%M')
-    
+
     def convert_setpoint_type(self, setpoint_type):
         type_to_description = {
             "lt": "Less Than",
@@ -209,11 +434,15 @@ class WeeklyScheduleView(QWidget):
             "gt": "Greater Than"
         }
         return type_to_description.get(setpoint_type, "Unknown")
-    
+
+    def handle_chip_click(self, ei):
+        # 重复事件打开的是整个系列（基准时间）
+        self.handle_event_click(ei['event_name'], ei['event_time'], ei['setpoint_value'], self.convert_setpoint_type(ei['setpoint_type']), ei['repeat_rules'], ei['schedule_name'], ei['zone_id'], ei['event_outstation'], ei['event_colour'])
+
     def handle_event_click(self, event_name, date_time, setpoint_value, setpoint_type, repeat_rules, event_schedule, event_zone, event_outstation, event_colour):
         # 调用 EventEditor 的方法
         self.event_infor.view_event(event_name, date_time, setpoint_value, setpoint_type, repeat_rules, event_schedule, event_zone, event_outstation, event_colour)
-    
+
     def updateEventsTimeline(self, schedule_path, date):
         # 计算所选日期所在周的周一日期
         week_start_date = date.addDays(-date.dayOfWeek() + 1)
@@ -224,4 +453,4 @@ class WeeklyScheduleView(QWidget):
         else:
             # 如果没有选中的日程，则清空时间线
             self.clearEvents()
-    
\ No newline at end of file
+
@@ -0,0 +1,121 @@
+from datetime import datetime
+
+# 事件和重复规则的校验规则，不依赖界面，界面对话框和批量导入共用。
+# 每个函数返回错误信息，校验通过时返回 None
+
+SETPOINT_TYPES = ('lt', 'eq', 'gt')
+DAY_CODES = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+
+
+def check_numeric(input_value):
+    try:
+        float(input_value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_time_part(part, first_digit_options, second_digit_map):
+    if len(part) != 2:
+        return False
+    first_digit, second_digit = part[0], part[1]
+    valid_second_digits = second_digit_map.get(first_digit, '*')  # 默认允许任何值，如果第一位是星号
+    if (first_digit not in first_digit_options + '*') or (second_digit not in valid_second_digits + '*'):
+        return False
+    return True
+
+
+def validate_year(year):
+    return len(year) == 4 and all(c.isdigit() or c == '*' for c in year)
+
+
+def validate_time_format(year, month, day, hour, minute):
+    if not validate_year(year):
+        return False
+    if not all([len(month) == 2, len(day) == 2, len(hour) == 2, len(minute) == 2]):
+        return False
+    if not validate_time_part(month, '01', {'0': '123456789', '1': '012'}):
+        return False
+    if not validate_time_part(day, '0123', {'0': '123456789', '1': '0123456789', '2': '0123456789', '3': '01'}):
+        return False
+    if not validate_time_part(hour, '012', {'0': '0123456789', '1': '0123456789', '2': '0123'}):
+        return False
+    if not validate_time_part(minute, '012345', {'0': '0123456789', '1': '0123456789', '2': '0123456789', '3': '0123456789', '4': '0123456789', '5': '0123456789'}):
+        return False
+    return True
+
+
+def parse_time(text):
+    # 'YYYYMMDDhhmm' 格式的具体时间，无效时返回 None
+    if len(text) != 12 or not text.isdigit():
+        return None
+    try:
+        return datetime.strptime(text, '%Y%m%d%H%M')
+    except ValueError:
+        return None
+
+
+def validate_excluded_times(excluded_times):
+    for excluded_time in excluded_times:
+        if parse_time(excluded_time) is None:
+            return f"Invalid Excluded Time '{excluded_time}'."
+    if len(excluded_times) != len(set(excluded_times)):
+        return "There is a duplicate Excluded Time, save failed."
+    return None
+
+
+def validate_day_specifier(specifier, excluded_times=()):
+    # 与 DaySpecifierDialog.attempt_accept 相同的规则
+    days = [day.strip() for day in (specifier or '').split(',') if day.strip()]
+    if not days:
+        return "You have not set the Day Specifier, save failed."
+    for day in days:
+        if day not in DAY_CODES:
+            return f"Unknown day '{day}' in day specifier."
+    return validate_excluded_times(excluded_times)
+
+
+def validate_time_specifier(specifier, excluded_times=()):
+    # 与 TimeSpecifierDialog.save_time_format 相同的规则
+    if not specifier:
+        return "You have not set the Time Specifier, save failed."
+    if specifier.count('*') == 12:
+        return "The time format cannot be all '*'. Please specify at least one part."
+    if len(specifier) != 12:
+        return "Each part of the time format must be fully filled. Please correct your entries."
+    if not validate_time_format(specifier[0:4], specifier[4:6], specifier[6:8], specifier[8:10], specifier[10:12]):
+        return "Invalid date or time format."
+    error = validate_excluded_times(excluded_times)
+    if error:
+        return error
+    if specifier.isdigit() and excluded_times:
+        return "Exclusion time cannot be set for specific time repetitions."
+    return None
+
+
+def validate_repeat_rule(rule):
+    rule_type, specifier, *excluded_times = rule
+    if rule_type == 'day':
+        return validate_day_specifier(specifier, excluded_times)
+    if rule_type == 'time':
+        return validate_time_specifier(specifier, excluded_times)
+    return f"Unknown repeat rule type '{rule_type}'."
+
+
+def validate_event(event_name, setpoint_value, setpoint_type, zone_name, outstation_identifier):
+    # 与 EventDialog.saveEvent / EventEditDialog.saveEvent 相同的检查和提示
+    if not event_name:
+        return "Event name cannot be empty."
+    if not setpoint_value:
+        return "Setpoint Value cannot be empty."
+    if not check_numeric(setpoint_value):
+        return "Setpoint Value must be a literal numeric value."
+    if not setpoint_type:
+        return "Setpoint Type must be selected."
+    if setpoint_type not in SETPOINT_TYPES:
+        return f"Unknown Setpoint Type '{setpoint_type}'."
+    if not zone_name:
+        return "Zone must be selected."
+    if not outstation_identifier:
+        return "Outstation Identifier cannot be empty."
+    return None
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from datetime import timedelta
+import threading
+import queue
+import os
+
+from test_recurrence import week_start_of
+from test_schedule_store import schedule_repository, schedule_stat_key
+from test_profiling import span
+
+# 周布局缓存的内存上限（字节，按发生时间数量估算）
+WEEK_CACHE_BUDGET = 16 * 1024 * 1024
+# 估算每个布局以及其中每个发生时间占用的内存
+LAYOUT_COST = 2048
+OCCURRENCE_COST = 160
+# 后台预取当前周前后各几周
+PREFETCH_WEEKS = 1
+
+
+def layout_cost(cells):
+    return LAYOUT_COST + OCCURRENCE_COST * sum(len(events) for events in cells.values())
+
+
+class WeekLayoutCache:
+    # 按 (日程, 周一日期, 数据版本) 缓存已经分好单元格的周布局，按最近使用顺序淘汰。
+    # 数据版本为日程文件及其日志的 mtime/size，文件变化后旧布局不会再被命中
+    def __init__(self, repository, budget=WEEK_CACHE_BUDGET):
+        self.repository = repository
+        self.budget = budget
+        self.layouts = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.pending = set()
+        self.worker = None
+        repository.file_listeners.append(self.on_file_changed)
+
+    def key(self, path, week_start):
+        return (os.path.normpath(path), week_start_of(week_start), tuple(schedule_stat_key(path)))
+
+    def build(self, path, week_start):
+        # 将一周内的发生时间按 (小时, 星期) 分到单元格中
+        occurrences = self.repository.week_occurrences(path, week_start)
+        cells = {}
+        with span('timeline.layout'):
+            for occurrence, event in occurrences:
+                cells.setdefault((occurrence.hour, occurrence.weekday()), []).append((occurrence, event))
+        return cells
+
+    def peek(self, path, week_start):
+        # 只查询缓存，未命中时返回 None，由调用者决定在哪个线程中计算
+        key = self.key(path, week_start)
+        with self.lock:
+            cells = self.layouts.get(key)
+            if cells is not None:
+                self.layouts.move_to_end(key)
+                self.hits += 1
+            return cells
+
+    def get(self, path, week_start):
+        key = self.key(path, week_start)
+        with self.lock:
+            cells = self.layouts.get(key)
+            if cells is not None:
+                self.layouts.move_to_end(key)
+                self.hits += 1
+                return cells
+            self.misses += 1
+        cells = self.build(path, key[1])
+        self.store(key, cells)
+        return cells
+
+    def store(self, key, cells):
+        with self.lock:
+            if key in self.layouts:
+                return
+            self.layouts[key] = cells
+            self.size += layout_cost(cells)
+            # 超出内存上限时淘汰最久未使用的布局，至少保留刚放入的这一个
+            while self.size > self.budget and len(self.layouts) > 1:
+                _, old_cells = self.layouts.popitem(last=False)
+                self.size -= layout_cost(old_cells)
+                self.evicted += 1
+
+    def prefetch_around(self, path, week_start):
+        # 在后台计算前后相邻的周，前后翻页时直接从缓存中取出
+        week_start = week_start_of(week_start)
+        for offset in range(1, PREFETCH_WEEKS + 1):
+            for week in (week_start + timedelta(weeks=offset), week_start - timedelta(weeks=offset)):
+                request = (path, week)
+                with self.lock:
+                    if request in self.pending:
+                        continue
+                    self.pending.add(request)
+                self.requests.put(request)
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.prefetch_worker, daemon=True)
+                self.worker.start()
+
+    def prefetch_worker(self):
+        # 预取只是优化：任何一周计算失败都跳过，不能让后台线程退出
+        try:
+            while True:
+                request = self.requests.get()
+                path, week = request
+                try:
+                    key = self.key(path, week)
+                    with self.lock:
+                        cached = key in self.layouts
+                    if not cached:
+                        self.store(key, self.build(path, week))
+                        with self.lock:
+                            self.prefetched += 1
+                except Exception:
+                    pass
+                finally:
+                    with self.lock:
+                        self.pending.discard(request)
+        finally:
+            # 线程意外退出时，下一次 prefetch_around 重新启动它
+            with self.lock:
+                self.worker = None
+
+    def on_file_changed(self, path, removed):
+        # 文件变化后该日程的旧布局不会再被命中，直接释放
+        path = os.path.normpath(path)
+        with self.lock:
+            for key in [key for key in self.layouts if key[0] == path]:
+                self.size -= layout_cost(self.layouts.pop(key))
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'prefetched': self.prefetched,
+                    'evicted': self.evicted, 'layouts': len(self.layouts), 'size': self.size, 'budget': self.budget}
+
+
+week_cache = WeekLayoutCache(schedule_repository)
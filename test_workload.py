@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+import xml.etree.ElementTree as ET
+import argparse
+import random
+import os
+
+from test_schedule_store import build_event_element, SCHEDULES_DIR
+
+DAY_NAMES = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
+# 常见的按天重复组合：工作日、周末、每天，其余为随机组合
+COMMON_DAY_SPECIFIERS = ["Mo, Tu, We, Th, Fr", "Sa, Su", "Mo, Tu, We, Th, Fr, Sa, Su"]
+SETPOINT_TYPES = ["lt", "eq", "gt"]
+
+
+def random_day_specifier(rng):
+    if rng.random() < 0.7:
+        return rng.choice(COMMON_DAY_SPECIFIERS)
+    days = sorted(rng.sample(range(7), rng.randint(1, 6)))
+    return ", ".join(DAY_NAMES[day] for day in days)
+
+
+def random_time_specifier(rng, event_time):
+    # 按月、按日或按年重复：在事件时间的基础上用 * 替换部分字段
+    choice = rng.randrange(3)
+    text = event_time.strftime('%Y%m%d%H%M')
+    if choice == 0:
+        return '****' + '**' + text[6:]    # 每月同一天同一时间
+    if choice == 1:
+        return '********' + text[8:]       # 每天同一时间
+    return '****' + text[4:]               # 每年同一天同一时间
+
+
+def random_exclusions(rng, event_time, count, weeks):
+    # 排除日期取在生成范围内，与事件时间同一时刻
+    days = rng.sample(range(weeks * 7), min(count, weeks * 7))
+    return [(event_time + timedelta(days=day)).strftime('%Y%m%d%H%M') for day in sorted(days)]
+
+
+def generate_schedule(schedule_name, building_id, zones, events_per_zone, rng, start, weeks,
+                      day_rule_ratio, time_rule_ratio, exclusions):
+    # 生成一个日程文件的 XML 树：每个 Zone 使用一个 Outstation，事件时间分布在 [start, start + weeks) 内
+    schedule = ET.Element('schedule', name=schedule_name)
+    building = ET.SubElement(schedule, 'building', ID=building_id)
+    for zone_number in range(zones):
+        zone_id = f'Zone{zone_number + 1}'
+        zone = ET.SubElement(building, 'zone', ID=zone_id, description=f'Generated zone {zone_number + 1}')
+        outstation = f'{building_id}-OS{zone_number + 1}'
+        for event_number in range(events_per_zone):
+            event_time = start + timedelta(minutes=rng.randrange(weeks * 7 * 24 * 4) * 15)
+            repeat_rules = []
+            draw = rng.random()
+            if draw < day_rule_ratio:
+                rule = ('day', random_day_specifier(rng))
+            elif draw < day_rule_ratio + time_rule_ratio:
+                rule = ('time', random_time_specifier(rng, event_time))
+            else:
+                rule = None
+            if rule is not None:
+                repeat_rules.append((*rule, *random_exclusions(rng, event_time, exclusions, weeks)))
+            setpoint_type = rng.choice(SETPOINT_TYPES)
+            setpoint_value = str(rng.randint(16, 26))
+            colour = str(tuple(rng.randrange(64, 256) for _ in range(3)))
+            zone.append(build_event_element(f'Event{event_number + 1}', event_time.strftime('%Y%m%d%H%M'), setpoint_value,
+                                            setpoint_type, repeat_rules, outstation, colour))
+    return ET.ElementTree(schedule)
+
+
+def generate_estate(schedules_dir=SCHEDULES_DIR, buildings=5, zones=10, events_per_zone=20, day_rule_ratio=0.5,
+                    time_rule_ratio=0.1, exclusions=2, seed=0, start=datetime(2024, 1, 1), weeks=8):
+    # 每个 Building 生成一个日程文件，返回生成的文件路径。同样的参数和种子总是生成同样的文件
+    rng = random.Random(seed)
+    if not os.path.isdir(schedules_dir):
+        os.makedirs(schedules_dir)
+    paths = []
+    for building_number in range(buildings):
+        schedule_name = f'Site{building_number + 1}'
+        tree = generate_schedule(schedule_name, f'B{building_number + 1}', zones, events_per_zone, rng, start, weeks,
+                                 day_rule_ratio, time_rule_ratio, exclusions)
+        path = os.path.join(schedules_dir, f'{schedule_name}.xml')
+        tree.write(path, encoding='utf-8', xml_declaration=True)
+        paths.append(path)
+    return paths
+
+
+def generate_dense_week(schedules_dir=SCHEDULES_DIR, schedules=1, events_per_cell=2, hours=24, start=datetime(2024, 1, 1)):
+    # 用于界面测试：每个日程的每个单元格（小时 × 星期）中正好有 events_per_cell 个事件，
+    # 每个事件按天每天重复，因此任何一周的显示都相同
+    if not os.path.isdir(schedules_dir):
+        os.makedirs(schedules_dir)
+    paths = []
+    for schedule_number in range(schedules):
+        schedule_name = f'Dense{schedule_number + 1}'
+        schedule = ET.Element('schedule', name=schedule_name)
+        building = ET.SubElement(schedule, 'building', ID=f'D{schedule_number + 1}')
+        zone = ET.SubElement(building, 'zone', ID='Zone1', description='Generated zone 1')
+        for hour in range(hours):
+            for position in range(events_per_cell):
+                event_time = start + timedelta(hours=hour, minutes=position * 60 // events_per_cell)
+                zone.append(build_event_element(f'Event{hour:02d}{position:02d}', event_time.strftime('%Y%m%d%H%M'), '21', 'eq',
+                                                [('day', 'Mo, Tu, We, Th, Fr, Sa, Su')], f'D{schedule_number + 1}-OS1', '(180, 210, 255)'))
+        path = os.path.join(schedules_dir, f'{schedule_name}.xml')
+        ET.ElementTree(schedule).write(path, encoding='utf-8', xml_declaration=True)
+        paths.append(path)
+    return paths
+
+
+def add_workload_arguments(parser):
+    parser.add_argument('--buildings', type=int, default=5, help='number of schedule files (one building each)')
+    parser.add_argument('--zones', type=int, default=10, help='zones per building')
+    parser.add_argument('--events', type=int, default=20, help='events per zone')
+    parser.add_argument('--day-rules', type=float, default=0.5, help='fraction of events with a day specifier')
+    parser.add_argument('--time-rules', type=float, default=0.1, help='fraction of events with a time specifier')
+    parser.add_argument('--exclusions', type=int, default=2, help='excDay entries per repeat rule')
+    parser.add_argument('--weeks', type=int, default=8, help='number of weeks the event times are spread over')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def workload_parameters(args):
+    return {
+        'buildings': args.buildings,
+        'zones': args.zones,
+        'events_per_zone': args.events,
+        'day_rule_ratio': args.day_rules,
+        'time_rule_ratio': args.time_rules,
+        'exclusions': args.exclusions,
+        'weeks': args.weeks,
+        'seed': args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic schedule files for benchmarking.')
+    parser.add_argument('--output', default=SCHEDULES_DIR, help='directory to write the schedule files to')
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+    paths = generate_estate(args.output, **workload_parameters(args))
+    total = args.buildings * args.zones * args.events
+    print(f"Generated {len(paths)} schedule(s) with {total} events in {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QDialogButtonBox
 from PySide6.QtWidgets import QMessageBox, QHBoxLayout, QPushButton, QWidget
 from PySide6.QtCore import Signal, Qt
-import xml.etree.ElementTree as ET
 import os
 
+from test_schedule_store import schedule_repository, ScheduleError
+
 class ListItemWidget(QWidget):
     removed = Signal(str)  # 用于发出信号，传递被删除的日程名称
     add_zone = Signal(str)  # 发出信号，传递要添加Zone的Schedule文件路径
@@ -50,7 +51,7 @@ class ListItemWidget(QWidget):
         response = QMessageBox.question(self, 'Remove Schedule', f'Are you sure you want to remove "{self.label.text()}"?', QMessageBox.Yes | QMessageBox.No)
         if response == QMessageBox.Yes:
             try:
-                os.remove(self.schedule_file)  # 删除文件
+                schedule_repository.remove(self.schedule_file)  # 删除文件
                 self.removed.emit(self.label.text())  # 发出信号，传递日程名称
             except Exception as e:
                 QMessageBox.critical(self, 'Remove Failed', str(e))
@@ -62,13 +63,11 @@ class ListItemWidget(QWidget):
   
     def showScheduleDetails(self):
         try:
-            tree = ET.parse(self.schedule_file)
-            root = tree.getroot()
-            building = root.find('.//building')
+            building = schedule_repository.building(self.schedule_file)
             if building is None:
                 QMessageBox.critical(self, "Error", "No building element found in the schedule.")
                 return  # 如果没有找到 building 元素，直接返回，不打开对话框
-            zones = building.findall('.//zone')
+            zones = schedule_repository.zones(self.schedule_file)
             if not zones:  # 检查是否存在 zone 元素
                 QMessageBox.critical(self, "Error", "No zones found in the building.")
                 return  # 如果没有找到 zone 元素，直接返回，不打开对话框
@@ -117,29 +116,12 @@ class CreateZoneDialog(QDialog):
         self.saveZoneToXML(zone_name, zone_description)
 
     def saveZoneToXML(self, zone_name, zone_description):
-        if not os.path.exists(self.schedule_file):
-            QMessageBox.critical(self, "Error", "Schedule file does not exist.")
-            return
-
-        tree = ET.parse(self.schedule_file)
-        root = tree.getroot()
-        building = root.find('.//building')
-
-        if building is None:
-            QMessageBox.critical(self, "Error", "No building element found in the schedule.")
-            return
-
-        # 检查当前building下是否已有相同名称的zone
-        existing_zone = building.find(f".//zone[@ID='{zone_name}']")
-        if existing_zone is not None:
-            QMessageBox.critical(self, "Error", f"Zone '{zone_name}' already exists.")
+        schedule_name = os.path.splitext(os.path.basename(self.schedule_file))[0]
+        try:
+            schedule_repository.add_zone(schedule_name, zone_name, zone_description)
+        except ScheduleError as e:
+            QMessageBox.critical(self, "Error", str(e))
             return
-
-        # 如果没有找到同名的Zone，则创建新的Zone
-        new_zone = ET.SubElement(building, 'zone', ID=zone_name)
-        new_zone.set('description', zone_description)
-
-        tree.write(self.schedule_file, encoding='utf-8', xml_declaration=True)
         self.accept()
 
 class ScheduleDetailsDialog(QDialog):
@@ -162,13 +144,9 @@ class ScheduleDetailsDialog(QDialog):
 
     def loadZones(self):
         try:
-            tree = ET.parse(self.schedule_file)
-            root = tree.getroot()
-            building = root.find('.//building')
-            if building:
-                for zone in building.findall('.//zone'):
-                    zone_id = zone.get('ID')
-                    zone_desc = zone.get('description', 'No description provided')
+            building = schedule_repository.building(self.schedule_file)
+            if building is not None:
+                for zone_id, zone_desc in schedule_repository.zones(self.schedule_file):
                     label = QLabel(f'Zone Name: {zone_id}\nZone Description: {zone_desc}')
                     self.zone_list.addWidget(label)
             else:
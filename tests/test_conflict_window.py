@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+
+from test_conflicts import candidate_event, conflicts_for_event, estate_report
+from test_schedule_store import ScheduleRepository
+from test_workload import generate_estate
+
+EVERY_DAY = ('day', 'Mo, Tu, We, Th, Fr, Sa, Su')
+
+
+def test_old_recurring_event_conflicts_this_week(tmp_path):
+    schedules_dir = str(tmp_path / 'Schedules')
+    generate_estate(schedules_dir, buildings=1, zones=1, events_per_zone=0)
+    repository = ScheduleRepository(schedules_dir)
+    repository.add_event('Site1', 'Zone1', 'Heat', '202401091200', '22', 'gt', [], 'OS1', '(1, 2, 3)')
+    repository.add_event('Site1', 'Zone1', 'Cool', '202001061200', '20', 'lt', [EVERY_DAY], 'OS1', '(1, 2, 3)')
+    now = datetime(2024, 1, 8, 9, 30)
+
+    # 编辑起始时间早于检查范围的重复事件
+    edited = candidate_event('Site1', 'Zone1', 'Cool', '202001061200', '18', 'lt', [EVERY_DAY], 'OS1', '(1, 2, 3)')
+    conflicts = conflicts_for_event(repository, edited, ignore=('Site1', 'Zone1', 'Cool'), now=now)
+
+    start = now.replace(hour=0, minute=0)
+    assert len(conflicts) == len(estate_report(repository, start, start + timedelta(days=28))) == 1
+    assert conflicts[0]['start'] == datetime(2024, 1, 9, 12, 0)
@@ -0,0 +1,45 @@
+from datetime import datetime
+import asyncio
+import socket
+
+from test_outstation_dispatcher import OutstationDispatcher
+
+
+def unresponsive_gateway():
+    # 监听但从不 accept 的网关：积压队列填满后，新的连接请求得不到任何应答
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(0)
+    backlog = []
+    for _ in range(3):
+        client = socket.socket()
+        client.setblocking(False)
+        try:
+            client.connect(server.getsockname())
+        except BlockingIOError:
+            pass
+        backlog.append(client)
+    return server, backlog
+
+
+def test_connect_timeout_is_retried_then_reported():
+    server, backlog = unresponsive_gateway()
+    port = server.getsockname()[1]
+
+    async def dispatch():
+        dispatcher = OutstationDispatcher(lambda outstation: ('127.0.0.1', port), max_retries=2, retry_delay=0.01, connect_timeout=0.2)
+        await dispatcher.start()
+        await dispatcher.submit({'zone_id': 'Zone1', 'event_name': 'Event1', 'schedule_name': 'Site1', 'setpoint_type': 'gt',
+                                 'setpoint_value': '20', 'fire_time': datetime(2024, 1, 8, 12, 0), 'outstation': 'OS1'})
+        await asyncio.wait_for(dispatcher.close(), 10)
+        return dispatcher
+
+    try:
+        dispatcher = asyncio.run(dispatch())
+    finally:
+        for client in backlog:
+            client.close()
+        server.close()
+    assert dispatcher.stats['retries'] == 2
+    assert dispatcher.stats['failed_commands'] == 1
+    assert 'timed out' in dispatcher.failures[0][2]
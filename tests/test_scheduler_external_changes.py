@@ -0,0 +1,37 @@
+from datetime import datetime
+import time
+
+from test_schedule_store import ScheduleRepository
+from test_setpoint_scheduler import SetpointScheduler
+from test_workload import generate_estate
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_event_deleted_by_another_repository_does_not_fire(tmp_path):
+    schedules_dir = str(tmp_path / 'Schedules')
+    generate_estate(schedules_dir, buildings=1, zones=1, events_per_zone=0)
+    repository = ScheduleRepository(schedules_dir)
+    for event_name, outstation in (('Keep', 'OS1'), ('Deleted', 'OS2')):
+        repository.add_event('Site1', 'Zone1', event_name, '202401081200', '20', 'gt', [], outstation, '(1, 2, 3)')
+
+    now = [datetime(2024, 1, 8, 11, 0)]
+    dispatched = []
+    scheduler = SetpointScheduler(repository, sink=dispatched.append, clock=lambda: now[0])
+    thread = scheduler.start()
+    try:
+        # 另一个进程（界面或命令行）中的仓库删除事件，本进程的监听者收不到通知
+        ScheduleRepository(schedules_dir).delete_event('Site1', 'Zone1', 'Deleted')
+        now[0] = datetime(2024, 1, 8, 12, 5)
+        with scheduler.condition:
+            scheduler.condition.notify()
+        assert wait_for(lambda: dispatched)
+    finally:
+        scheduler.stop()
+        thread.join(5)
+    assert [dispatch['event_name'] for dispatch in dispatched] == ['Keep']
@@ -0,0 +1,30 @@
+import os
+import tracemalloc
+
+from test_schedule_store import stream_events
+from test_workload import generate_estate
+
+
+def peak_streaming_memory(path):
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in stream_events(path))
+        return count, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_stream_events_memory_does_not_grow_with_events_per_zone(tmp_path):
+    paths = {}
+    for events_per_zone in (1000, 10000):
+        schedules_dir = str(tmp_path / f'Schedules{events_per_zone}')
+        generate_estate(schedules_dir, buildings=1, zones=1, events_per_zone=events_per_zone)
+        paths[events_per_zone] = os.path.join(schedules_dir, 'Site1.xml')
+    # 先读一次，排除首次解析规则等一次性的缓存
+    peak_streaming_memory(paths[1000])
+
+    small_count, small_peak = peak_streaming_memory(paths[1000])
+    large_count, large_peak = peak_streaming_memory(paths[10000])
+    assert (small_count, large_count) == (1000, 10000)
+    # 十倍的事件数量，峰值内存基本不变
+    assert large_peak < small_peak * 2